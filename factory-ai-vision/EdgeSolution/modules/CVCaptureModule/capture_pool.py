@@ -0,0 +1,84 @@
+"""Capture Pool
+
+A fixed number of worker threads shared by all cameras. A camera is a job
+that the pool calls when it is due: the job grabs one frame, or tries to
+reconnect, and returns the seconds until it is due again. A job runs on one
+worker at a time, so a camera needs no locking of its own.
+"""
+
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+# Decode workers for all cameras, decoding happens in cv2 without the GIL
+CAPTURE_WORKERS = int(os.environ.get("CAPTURE_WORKERS", os.cpu_count() or 4))
+
+logger = logging.getLogger(__name__)
+
+
+class CapturePool:
+    def __init__(self, num_workers=CAPTURE_WORKERS):
+        self.num_workers = max(1, num_workers)
+        self.condition = threading.Condition()
+        # heap of (due time, seq, job), seq keeps jobs of the same time in order
+        self.jobs = []
+        self.seq = itertools.count()
+        self.busy = 0
+        self.average_lag = 0
+
+        for _ in range(self.num_workers):
+            threading.Thread(target=self._run, daemon=True).start()
+        logger.info("Capture pool: %s workers", self.num_workers)
+
+    def add(self, job, delay=0):
+        """Call job in delay seconds.
+
+        Args:
+            job (callable): returns the seconds until it should be called
+                again, None when it is done.
+        """
+        with self.condition:
+            heapq.heappush(self.jobs, (time.time() + delay, next(self.seq), job))
+            self.condition.notify()
+
+    def _next_job(self):
+        with self.condition:
+            while True:
+                if not self.jobs:
+                    self.condition.wait()
+                    continue
+                delay = self.jobs[0][0] - time.time()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                due, _, job = heapq.heappop(self.jobs)
+                self.busy += 1
+                # how late the job starts, all workers busy when it grows
+                lag = (time.time() - due) * 1000
+                self.average_lag = 1 / 16 * lag + 15 / 16 * self.average_lag
+                return job
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            try:
+                delay = job()
+            except Exception:
+                logger.exception("Capture job failed")
+                delay = 1
+            with self.condition:
+                self.busy -= 1
+            if delay is not None:
+                self.add(job, max(0, delay))
+
+    def get_metrics(self):
+        with self.condition:
+            return {
+                "workers": self.num_workers,
+                "busy": self.busy,
+                "jobs": len(self.jobs) + self.busy,
+                "average_lag": self.average_lag,
+            }
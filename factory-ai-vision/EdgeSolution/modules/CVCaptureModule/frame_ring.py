@@ -0,0 +1,85 @@
+"""Frame Ring
+
+Ring of frame slots in a /dev/shm file shared with the InferenceModule.
+Frames are resized straight into a slot and only a small descriptor is
+posted, the InferenceModule maps the same file and reads the frame in place.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from shared_memory import SharedMemoryManager
+
+logger = logging.getLogger(__name__)
+
+
+class FrameRing:
+    """Fixed number of frame slots, allocated with SharedMemoryManager."""
+
+    def __init__(self, cam_id, frame_shape, num_slots):
+        self.frame_shape = tuple(frame_shape)
+        self.frame_size = int(np.prod(self.frame_shape))
+        # SharedMemoryManager leaves a 1 byte gap between slots and may hand
+        # out the end of the file, keep one spare slot of room for that
+        self.size = self.frame_size * (num_slots + 1)
+        # unique per ring, a reader never maps the file of a previous ring
+        self.name = "cvcapture_{}_{}".format(
+            re.sub(r"[^A-Za-z0-9_.-]", "_", str(cam_id)), int(time.time() * 1000)
+        )
+
+        self.mutex = threading.Lock()
+        self.seq = 0
+        self.shm = SharedMemoryManager(
+            os.O_RDWR | os.O_SYNC | os.O_CREAT, name=self.name, size=self.size
+        )
+        self.buf = memoryview(self.shm._shm)
+        logger.info(
+            "Frame ring %s: %s slots of %s bytes", self.name, num_slots, self.frame_size
+        )
+
+    def reserve(self):
+        """Reserve a slot for the next frame.
+
+        Returns:
+            (seq, frame array backed by the slot, offset), or None if every
+            slot is still in use.
+        """
+        with self.mutex:
+            self.seq += 1
+            address = self.shm.GetEmptySlot(self.seq, self.frame_size)
+            if address is None:
+                return None
+            if address[1] >= self.size:
+                self.shm.DeleteSlot(self.seq)
+                return None
+            seq = self.seq
+        frame = np.ndarray(
+            self.frame_shape, dtype=np.uint8, buffer=self.buf, offset=address[0]
+        )
+        return seq, frame, address[0]
+
+    def release(self, seq):
+        with self.mutex:
+            self.shm.DeleteSlot(seq)
+
+    def descriptor(self, seq, offset, timestamp):
+        return {
+            "shm_name": self.name,
+            "shm_size": self.size,
+            "seq": seq,
+            "offset": offset,
+            "shape": list(self.frame_shape),
+            "timestamp": timestamp,
+        }
+
+    def close(self):
+        # the mappings stay valid until the readers drop them
+        try:
+            os.unlink(os.path.join("/dev/shm", self.name))
+        except OSError:
+            pass
@@ -0,0 +1,186 @@
+"""Frame Sender
+
+Posts the frames of a camera to the InferenceModule. All cameras share one
+requests.Session, so frames reuse kept-alive connections instead of opening
+one per request. Each camera has one sender thread with a single frame
+mailbox: the capture thread puts the latest frame and wakes the sender, a
+frame still waiting when the next one comes in is dropped, and at most one
+request per camera is in flight.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Kept-alive connections to the InferenceModule, shared by all cameras
+SEND_POOL_SIZE = int(os.environ.get("SEND_POOL_SIZE", 16))
+# Seconds to wait for the InferenceModule to answer a frame
+SEND_TIMEOUT = float(os.environ.get("SEND_TIMEOUT", 10))
+# Server errors in a row on /predict_shm before going back to http, e.g.
+# the InferenceModule can't open the ring without IpcMode host
+SHM_MAX_FAILURES = int(os.environ.get("SHM_MAX_FAILURES", 10))
+
+logger = logging.getLogger(__name__)
+
+
+def create_session(pool_size=SEND_POOL_SIZE):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class FrameSender:
+    def __init__(self, cam_id, endpoint, session, timeout=SEND_TIMEOUT):
+        self.cam_id = cam_id
+        self.endpoint = endpoint + "/predict?camera_id=" + cam_id
+        self.shm_endpoint = endpoint + "/predict_shm?camera_id=" + cam_id
+        self.session = session
+        self.timeout = timeout
+        # False once /predict_shm kept failing, ring frames go over http
+        self.use_shm = True
+        self.shm_failures = 0
+
+        self.condition = threading.Condition()
+        # (img, ring, slot, timestamp) of the next frame to send
+        self.frame = None
+        self.is_alive = True
+
+        self.total_sent = 0
+        self.total_dropped = 0
+        self.total_failed = 0
+        self.average_send_latency = 0
+        self.last_send = None
+
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def put(self, img, timestamp, ring=None, slot=None):
+        """Make img the next frame to send.
+
+        Args:
+            img: frame to post as raw bytes, when it is not in a ring slot.
+            timestamp (float): capture time of the frame.
+            ring (FrameRing): ring holding the frame, if any.
+            slot ((seq, offset)): slot of the frame in ring, the sender
+                releases it once the frame is sent or dropped.
+        """
+        with self.condition:
+            previous = self.frame
+            self.frame = (img, ring, slot, timestamp)
+            if previous:
+                self.total_dropped += 1
+            self.condition.notify()
+        if previous:
+            self._release(previous)
+
+    def count_dropped(self):
+        """A frame was dropped before reaching the mailbox."""
+        with self.condition:
+            self.total_dropped += 1
+
+    @staticmethod
+    def _release(frame):
+        _, ring, slot, _ = frame
+        if slot:
+            ring.release(slot[0])
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: self.frame is not None or not self.is_alive
+                )
+                if not self.is_alive:
+                    break
+                frame, self.frame = self.frame, None
+            self._send(frame)
+
+        with self.condition:
+            frame, self.frame = self.frame, None
+        if frame:
+            self._release(frame)
+
+    def _send(self, frame):
+        img, ring, slot, timestamp = frame
+        start = time.time()
+        error = None
+        try:
+            is_shm = bool(slot) and self.use_shm
+            if is_shm:
+                seq, offset = slot
+                res = self.session.post(
+                    self.shm_endpoint,
+                    json=ring.descriptor(seq, offset, timestamp),
+                    timeout=self.timeout,
+                )
+            else:
+                res = self.session.post(
+                    self.endpoint, data=img.tobytes(), timeout=self.timeout
+                )
+        except requests.RequestException as e:
+            error = e
+        finally:
+            self._release(frame)
+
+        if error:
+            self.total_failed += 1
+            if self.total_failed % 30 == 1:
+                logger.warning(
+                    "stream {} cannot send frame, failed = {}: {}".format(
+                        self.cam_id, self.total_failed, error
+                    )
+                )
+            # don't spin on a module that is down
+            time.sleep(1)
+            return
+        if is_shm:
+            self._check_shm(res)
+        if not res.ok:
+            # e.g. the stream is not set up yet on the InferenceModule
+            self.total_failed += 1
+            return
+
+        latency = (time.time() - start) * 1000
+        self.average_send_latency = (
+            1 / 16 * latency + 15 / 16 * self.average_send_latency
+        )
+        self.last_send = timestamp
+        self.total_sent += 1
+        if self.total_sent % 30 == 1:
+            logger.warning(
+                "send through channel {} to inference server , count = {}".format(
+                    bytes(self.cam_id, "utf-8"), self.total_sent
+                )
+            )
+
+    def _check_shm(self, res):
+        if res.status_code < 500:
+            self.shm_failures = 0
+            return
+        self.shm_failures += 1
+        if self.shm_failures >= SHM_MAX_FAILURES:
+            logger.warning(
+                "stream %s: /predict_shm failed %s times, sending frames over http",
+                self.cam_id,
+                self.shm_failures,
+            )
+            self.use_shm = False
+
+    def stop(self):
+        with self.condition:
+            self.is_alive = False
+            self.condition.notify_all()
+
+    def get_metrics(self):
+        return {
+            "total_sent": self.total_sent,
+            "total_dropped": self.total_dropped,
+            "total_failed": self.total_failed,
+            "use_shm": self.use_shm,
+            "average_send_latency": self.average_send_latency,
+        }
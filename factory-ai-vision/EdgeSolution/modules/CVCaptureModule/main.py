@@ -35,9 +35,15 @@ async def index():
                 "cam_id": stream.cam_id,
                 "cam_source": stream.cam_source,
                 "fps": stream.fps,
+                "send_metrics": stream.frame_sender.get_metrics(),
+                "capture_metrics": stream.get_capture_metrics(),
             }
         )
-    return {"number_of_streams": number_of_streams, "infos": infos}
+    return {
+        "number_of_streams": number_of_streams,
+        "infos": infos,
+        "capture_pool": stream_manager.capture_pool.get_metrics(),
+    }
 
 
 @app.get("/delete_stream/{stream_id}")
@@ -48,6 +54,15 @@ async def delete_stream(stream_id):
     return "ok"
 
 
+@app.get("/update_fps/{stream_id}")
+async def update_fps(stream_id, fps: float):
+    if not stream_manager.update_fps(stream_id, fps):
+        return "stream not found"
+    logger.info("Update stream {} fps to {}".format(stream_id, fps))
+
+    return "ok"
+
+
 @app.get("/streams/{stream_id}")
 async def read_stream(stream_id):
     return {}
@@ -2,6 +2,8 @@ import logging
 import threading
 
 import zmq
+from capture_pool import CapturePool
+from frame_sender import create_session
 from streams import Stream
 
 # FIXME RON
@@ -17,6 +19,10 @@ class StreamManager(object):
         self.context = None
         self.sender = None
         self._init_zmq()
+        # kept-alive connections to the InferenceModule, for all streams
+        self.session = create_session()
+        # decode workers shared by all streams
+        self.capture_pool = CapturePool()
 
     def _init_zmq(self):
 
@@ -33,7 +39,9 @@ class StreamManager(object):
             return False
 
         # FIXME RON check this
-        stream = Stream(stream_id, rtsp, fps, endpoint, self.sender)
+        stream = Stream(
+            stream_id, rtsp, fps, endpoint, self.sender, self.session, self.capture_pool
+        )
         self.streams[stream_id] = stream
 
     def get_streams(self):
@@ -66,6 +74,13 @@ class StreamManager(object):
 
         return "ok"
 
+    def update_fps(self, stream_id, fps):
+        stream = self.get_stream_by_id(stream_id)
+        if not stream:
+            return False
+        stream.set_fps(fps)
+        return True
+
     def update_streams(self, stream_id):
         self.mutex.acquire()
 
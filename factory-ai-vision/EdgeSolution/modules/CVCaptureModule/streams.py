@@ -7,7 +7,8 @@ import time
 
 import cv2
 import numpy as np
-import requests
+from frame_ring import FrameRing
+from frame_sender import FrameSender
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -15,9 +16,22 @@ logger.setLevel(logging.INFO)
 IMG_WIDTH = 960
 IMG_HEIGHT = 540
 
+# "shm" writes frames into a /dev/shm ring shared with the InferenceModule
+# (both modules need IpcMode host) and posts only a descriptor, "http" posts
+# the raw frame
+FRAME_TRANSPORT = os.environ.get("FRAME_TRANSPORT", "http")
+SHM_RING_SLOTS = int(os.environ.get("SHM_RING_SLOTS", 4))
+# Seconds before reconnecting a source, doubled after each failure up to max
+CAPTURE_BACKOFF_MIN = float(os.environ.get("CAPTURE_BACKOFF_MIN", 1))
+CAPTURE_BACKOFF_MAX = float(os.environ.get("CAPTURE_BACKOFF_MAX", 60))
+# "true" to let cv2 decode on whatever hardware decoder the box has
+CAPTURE_HW_ACCELERATION = os.environ.get("CAPTURE_HW_ACCELERATION", "true")
+
+MAX_SOURCE_FPS = 60
+
 
 class Stream:
-    def __init__(self, cam_id, cam_source, fps, endpoint, sender):
+    def __init__(self, cam_id, cam_source, fps, endpoint, sender, session, capture_pool):
         self.cam_id = cam_id
 
         self.mutex = threading.Lock()
@@ -31,7 +45,15 @@ class Stream:
         #     frameRate = 10
         self.cam = None
         self.fps = max(0.1, fps)
+        # frame rate of the source, 0 until it is opened or if unknown
+        self.cam_fps = 0.0
         self.cam_is_alive = True
+        self.capture_pool = capture_pool
+        self.next_retrieve = 0
+        self.backoff = 0
+        self.total_grabbed = 0
+        self.total_retrieved = 0
+        self.total_reconnects = 0
 
         self.IMG_WIDTH = 960
         self.IMG_HEIGHT = 540
@@ -41,79 +63,111 @@ class Stream:
         self.last_update = None
         self.last_send = None
 
+        self.ring = None
+        self.ring_failed = False
+
         self.zmq_sender = sender
+        # posts the frames over the connections of session
+        self.frame_sender = FrameSender(cam_id, endpoint, session)
         self.start_http()
         # self.start_zmq()
 
     def start_http(self):
-        def _new_streaming(self):
-            cnt = 0
-            endpoint = self.endpoint + "/predict?camera_id=" + self.cam_id
-            if self.cam_source == "0":
-                self.cam = cv2.VideoCapture(0)
-            else:
-                self.cam = cv2.VideoCapture(self.cam_source)
-
-            if self.cam.isOpened():
-                cam_fps = self.cam.get(cv2.CAP_PROP_FPS)
-                if cam_fps > 0.0 and cam_fps < self.fps:
-                    self.fps = cam_fps
-
-            while self.cam_is_alive:
-                cnt += 1
-                is_ok, img = self.cam.read()
-                if is_ok:
-
-                    width = IMG_WIDTH
-                    ratio = IMG_WIDTH / img.shape[1]
-                    height = int(img.shape[0] * ratio + 0.000001)
-                    # if height >= self.IMG_HEIGHT:
-                    #    height = self.IMG_HEIGHT
-                    #    ratio = self.IMG_HEIGHT / img.shape[0]
-                    #    width = int(img.shape[1] * ratio + 0.000001)
-
-                    img = cv2.resize(img, (width, height))
-
-                    self.last_img = img
-                    self.last_update = time.time()
-                    time.sleep(1 / self.fps)
-                    # print(jpg)
-                else:
-                    self.restart_cam()
-                    time.sleep(1)
-
+        # frames are sent by self.frame_sender as soon as they are written
+        self.capture_pool.add(self.capture)
+
+    def open_cam(self):
+        """Open the source, on the hardware decoder when cv2 can pick one."""
+        source = 0 if self.cam_source == "0" else self.cam_source
+        cam = None
+        if CAPTURE_HW_ACCELERATION == "true" and hasattr(cv2, "VIDEO_ACCELERATION_ANY"):
+            try:
+                cam = cv2.VideoCapture(
+                    source,
+                    cv2.CAP_ANY,
+                    [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY],
+                )
+            except cv2.error:
+                cam = None
+        if cam is None or not cam.isOpened():
+            cam = cv2.VideoCapture(source)
+        if source == 0:
+            # devices can scale on their side, ask for the size we send
+            cam.set(cv2.CAP_PROP_FRAME_WIDTH, IMG_WIDTH)
+            cam.set(cv2.CAP_PROP_FRAME_HEIGHT, IMG_HEIGHT)
+        return cam
+
+    def capture(self):
+        """Capture pool job, grab the next frame of the source.
+
+        Every frame is grabbed to keep up with the source, only the frames
+        due at self.fps are retrieved, converted and sent.
+
+        Returns:
+            Seconds until the next frame, None once the stream is deleted.
+        """
+        if not self.cam_is_alive:
             logger.warning("Stream {} finished".format(self.cam_id))
+            if self.cam:
+                self.cam.release()
+            self.frame_sender.stop()
+            if self.ring:
+                self.ring.close()
+            return None
+
+        if self.cam is None:
+            self.cam = self.open_cam()
+            if not self.cam.isOpened():
+                return self.retry_cam()
+            cam_fps = self.cam.get(cv2.CAP_PROP_FPS)
+            if cam_fps > 0.0:
+                self.cam_fps = cam_fps
+            if cam_fps > 0.0 and cam_fps < self.fps:
+                self.fps = cam_fps
+            self.next_retrieve = 0
+
+        start = time.time()
+        if not self.cam.grab():
+            return self.retry_cam()
+        self.backoff = 0
+        self.total_grabbed += 1
+
+        if start >= self.next_retrieve:
+            # no catching up after a stall, the next frame is 1/fps away
+            self.next_retrieve = max(self.next_retrieve + 1 / self.fps, start)
+            is_ok, img = self.cam.retrieve()
+            if is_ok:
+                self.total_retrieved += 1
+                width = IMG_WIDTH
+                ratio = IMG_WIDTH / img.shape[1]
+                height = int(img.shape[0] * ratio + 0.000001)
+                self.write_frame(img, width, height)
+
+        # grab again when the source has the next frame, some RTSP sources
+        # report a bogus frame rate
+        if self.cam_fps > 0.0:
+            interval = 1 / min(self.cam_fps, MAX_SOURCE_FPS)
+        else:
+            interval = 1 / self.fps
+        return interval - (time.time() - start)
+
+    def retry_cam(self):
+        """Drop the source and reconnect after an exponential backoff."""
+        self.backoff = min(CAPTURE_BACKOFF_MAX, max(CAPTURE_BACKOFF_MIN, self.backoff * 2))
+        logger.warning("Restarting Cam {} in {}s".format(self.cam_id, self.backoff))
+        if self.cam:
             self.cam.release()
+        self.cam = None
+        self.total_reconnects += 1
+        return self.backoff
 
-        def run_send(self):
-            endpoint = self.endpoint + "/predict?camera_id=" + self.cam_id
-            cnt = 0
-            while self.cam_is_alive:
-                if self.last_img is None:
-                    logger.warning(
-                        "stream {} img not ready".format(self.cam_id))
-                    time.sleep(1)
-                    continue
-                if self.last_send == self.last_update:
-                    # logger.warning('no new img')
-                    time.sleep(1 / self.fps)
-                    continue
-                cnt += 1
-                if cnt % 30 == 1:
-                    logger.warning(
-                        "send through channel {} to inference server , count = {}".format(
-                            bytes(self.cam_id, "utf-8"), cnt
-                        )
-                    )
-                # data = cv2.imencode(".jpg", self.last_img)[1].tobytes()
-                data = self.last_img.tobytes()
-                res = requests.post(endpoint, data=data)
-                self.last_send = self.last_update
-                time.sleep(1 / self.fps)
-
-        threading.Thread(target=_new_streaming,
-                         args=(self,), daemon=True).start()
-        threading.Thread(target=run_send, args=(self,), daemon=True).start()
+    def get_capture_metrics(self):
+        return {
+            "cam_fps": self.cam_fps,
+            "total_grabbed": self.total_grabbed,
+            "total_retrieved": self.total_retrieved,
+            "total_reconnects": self.total_reconnects,
+        }
 
     def start_zmq(self):
         def run_capture(self):
@@ -177,6 +231,44 @@ class Stream:
         threading.Thread(target=run_capture, args=(self,), daemon=True).start()
         threading.Thread(target=run_send, args=(self,), daemon=True).start()
 
+    def write_frame(self, img, width, height):
+        """Resize img to width x height as the next frame to send.
+
+        With the shm transport the frame is resized straight into a ring
+        slot. If every slot is busy the frame is dropped, a newer one will
+        follow; frames that don't fit the ring, or once the sender gave up
+        on /predict_shm, go over http. The sender releases the slot once the
+        frame is sent or superseded.
+        """
+        shape = (height, width, 3)
+        if FRAME_TRANSPORT == "shm" and self.ring is None and not self.ring_failed:
+            try:
+                self.ring = FrameRing(self.cam_id, shape, SHM_RING_SLOTS)
+            except Exception:
+                logger.exception("Cannot create frame ring, sending frames over http")
+                self.ring_failed = True
+
+        if (
+            self.ring
+            and self.frame_sender.use_shm
+            and self.ring.frame_shape == shape
+        ):
+            slot = self.ring.reserve()
+            if slot is None:
+                self.frame_sender.count_dropped()
+                return
+            seq, frame, offset = slot
+            cv2.resize(img, (width, height), dst=frame)
+            self.last_img = frame
+            self.last_update = time.time()
+            self.frame_sender.put(frame, self.last_update, self.ring, (seq, offset))
+            return
+
+        img = cv2.resize(img, (width, height))
+        self.last_img = img
+        self.last_update = time.time()
+        self.frame_sender.put(img, self.last_update)
+
     def restart_cam(self):
 
         logger.warning("Restarting Cam {}".format(self.cam_id))
@@ -293,6 +385,13 @@ class Stream:
             self.scenario = None
             self.scenario_type = self.model.detection_mode
 
+    def set_fps(self, fps):
+        """Change the capture rate without reopening the source."""
+        fps = max(0.1, fps)
+        if self.cam_fps > 0.0:
+            fps = min(fps, self.cam_fps)
+        self.fps = fps
+
     def check_update(self, rtsp, fps, endpoint):
         print(endpoint)
         print(type(endpoint))
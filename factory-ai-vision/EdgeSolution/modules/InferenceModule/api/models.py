@@ -2,7 +2,7 @@
 """
 
 from enum import Enum
-from typing import List, Literal
+from typing import List, Literal, Optional
 
 from pydantic import BaseModel
 
@@ -50,9 +50,39 @@ class CameraModel(BaseModel):
     send_video_to_cloud_threshold: int = 60
     recording_duration: int = 60
     enable_tracking: bool
+    # share of the frame rate the camera gets with ADAPTIVE_FRAME_RATE
+    priority: float = 1
 
 
 class CamerasModel(BaseModel):
     lva_mode: Literal["http", "grpc"]
     fps: float
     cameras: List[CameraModel]
+
+
+class RetrainParametersModel(BaseModel):
+    is_retrain: bool
+    confidence_min: int
+    confidence_max: int
+    max_images: int
+
+
+class IothubParametersModel(BaseModel):
+    is_send: bool
+    threshold: int
+    fpm: int
+
+
+class ConfigurationModel(BaseModel):
+    """Everything a deploy sets, a missing section is left as it is."""
+
+    # documents older than the applied one are ignored
+    version: int
+    part_detection_id: Optional[int] = None
+    part_detection_mode: Optional[PartDetectionModeEnum] = None
+    model: Optional[UploadModelBody] = None
+    parts: Optional[PartsModel] = None
+    cameras: Optional[CamerasModel] = None
+    retrain_parameters: Optional[RetrainParametersModel] = None
+    iothub_parameters: Optional[IothubParametersModel] = None
+    prob_threshold: Optional[int] = None
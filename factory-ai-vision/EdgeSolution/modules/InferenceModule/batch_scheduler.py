@@ -0,0 +1,170 @@
+"""Batch Scheduler
+
+Collect frames from several Stream.predict callers and run them through the
+model as one batch.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+from instrumentation import set_gauge
+
+logger = logging.getLogger(__name__)
+
+
+class BatchRequest:
+    """A frame waiting for its prediction."""
+
+    def __init__(self, image, buffer=None):
+        self.image = image
+        self.buffer = buffer
+        self.submit_time = time.time()
+        self.event = threading.Event()
+        self.predictions = None
+        self.inf_time = 0
+        self.error = None
+
+    def set_result(self, predictions, inf_time):
+        self.predictions = predictions
+        self.inf_time = inf_time
+        self.event.set()
+
+    def set_error(self, error):
+        self.error = error
+        self.event.set()
+
+
+class BatchScheduler:
+    """Micro-batching scheduler in front of the model.
+
+    Callers block in submit() until their frame has been scored. A worker
+    thread waits for the first frame, keeps collecting frames until either
+    max_batch_size is reached or max_wait_time (seconds) has elapsed since
+    that first frame, then runs them with one call to predict_batch. One
+    worker is started per inference session so batches run concurrently.
+    """
+
+    def __init__(
+        self, predict_batch, max_batch_size=4, max_wait_time=0.01, num_workers=1
+    ):
+        """Initialize the scheduler
+
+        Args:
+            predict_batch (callable): takes a list of images and the list of
+                their preprocess buffers, returns (list of predictions,
+                inference time).
+            max_batch_size (int): the max number of frames in one batch.
+            max_wait_time (float): the max seconds to wait for a batch to fill.
+            num_workers (int): the number of batches run at the same time.
+        """
+        self.predict_batch = predict_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_time = max(0.0, max_wait_time)
+        self.requests = queue.Queue()
+
+        self.mutex = threading.Lock()
+        self.average_batch_size = 0
+        self.average_request_latency = 0
+        self.total_batches = 0
+        self.total_requests = 0
+
+        self.is_alive = True
+        self.workers = []
+        for _ in range(max(1, int(num_workers))):
+            worker = threading.Thread(target=self._run, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, image, buffer=None):
+        """Queue an image and wait for its prediction.
+
+        Args:
+            image: the frame to score.
+            buffer (PreprocessBuffer): reusable arrays of the caller's stream.
+
+        Returns:
+            (predictions, inference time) of the batch the image ran in.
+        """
+        request = BatchRequest(image, buffer)
+        self.requests.put(request)
+        set_gauge("batch_queued", self.requests.qsize())
+        request.event.wait()
+        if request.error is not None:
+            raise request.error
+        return request.predictions, request.inf_time
+
+    def stop(self):
+        self.is_alive = False
+        for _ in self.workers:
+            self.requests.put(None)
+
+    def _collect(self):
+        request = self.requests.get()
+        if request is None:
+            return []
+        batch = [request]
+        deadline = time.time() + self.max_wait_time
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0:
+                    request = self.requests.get(timeout=timeout)
+                else:
+                    request = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                # let the other workers see the stop signal as well
+                self.requests.put(None)
+                break
+            batch.append(request)
+        set_gauge("batch_queued", self.requests.qsize())
+        return batch
+
+    def _run(self):
+        while self.is_alive:
+            batch = self._collect()
+            if not batch:
+                continue
+            try:
+                predictions, inf_time = self.predict_batch(
+                    [request.image for request in batch],
+                    [request.buffer for request in batch],
+                )
+            except Exception as e:
+                logger.exception("Batch of %s frames failed", len(batch))
+                for request in batch:
+                    request.set_error(e)
+                continue
+
+            now = time.time()
+            for request, prediction in zip(batch, predictions):
+                request.set_result(prediction, inf_time)
+            self._update_metrics(batch, now)
+
+    def _update_metrics(self, batch, now):
+        # moving average, same as Stream.average_inference_time
+        latency_ms = max((now - request.submit_time) * 1000 for request in batch)
+        with self.mutex:
+            self.total_batches += 1
+            self.total_requests += len(batch)
+            self.average_batch_size = (
+                1 / 16 * len(batch) + 15 / 16 * self.average_batch_size
+            )
+            self.average_request_latency = (
+                1 / 16 * latency_ms + 15 / 16 * self.average_request_latency
+            )
+
+    def get_metrics(self):
+        with self.mutex:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_time": self.max_wait_time,
+                "num_workers": len(self.workers),
+                "average_batch_size": self.average_batch_size,
+                "average_request_latency": self.average_request_latency,
+                "total_batches": self.total_batches,
+                "total_requests": self.total_requests,
+            }
@@ -0,0 +1,414 @@
+"""Benchmark
+
+Measure the InferenceModule end to end (Stream.predict, scenario included)
+over a sweep of settings and write the results as JSON.
+
+    python benchmark.py --streams 1 2 4 --batch-sizes 1 4 --pool-sizes 1 2 \\
+        --resolutions 960x540 1920x1080 --scenarios PD PC ES DD \\
+        --frames 50 --output benchmark.json
+    python benchmark.py --compare old.json new.json
+
+At startup server.py calls startup_benchmark(), which reuses the cached
+result of a short probe of the deployed settings when the device, model and
+settings haven't changed.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import resource
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from model_wrapper import MAX_BATCH_SIZE, SESSION_POOL_SIZE, ONNXRuntimeModelDeploy
+from motion_gate import MOTION_GATING
+from streams import Stream
+
+# Where the startup probe result is kept, put it on a volume to keep it
+# across container restarts
+BENCHMARK_CACHE = os.environ.get("BENCHMARK_CACHE", "benchmark/cache.json")
+# Highest p95 latency a stream count may have to count towards the
+# recommended frame rate
+BENCHMARK_P95_BUDGET_MS = float(os.environ.get("BENCHMARK_P95_BUDGET_MS", 500))
+
+SAMPLE_IMAGE = "img.png"
+SCENARIO_MODELS = {
+    "PD": "scenario_models/1",
+    "PC": "scenario_models/1",
+    "ES": "scenario_models/2",
+    "DD": "scenario_models/3",
+}
+LINE_INFO = json.dumps(
+    {
+        "useCountingLine": True,
+        "countingLines": [{"label": [{"x": 480, "y": 0}, {"x": 480, "y": 540}]}],
+    }
+)
+ZONE_INFO = json.dumps(
+    {
+        "useDangerZone": True,
+        "dangerZones": [{"label": {"x1": 240, "y1": 135, "x2": 720, "y2": 405}}],
+    }
+)
+
+# Startup probe, the deployed settings with the default scenario
+STARTUP_STREAMS = [1, 2, 4]
+STARTUP_FRAMES = 15
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def get_memory():
+    """(current, peak) resident memory of the process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    current = peak
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return current, peak
+
+
+def get_model_id(model_dir):
+    """Identify a model by the SHA1 in its manifest, or its files."""
+    try:
+        with open(os.path.join(model_dir, "onnx", "cvexport.manifest")) as f:
+            return json.load(f)["ModelFileSHA1"]
+    except (OSError, KeyError, ValueError):
+        pass
+    digest = hashlib.sha1()
+    for root, _, files in sorted(os.walk(model_dir)):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(path.encode())
+            digest.update(str(os.path.getsize(path)).encode())
+    return digest.hexdigest()
+
+
+def run_case(model, num_streams, resolution, scenario, num_frames, image):
+    """Run num_frames frames through each of num_streams streams.
+
+    Every stream has its own thread and Stream, like real cameras do.
+    """
+    width, height = resolution
+    frame = cv2.resize(image, (width, height))
+
+    streams = []
+    for i in range(num_streams):
+        stream = Stream(str(10000 + i), model, None)
+        stream.set_is_benchmark(True)
+        # the sample frame never moves, a motion gate would skip most of it
+        stream.motion_gate = None
+        stream.update_cam(
+            cam_type="video",
+            cam_source="benchmark",
+            frameRate=30,
+            recording_duration=60,
+            lva_mode=stream.lva_mode,
+            cam_id=stream.cam_id,
+            cam_name="benchmark",
+            has_aoi=False,
+            aoi_info=None,
+            scenario_type=scenario,
+            line_info=LINE_INFO,
+            zone_info=ZONE_INFO,
+        )
+        streams.append(stream)
+
+    latencies = [[] for _ in streams]
+
+    def _run(stream, stream_latencies):
+        for _ in range(num_frames):
+            start = time.time()
+            stream.predict(frame)
+            stream_latencies.append(time.time() - start)
+
+    threads = [
+        threading.Thread(target=_run, args=(stream, stream_latencies))
+        for stream, stream_latencies in zip(streams, latencies)
+    ]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    for stream in streams:
+        stream.cam_is_alive = False
+        stream.renderer.stop()
+        stream.broadcaster.stop()
+
+    latencies_ms = [
+        latency * 1000 for stream_latencies in latencies for latency in stream_latencies
+    ]
+    memory, peak_memory = get_memory()
+    return {
+        "streams": num_streams,
+        "resolution": "{}x{}".format(width, height),
+        "scenario": scenario,
+        "frames": len(latencies_ms),
+        "elapsed": elapsed,
+        "throughput": len(latencies_ms) / elapsed,
+        "latency_p50_ms": percentile(latencies_ms, 50),
+        "latency_p95_ms": percentile(latencies_ms, 95),
+        "latency_p99_ms": percentile(latencies_ms, 99),
+        "memory_mb": memory,
+        "peak_memory_mb": peak_memory,
+    }
+
+
+def run_sweep(
+    streams,
+    batch_sizes,
+    pool_sizes,
+    resolutions,
+    scenarios,
+    num_frames,
+    image_path=SAMPLE_IMAGE,
+):
+    image = cv2.imread(image_path)
+    results = []
+    device = None
+    for batch_size in batch_sizes:
+        for pool_size in pool_sizes:
+            model = ONNXRuntimeModelDeploy(
+                max_batch_size=batch_size, session_pool_size=pool_size
+            )
+            device = model.get_device()
+            for scenario in scenarios:
+                model_dir = SCENARIO_MODELS[scenario]
+                model.set_is_scenario(scenario != "PD")
+                model.set_detection_mode(scenario)
+                model.update_model(model_dir)
+                model.update_parts(list(model.model.models[0].labels))
+                # one frame per stream first, so the sessions are warm
+                run_case(model, max(streams), resolutions[0], scenario, 1, image)
+                for resolution in resolutions:
+                    for num_streams in streams:
+                        result = run_case(
+                            model, num_streams, resolution, scenario, num_frames, image
+                        )
+                        result.update(
+                            {
+                                "batch_size": batch_size,
+                                "pool_size": model.pool_size,
+                                "model": get_model_id(model_dir),
+                            }
+                        )
+                        logger.info(
+                            "streams %s batch %s pool %s %s %s: %.1f fps, "
+                            "p50 %.1f ms, p95 %.1f ms, p99 %.1f ms",
+                            num_streams,
+                            batch_size,
+                            model.pool_size,
+                            result["resolution"],
+                            scenario,
+                            result["throughput"],
+                            result["latency_p50_ms"],
+                            result["latency_p95_ms"],
+                            result["latency_p99_ms"],
+                        )
+                        results.append(result)
+            if model.batch_scheduler:
+                model.batch_scheduler.stop()
+
+    return {
+        "created_at": time.time(),
+        "device": device,
+        "cpu_count": os.cpu_count(),
+        "frames_per_stream": num_frames,
+        "results": results,
+    }
+
+
+def get_recommended_throughput(results, p95_budget_ms=BENCHMARK_P95_BUDGET_MS):
+    """Total frame rate per stream count, from the results within budget.
+
+    Returns:
+        {streams: frames per second}, falls back to every result when none
+        is within budget.
+    """
+    within_budget = [r for r in results if r["latency_p95_ms"] <= p95_budget_ms]
+    throughput = {}
+    for result in within_budget or results:
+        streams = result["streams"]
+        throughput[streams] = max(throughput.get(streams, 0), result["throughput"])
+    return throughput
+
+
+def get_cache_key(model):
+    return {
+        "device": model.get_device(),
+        "cpu_count": os.cpu_count(),
+        "batch_size": model.batch_scheduler.max_batch_size
+        if model.batch_scheduler
+        else 1,
+        "pool_size": model.pool_size,
+        "motion_gating": MOTION_GATING,
+        "model": get_model_id(SCENARIO_MODELS["PC"]),
+        "streams": STARTUP_STREAMS,
+        "frames": STARTUP_FRAMES,
+    }
+
+
+def load_cache(key, path=BENCHMARK_CACHE):
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cache.get("key") != key:
+        return None
+    return cache["benchmark"]
+
+
+def save_cache(key, benchmark, path=BENCHMARK_CACHE):
+    try:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"key": key, "benchmark": benchmark}, f, indent=2)
+    except OSError:
+        logger.exception("Cannot save benchmark cache to %s", path)
+
+
+def startup_benchmark(model):
+    """Set the recommended frame rates of model from measured throughput.
+
+    Probes the deployed batch and pool settings with the counting scenario,
+    unless the cached result of the same probe can be reused.
+    """
+    logger.info("============= BenchMarking (Begin) ==================")
+    key = get_cache_key(model)
+    benchmark = load_cache(key)
+    if benchmark is not None:
+        logger.info("Reusing cached benchmark from %s", BENCHMARK_CACHE)
+    else:
+        batch_size = key["batch_size"]
+        benchmark = run_sweep(
+            STARTUP_STREAMS,
+            [batch_size],
+            [model.pool_size],
+            [(960, 540)],
+            ["PC"],
+            STARTUP_FRAMES,
+        )
+        save_cache(key, benchmark)
+
+    throughput = get_recommended_throughput(benchmark["results"])
+    for streams, fps in sorted(throughput.items()):
+        logger.info("  %s streams: %.1f fps in total", streams, fps)
+    logger.info("============= BenchMarking (End) ==================")
+    model.set_measured_throughput(throughput)
+    return benchmark
+
+
+def compare(old_path, new_path):
+    """Print throughput and latency changes between two benchmark files."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    def _key(result):
+        return (
+            result["streams"],
+            result["batch_size"],
+            result["pool_size"],
+            result["resolution"],
+            result["scenario"],
+        )
+
+    old_results = {_key(r): r for r in old["results"]}
+    print(
+        "%7s %5s %4s %10s %4s %10s %10s %8s %10s %10s"
+        % (
+            "streams",
+            "batch",
+            "pool",
+            "resolution",
+            "scn",
+            "old fps",
+            "new fps",
+            "change",
+            "old p95",
+            "new p95",
+        )
+    )
+    for result in new["results"]:
+        previous = old_results.get(_key(result))
+        if previous is None:
+            continue
+        change = (result["throughput"] / previous["throughput"] - 1) * 100
+        print(
+            "%7d %5d %4d %10s %4s %10.1f %10.1f %+7.1f%% %10.1f %10.1f"
+            % (
+                result["streams"],
+                result["batch_size"],
+                result["pool_size"],
+                result["resolution"],
+                result["scenario"],
+                previous["throughput"],
+                result["throughput"],
+                change,
+                previous["latency_p95_ms"],
+                result["latency_p95_ms"],
+            )
+        )
+
+
+def parse_resolution(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="InferenceModule benchmark")
+    parser.add_argument("--streams", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[MAX_BATCH_SIZE])
+    parser.add_argument("--pool-sizes", nargs="+", default=[SESSION_POOL_SIZE])
+    parser.add_argument(
+        "--resolutions", type=parse_resolution, nargs="+", default=[(960, 540)]
+    )
+    parser.add_argument(
+        "--scenarios", nargs="+", default=["PD"], choices=sorted(SCENARIO_MODELS)
+    )
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--image", default=SAMPLE_IMAGE)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    logging.basicConfig(level=logging.INFO)
+    benchmark = run_sweep(
+        args.streams,
+        args.batch_sizes,
+        args.pool_sizes,
+        args.resolutions,
+        args.scenarios,
+        args.frames,
+        args.image,
+    )
+    with open(args.output, "w") as f:
+        json.dump(benchmark, f, indent=2)
+    print("Results written to", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Postprocess micro-benchmark
+
+Times the per-frame postprocess (region decode + NMS) on synthetic crowded
+scenes and checks the results against the previous implementation.
+
+    python benchmark_postprocess.py --objects 5 50 200 --frames 200
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from postprocess import postprocess
+
+ANCHORS = np.array(
+    [[0.573, 0.677], [1.87, 2.06], [3.34, 5.47], [7.88, 3.53], [9.77, 9.17]]
+)
+IOU_THRESHOLD = 0.45
+PROB_THRESHOLD = 0.10
+MAX_DETECTIONS = 20
+
+
+def reference_postprocess(
+    prediction_output, anchors, labels, prob_threshold, iou_threshold, max_detections
+):
+    """The previous per-box Python implementation, kept as the baseline."""
+
+    def _logistic(x):
+        return np.where(x > 0, 1 / (1 + np.exp(-x)), np.exp(x) / (1 + np.exp(x)))
+
+    num_anchor = anchors.shape[0]
+    height, width, channels = prediction_output.shape
+    num_class = int(channels / num_anchor) - 5
+    outputs = prediction_output.reshape((height, width, num_anchor, -1))
+
+    x = (
+        _logistic(outputs[..., 0]) + np.arange(width)[np.newaxis, :, np.newaxis]
+    ) / width
+    y = (
+        _logistic(outputs[..., 1]) + np.arange(height)[:, np.newaxis, np.newaxis]
+    ) / height
+    w = np.exp(outputs[..., 2]) * anchors[:, 0][np.newaxis, np.newaxis, :] / width
+    h = np.exp(outputs[..., 3]) * anchors[:, 1][np.newaxis, np.newaxis, :] / height
+    x = x - w / 2
+    y = y - h / 2
+    boxes = np.stack((x, y, w, h), axis=-1).reshape(-1, 4)
+    objectness = _logistic(outputs[..., 4])
+    class_probs = outputs[..., 5:]
+    class_probs = np.exp(class_probs - np.amax(class_probs, axis=3)[..., np.newaxis])
+    class_probs = (
+        class_probs
+        / np.sum(class_probs, axis=3)[..., np.newaxis]
+        * objectness[..., np.newaxis]
+    )
+    class_probs = class_probs.reshape(-1, num_class)
+
+    max_probs = np.amax(class_probs, axis=1)
+    (index,) = np.where(max_probs > prob_threshold)
+    index = index[(-max_probs[index]).argsort()]
+    boxes = boxes[index]
+    class_probs = class_probs[index]
+
+    max_detections = min(max_detections, len(boxes))
+    max_probs = np.amax(class_probs, axis=1) if len(boxes) else np.empty(0)
+    max_classes = (
+        np.argmax(class_probs, axis=1) if len(boxes) else np.empty(0, dtype=int)
+    )
+    areas = boxes[:, 2] * boxes[:, 3]
+    selected = []
+    while len(selected) < max_detections:
+        i = np.argmax(max_probs)
+        if max_probs[i] < prob_threshold:
+            break
+        selected.append((boxes[i], max_classes[i], max_probs[i]))
+        box = boxes[i]
+        other_indices = np.concatenate((np.arange(i), np.arange(i + 1, len(boxes))))
+        other_boxes = boxes[other_indices]
+        x1 = np.maximum(box[0], other_boxes[:, 0])
+        y1 = np.maximum(box[1], other_boxes[:, 1])
+        x2 = np.minimum(box[0] + box[2], other_boxes[:, 0] + other_boxes[:, 2])
+        y2 = np.minimum(box[1] + box[3], other_boxes[:, 1] + other_boxes[:, 3])
+        overlap_area = np.maximum(0, x2 - x1) * np.maximum(0, y2 - y1)
+        iou = overlap_area / (areas[i] + areas[other_indices] - overlap_area)
+        overlapping_indices = other_indices[np.where(iou > iou_threshold)[0]]
+        overlapping_indices = np.append(overlapping_indices, i)
+        class_probs[overlapping_indices, max_classes[i]] = 0
+        max_probs[overlapping_indices] = np.amax(
+            class_probs[overlapping_indices], axis=1
+        )
+        max_classes[overlapping_indices] = np.argmax(
+            class_probs[overlapping_indices], axis=1
+        )
+
+    return [
+        {
+            "probability": round(float(p), 8),
+            "tagId": int(c),
+            "tagName": labels[c],
+            "boundingBox": {
+                "left": round(float(b[0]), 8),
+                "top": round(float(b[1]), 8),
+                "width": round(float(b[2]), 8),
+                "height": round(float(b[3]), 8),
+            },
+        }
+        for b, c, p in selected
+    ]
+
+
+def crowded_scene(num_objects, num_labels, grid=(12, 21), seed=0):
+    """Random region output with num_objects confident cells."""
+    rng = np.random.RandomState(seed)
+    height, width = grid
+    num_anchor = len(ANCHORS)
+    outputs = rng.normal(0, 1, (height, width, num_anchor, num_labels + 5)).astype(
+        np.float32
+    )
+    # Mostly background
+    outputs[..., 4] = rng.normal(-6, 1, (height, width, num_anchor))
+    cells = rng.choice(
+        height * width * num_anchor,
+        min(num_objects, height * width * num_anchor),
+        replace=False,
+    )
+    flat = outputs.reshape(-1, num_labels + 5)
+    flat[cells, 4] = rng.normal(3, 1, len(cells))
+    flat[cells, 5:] += rng.normal(0, 3, (len(cells), num_labels))
+    return flat.reshape(height, width, -1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Postprocess micro-benchmark")
+    parser.add_argument("--objects", type=int, nargs="+", default=[5, 50, 200, 600])
+    parser.add_argument("--labels", type=int, default=6)
+    parser.add_argument("--frames", type=int, default=100)
+    args = parser.parse_args()
+
+    labels = ["label%d" % i for i in range(args.labels)]
+    print(
+        "%8s %14s %14s %8s %6s"
+        % ("objects", "reference ms", "vectorized ms", "speedup", "same")
+    )
+    for num_objects in args.objects:
+        frames = [
+            crowded_scene(num_objects, args.labels, seed=i) for i in range(args.frames)
+        ]
+
+        start = time.time()
+        expected = [
+            reference_postprocess(
+                frame, ANCHORS, labels, PROB_THRESHOLD, IOU_THRESHOLD, MAX_DETECTIONS
+            )
+            for frame in frames
+        ]
+        reference_time = (time.time() - start) / len(frames) * 1000
+
+        start = time.time()
+        actual = [
+            postprocess(
+                frame, ANCHORS, labels, PROB_THRESHOLD, IOU_THRESHOLD, MAX_DETECTIONS
+            )
+            for frame in frames
+        ]
+        vectorized_time = (time.time() - start) / len(frames) * 1000
+
+        print(
+            "%8d %14.3f %14.3f %7.1fx %6s"
+            % (
+                num_objects,
+                reference_time,
+                vectorized_time,
+                reference_time / vectorized_time,
+                expected == actual,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Frame Broadcaster
+
+Share the drawn frames of a stream with every video_feed viewer and the ZMQ
+sender. A frame is JPEG encoded at most once, by the first subscriber that
+asks for it, and never when nobody is watching.
+"""
+
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+import cv2
+
+from instrumentation import timed
+
+# Quality and max width of the frames sent to viewers, 0 keeps the drawn size
+VIDEO_FEED_JPEG_QUALITY = int(os.environ.get("VIDEO_FEED_JPEG_QUALITY", 80))
+VIDEO_FEED_WIDTH = int(os.environ.get("VIDEO_FEED_WIDTH", 0))
+
+logger = logging.getLogger(__name__)
+
+
+class FrameBroadcaster:
+    """Latest drawn frame of a stream and its JPEG bytes."""
+
+    def __init__(
+        self, quality=VIDEO_FEED_JPEG_QUALITY, width=VIDEO_FEED_WIDTH, cam_id=None
+    ):
+        self.quality = quality
+        self.width = width
+        self.cam_id = cam_id
+
+        self.condition = threading.Condition()
+        self.frame = None
+        self.frame_id = 0
+        self.num_subscribers = 0
+        self.is_alive = True
+
+        self.encode_lock = threading.Lock()
+        self.jpg = None
+        self.jpg_id = 0
+        self.total_published = 0
+        self.total_encoded = 0
+
+    def has_subscribers(self):
+        return self.num_subscribers > 0
+
+    def publish(self, img):
+        """Make img the latest frame, img must not be modified afterwards."""
+        with self.condition:
+            self.total_published += 1
+            if self.num_subscribers == 0:
+                return
+            self.frame = img
+            self.frame_id += 1
+            self.condition.notify_all()
+
+    @contextmanager
+    def subscribe(self):
+        with self.condition:
+            self.num_subscribers += 1
+        try:
+            yield self
+        finally:
+            with self.condition:
+                self.num_subscribers -= 1
+                if self.num_subscribers == 0:
+                    # nothing to keep the last frame alive for
+                    self.frame = None
+
+    def wait(self, last_frame_id, timeout=None):
+        """Wait for a frame newer than last_frame_id.
+
+        Returns:
+            (frame_id, jpg bytes), jpg is None if the timeout expired.
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.frame_id > last_frame_id or not self.is_alive, timeout
+            )
+            if self.frame_id <= last_frame_id or self.frame is None:
+                return last_frame_id, None
+            frame_id, frame = self.frame_id, self.frame
+        return self._encode(frame_id, frame)
+
+    def _encode(self, frame_id, frame):
+        with self.encode_lock:
+            # another subscriber may have encoded it, or a newer one, already
+            if self.jpg_id >= frame_id:
+                return self.jpg_id, self.jpg
+            with timed("encode", self.cam_id):
+                if self.width and frame.shape[1] > self.width:
+                    height = int(frame.shape[0] * self.width / frame.shape[1])
+                    frame = cv2.resize(frame, (self.width, height))
+                self.jpg = cv2.imencode(
+                    ".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+                )[1].tobytes()
+            self.jpg_id = frame_id
+            self.total_encoded += 1
+            return self.jpg_id, self.jpg
+
+    def stop(self):
+        with self.condition:
+            self.is_alive = False
+            self.condition.notify_all()
+
+    def get_metrics(self):
+        return {
+            "subscribers": self.num_subscribers,
+            "total_published": self.total_published,
+            "total_encoded": self.total_encoded,
+        }
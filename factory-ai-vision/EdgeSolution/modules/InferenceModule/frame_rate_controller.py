@@ -0,0 +1,249 @@
+"""Frame Rate Controller
+
+Closed loop over the frame rate asked from each camera. Every interval it
+measures how busy the model was and whether any stream fell behind, moves
+the total frame rate the box can take towards that, and splits it across
+the streams by their priority weights.
+
+The frame rate sent by update_cams stays the cap of each stream. The loop
+starts from the benchmarked throughput of ONNXRuntimeModelDeploy.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from instrumentation import get_counters, set_gauge
+
+# Opt-in, "true" to adjust the camera frame rates at run time
+ADAPTIVE_FRAME_RATE = os.environ.get("ADAPTIVE_FRAME_RATE", "false")
+# Seconds between two adjustments
+ADAPTIVE_FRAME_RATE_INTERVAL = float(os.environ.get("ADAPTIVE_FRAME_RATE_INTERVAL", 10))
+# Share of the inference capacity to use, the rest absorbs bursts
+ADAPTIVE_FRAME_RATE_UTILIZATION = float(
+    os.environ.get("ADAPTIVE_FRAME_RATE_UTILIZATION", 0.9)
+)
+# Score latency, batch wait included, above which a stream is falling behind
+ADAPTIVE_FRAME_RATE_LATENCY_MS = float(
+    os.environ.get("ADAPTIVE_FRAME_RATE_LATENCY_MS", 500)
+)
+# Smallest relative change sent to a camera, an LVA graph instance is
+# restarted for each change
+ADAPTIVE_FRAME_RATE_MIN_CHANGE = float(
+    os.environ.get("ADAPTIVE_FRAME_RATE_MIN_CHANGE", 0.2)
+)
+
+MIN_FRAME_RATE = 1
+# Frames lost to a full queue, a stream that has any is falling behind
+LAG_COUNTERS = ("dropped_frames", "rejected_frames", "grpc_skipped_frames")
+
+logger = logging.getLogger(__name__)
+
+
+def split_frame_rate(total, weights, caps, min_frame_rate=MIN_FRAME_RATE):
+    """Split total across streams in proportion to weights.
+
+    A stream never gets more than its cap nor less than min_frame_rate,
+    what a capped stream can't take goes to the others.
+
+    Args:
+        total (float): frames per second for all streams.
+        weights ({cam_id: float}): priority of each stream.
+        caps ({cam_id: float}): max frame rate of each stream.
+
+    Returns:
+        {cam_id: frame rate}
+    """
+    frame_rates = {}
+    remaining = dict(weights)
+    left = total
+    while remaining:
+        weight_sum = sum(remaining.values())
+        capped = {}
+        for cam_id, weight in remaining.items():
+            share = (
+                left * weight / weight_sum if weight_sum > 0 else left / len(remaining)
+            )
+            if share >= caps[cam_id]:
+                capped[cam_id] = caps[cam_id]
+        if not capped:
+            for cam_id, weight in remaining.items():
+                share = (
+                    left * weight / weight_sum
+                    if weight_sum > 0
+                    else left / len(remaining)
+                )
+                frame_rates[cam_id] = share
+            break
+        for cam_id, cap in capped.items():
+            frame_rates[cam_id] = cap
+            left -= cap
+            del remaining[cam_id]
+    return {
+        cam_id: max(min_frame_rate, min(frame_rate, caps[cam_id]))
+        for cam_id, frame_rate in frame_rates.items()
+    }
+
+
+class StreamSample:
+    """Counters of a stream at the start of an interval."""
+
+    def __init__(self, stream):
+        self.time = time.time()
+        self.predicted = stream.total_predicted
+        counters = get_counters(stream.cam_id)
+        self.lost = sum(counters.get(name, 0) for name in LAG_COUNTERS)
+
+
+class FrameRateController:
+    def __init__(
+        self,
+        stream_manager,
+        model,
+        interval=ADAPTIVE_FRAME_RATE_INTERVAL,
+        utilization=ADAPTIVE_FRAME_RATE_UTILIZATION,
+        latency_ms=ADAPTIVE_FRAME_RATE_LATENCY_MS,
+        min_change=ADAPTIVE_FRAME_RATE_MIN_CHANGE,
+    ):
+        self.stream_manager = stream_manager
+        self.model = model
+        self.interval = interval
+        self.utilization = utilization
+        self.latency_ms = latency_ms
+        self.min_change = min_change
+
+        self.mutex = threading.Lock()
+        self.weights = {}
+        self.samples = {}
+        # model session time at the start of the interval
+        self.session_time = 0
+        self.total_frame_rate = None
+        self.last_utilization = 0
+        self.frame_rates = {}
+        self.is_alive = False
+
+    def set_weight(self, cam_id, weight):
+        with self.mutex:
+            self.weights[cam_id] = max(0.0, weight)
+
+    def reset(self):
+        """Start over from the benchmarked throughput, e.g. after the
+        cameras or the model changed.
+        """
+        with self.mutex:
+            self.total_frame_rate = None
+            self.samples = {}
+
+    def start(self):
+        self.is_alive = True
+        threading.Thread(target=self._run, daemon=True).start()
+        logger.info("Adaptive frame rate every %ss", self.interval)
+
+    def stop(self):
+        self.is_alive = False
+
+    def _run(self):
+        while self.is_alive:
+            time.sleep(self.interval)
+            try:
+                self.step()
+            except Exception:
+                logger.exception("Frame rate adjustment failed")
+
+    def step(self):
+        """Measure the last interval and set the frame rate of every stream."""
+        streams = [s for s in self.stream_manager.get_streams() if s.cam_is_alive]
+        with self.mutex:
+            if not streams:
+                self.samples = {}
+                return
+            if self.total_frame_rate is None or set(self.samples) != {
+                s.cam_id for s in streams
+            }:
+                # first interval of this set of streams, only take samples
+                if self.total_frame_rate is None:
+                    self.total_frame_rate = self.model.get_total_frame_rate(
+                        len(streams)
+                    )
+                self.samples = {s.cam_id: StreamSample(s) for s in streams}
+                self.session_time = self.model.get_total_session_time()
+                return
+
+            # time in session.run only, the batch and session waits of the
+            # streams overlap and would count several times
+            session_time = self.model.get_total_session_time()
+            busy_time = session_time - self.session_time
+            self.session_time = session_time
+            processed = 0
+            is_behind = False
+            elapsed = 0
+            for stream in streams:
+                sample = StreamSample(stream)
+                previous = self.samples[stream.cam_id]
+                self.samples[stream.cam_id] = sample
+                elapsed = max(elapsed, sample.time - previous.time)
+                processed += sample.predicted - previous.predicted
+                if (
+                    sample.lost > previous.lost
+                    or stream.average_request_latency > self.latency_ms
+                ):
+                    is_behind = True
+            if elapsed <= 0 or processed == 0:
+                return
+
+            # streams predict in parallel on pool_size sessions
+            utilization = busy_time / elapsed / max(1, self.model.pool_size)
+            processed_frame_rate = processed / elapsed
+            if is_behind:
+                # back off below what was actually processed
+                total = min(self.total_frame_rate, processed_frame_rate) * 0.8
+            elif utilization > 0:
+                # what the same load would be at the target utilization
+                total = processed_frame_rate * self.utilization / utilization
+                # move half way, one noisy interval shouldn't swing it
+                total = (self.total_frame_rate + total) / 2
+            else:
+                total = self.total_frame_rate
+            weights = {s.cam_id: self.weights.get(s.cam_id, 1.0) for s in streams}
+            caps = {
+                s.cam_id: max(MIN_FRAME_RATE, s.requested_frame_rate) for s in streams
+            }
+            # no use growing past what the cameras are allowed to send
+            total = min(total, sum(caps.values()))
+            self.total_frame_rate = max(MIN_FRAME_RATE * len(streams), total)
+            self.last_utilization = utilization
+
+            frame_rates = split_frame_rate(self.total_frame_rate, weights, caps)
+            self.frame_rates = frame_rates
+
+        for stream in streams:
+            frame_rate = frame_rates[stream.cam_id]
+            set_gauge("target_frame_rate", frame_rate, stream.cam_id)
+            change = abs(frame_rate - stream.frameRate) / max(
+                stream.frameRate, MIN_FRAME_RATE
+            )
+            if change >= self.min_change:
+                logger.info(
+                    "Stream %s frame rate %.1f -> %.1f, utilization %.2f%s",
+                    stream.cam_id,
+                    stream.frameRate,
+                    frame_rate,
+                    utilization,
+                    ", falling behind" if is_behind else "",
+                )
+                try:
+                    stream.set_frame_rate(round(frame_rate, 1))
+                except Exception:
+                    # the other streams are still updated
+                    logger.exception("Stream %s frame rate not updated", stream.cam_id)
+
+    def get_metrics(self):
+        with self.mutex:
+            return {
+                "enabled": self.is_alive,
+                "total_frame_rate": self.total_frame_rate,
+                "utilization": self.last_utilization,
+                "frame_rates": dict(self.frame_rates),
+                "weights": dict(self.weights),
+            }
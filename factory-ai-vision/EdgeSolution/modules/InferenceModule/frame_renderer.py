@@ -0,0 +1,100 @@
+"""Frame Renderer
+
+Draw the predictions of a stream in a thread of its own, so Stream.predict
+never waits for it. Only the latest frame is drawn, only while the
+FrameBroadcaster has subscribers, and at most VIDEO_FEED_FPS times a second.
+"""
+
+import logging
+import os
+import threading
+import time
+
+# Max frames drawn per second for the viewers of a stream, 0 for no limit
+VIDEO_FEED_FPS = float(os.environ.get("VIDEO_FEED_FPS", 15))
+
+logger = logging.getLogger(__name__)
+
+
+class FrameRenderer:
+    """Latest predicted frame of a stream, drawn on demand."""
+
+    def __init__(self, draw, broadcaster, fps=VIDEO_FEED_FPS):
+        """
+        Args:
+            draw (callable): takes the submitted frame arguments, returns
+                the drawn image.
+            broadcaster (FrameBroadcaster): where drawn images go.
+            fps (float): max frames drawn per second.
+        """
+        self.draw = draw
+        self.broadcaster = broadcaster
+        self.interval = 1 / fps if fps > 0 else 0
+
+        self.condition = threading.Condition()
+        self.frame = None
+        self.frame_id = 0
+        self.is_alive = True
+        self.total_submitted = 0
+        self.total_rendered = 0
+
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, *frame):
+        """Make frame the latest one, its arguments must not be modified
+        afterwards.
+        """
+        with self.condition:
+            self.frame = frame
+            self.frame_id += 1
+            self.total_submitted += 1
+            self.condition.notify()
+
+    def _is_ready(self, rendered_id):
+        return not self.is_alive or (
+            self.frame_id > rendered_id and self.broadcaster.has_subscribers()
+        )
+
+    def _run(self):
+        rendered_id = 0
+        last_render_time = 0
+        while True:
+            with self.condition:
+                # a new subscriber doesn't notify, check every now and then
+                self.condition.wait_for(
+                    lambda: self._is_ready(rendered_id), timeout=0.5
+                )
+                if not self.is_alive:
+                    break
+                if not self._is_ready(rendered_id):
+                    continue
+
+            delay = last_render_time + self.interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            with self.condition:
+                # newer frames may have come in while waiting
+                frame_id, frame = self.frame_id, self.frame
+
+            try:
+                img = self.draw(*frame)
+            except Exception:
+                logger.exception("Cannot draw frame")
+            else:
+                self.broadcaster.publish(img)
+                self.total_rendered += 1
+            rendered_id = frame_id
+            last_render_time = time.time()
+
+    def stop(self):
+        with self.condition:
+            self.is_alive = False
+            self.frame = None
+            self.condition.notify_all()
+
+    def get_metrics(self):
+        return {
+            "max_fps": 1 / self.interval if self.interval else 0,
+            "total_submitted": self.total_submitted,
+            "total_rendered": self.total_rendered,
+        }
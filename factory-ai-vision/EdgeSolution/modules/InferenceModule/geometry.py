@@ -0,0 +1,136 @@
+"""Geometry
+
+AOIs, danger zones and counting lines are compiled once when a camera is
+updated, then every detection of a frame is checked against them in one
+vectorized call. Boxes are [x1, y1, x2, y2] rows in the coordinates of the
+displayed frame.
+"""
+
+import cv2
+import numpy as np
+from shapely.geometry import Polygon
+
+
+def to_boxes(boxes):
+    return np.asarray(boxes, dtype=float).reshape(-1, 4)
+
+
+class AoiIndex:
+    """The AOIs of a camera.
+
+    BBox AOIs are tested directly. Polygon AOIs are rasterized into a single
+    mask of the frame size, a box touches one of them when its rectangle of
+    the mask is not empty, which is a lookup in the integral image.
+    """
+
+    def __init__(self, aoi_info):
+        bboxes = []
+        self.polygons = []
+        for aoi_area in aoi_info or []:
+            label = aoi_area["label"]
+            if aoi_area["type"] == "BBox":
+                bboxes.append([label["x1"], label["y1"], label["x2"], label["y2"]])
+            elif aoi_area["type"] == "Polygon":
+                points = [[point["x"], point["y"]] for point in label]
+                try:
+                    is_valid = Polygon(points).is_valid
+                except ValueError:
+                    is_valid = False
+                if is_valid:
+                    self.polygons.append(np.round(points).astype(np.int32))
+        self.bboxes = to_boxes(bboxes)
+
+        self.size = None
+        self.integral = None
+
+    def get_bounds(self):
+        """(x1, y1, x2, y2) around all the AOIs, None without any."""
+        corners = [self.bboxes[:, :2], self.bboxes[:, 2:]] + self.polygons
+        corners = np.concatenate([c.reshape(-1, 2) for c in corners])
+        if len(corners) == 0:
+            return None
+        x1, y1 = np.floor(corners.min(axis=0)).astype(int)
+        x2, y2 = np.ceil(corners.max(axis=0)).astype(int)
+        return int(x1), int(y1), int(x2), int(y2)
+
+    def _rasterize(self, width, height):
+        mask = np.zeros((height, width), dtype=np.uint8)
+        # one call per polygon, a single call fills even-odd and leaves the
+        # overlap of two polygons empty
+        for polygon in self.polygons:
+            cv2.fillPoly(mask, [polygon], 1)
+        self.integral = cv2.integral(mask)
+        self.size = (width, height)
+
+    def contains(self, boxes, width, height):
+        """Whether each box is inside one of the AOIs.
+
+        Args:
+            boxes: integer boxes clipped to the frame, as parse_bbox returns.
+            width (int): frame width.
+            height (int): frame height.
+
+        Returns:
+            Boolean array, one entry per box.
+        """
+        boxes = to_boxes(boxes)
+        inside = np.zeros(len(boxes), dtype=bool)
+        if len(boxes) == 0:
+            return inside
+
+        if len(self.bboxes):
+            x1, y1, x2, y2 = (boxes[:, i, np.newaxis] for i in range(4))
+            ax1, ay1, ax2, ay2 = (self.bboxes[np.newaxis, :, i] for i in range(4))
+            in_x = ((ax1 <= x1) & (x1 <= ax2)) | ((ax1 <= x2) & (x2 <= ax2))
+            in_y = ((ay1 <= y1) & (y1 <= ay2)) | ((ay1 <= y2) & (y2 <= ay2))
+            inside |= (in_x & in_y).any(axis=1)
+
+        if self.polygons:
+            if self.size != (width, height):
+                self._rasterize(width, height)
+            x1 = np.clip(boxes[:, 0].astype(int), 0, width - 1)
+            y1 = np.clip(boxes[:, 1].astype(int), 0, height - 1)
+            x2 = np.clip(boxes[:, 2].astype(int), 0, width - 1) + 1
+            y2 = np.clip(boxes[:, 3].astype(int), 0, height - 1) + 1
+            s = self.integral
+            inside |= (s[y2, x2] - s[y1, x2] - s[y2, x1] + s[y1, x1]) > 0
+
+        return inside
+
+
+class RectIndex:
+    """Rectangles, like danger zones, a box is inside when it overlaps one.
+
+    Same test as tracker.Rect.is_inside for all boxes and rectangles at once.
+    """
+
+    def __init__(self, rects):
+        self.rects = to_boxes(rects)
+
+    def __len__(self):
+        return len(self.rects)
+
+    def contains(self, boxes):
+        boxes = to_boxes(boxes)
+        if len(boxes) == 0 or len(self.rects) == 0:
+            return np.zeros(len(boxes), dtype=bool)
+
+        a = boxes[:, np.newaxis, :]
+        b = self.rects[np.newaxis, :, :]
+        w = np.maximum(
+            0, np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]) + 1
+        )
+        h = np.maximum(
+            0, np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]) + 1
+        )
+        inter_area = w * h
+        a_area = (a[..., 2] - a[..., 0] + 1) * (a[..., 3] - a[..., 1] + 1)
+        b_area = (b[..., 2] - b[..., 0] + 1) * (b[..., 3] - b[..., 1] + 1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            iou = inter_area / (a_area + b_area - inter_area)
+        return (iou > 0.000001).any(axis=1)
+
+
+def compute_centers(boxes):
+    boxes = to_boxes(boxes)
+    return (boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2
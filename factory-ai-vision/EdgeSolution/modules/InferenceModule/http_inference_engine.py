@@ -1,15 +1,158 @@
 """HttpInferenceEngine.
 """
 
+import asyncio
 import logging
+import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from instrumentation import count, observe, set_gauge, timed
+from shared_memory import SharedMemoryManager
+
+# Threads decoding and predicting /predict frames, one camera uses at most one
+PREDICT_WORKERS = int(os.environ.get("PREDICT_WORKERS", 8))
+# Frames waiting for a worker, across all cameras, before /predict returns 429
+PREDICT_MAX_QUEUED = int(os.environ.get("PREDICT_MAX_QUEUED", 16))
+
+IS_OPENCV = os.environ.get("IS_OPENCV", "false")
 
 logger = logging.getLogger(__name__)
 
 
+class Overloaded(Exception):
+    """Too many frames are waiting, the caller should back off."""
+
+
+class CameraMailbox:
+    """Frame being predicted and the latest frame waiting behind it."""
+
+    def __init__(self):
+        self.is_running = False
+        self.pending = None
+
+
 class HttpInferenceEngine:
-    def __init__(self, stream_manager):
+    def __init__(self, stream_manager, max_workers=PREDICT_WORKERS, max_queued=PREDICT_MAX_QUEUED):
         self.stream_manager = stream_manager
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.max_queued = max_queued
+        # Only touched from the event loop, no lock needed
+        self.mailboxes = {}
+        self.num_queued = 0
+        self.total_dropped = 0
+        self.total_rejected = 0
+
+        # cam_id -> (shm name, SharedMemoryManager) of the CVCapture frame ring
+        self.shm_mutex = threading.Lock()
+        self.shared_memories = {}
+
+    async def predict_async(self, cam_id, data, decode=None):
+        """Decode and predict data off the event loop.
+
+        decode turns data into the frame, the default takes an encoded
+        image or, with IS_OPENCV, raw 960-wide BGR bytes.
+
+        A camera has at most one frame running and one waiting. A newer
+        frame replaces the waiting one, whose caller gets None back.
+
+        Raises:
+            Overloaded: PREDICT_MAX_QUEUED frames are already waiting.
+        """
+        mailbox = self.mailboxes.setdefault(cam_id, CameraMailbox())
+        future = asyncio.get_event_loop().create_future()
+
+        if mailbox.pending is not None:
+            # superseded, the newer frame takes its place in the queue
+            mailbox.pending[2].set_result(None)
+            self.total_dropped += 1
+            count("dropped_frames", cam_id=cam_id)
+        elif mailbox.is_running:
+            if self.num_queued >= self.max_queued:
+                self.total_rejected += 1
+                count("rejected_frames", cam_id=cam_id)
+                raise Overloaded()
+            self.num_queued += 1
+            set_gauge("http_queued", self.num_queued)
+        mailbox.pending = (data, decode, future, time.time())
+
+        if not mailbox.is_running:
+            mailbox.is_running = True
+            asyncio.ensure_future(self._drain(cam_id, mailbox))
+        return await future
+
+    async def _drain(self, cam_id, mailbox):
+        loop = asyncio.get_event_loop()
+        try:
+            is_queued = False
+            while mailbox.pending is not None:
+                data, decode, future, queued_time = mailbox.pending
+                mailbox.pending = None
+                if is_queued:
+                    self.num_queued -= 1
+                    set_gauge("http_queued", self.num_queued)
+                is_queued = True
+                observe("http_queue", time.time() - queued_time, cam_id)
+                try:
+                    results = await loop.run_in_executor(
+                        self.executor, self.decode_and_predict, cam_id, data, decode
+                    )
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+                if not future.done():
+                    future.set_result(results)
+        finally:
+            mailbox.is_running = False
+            if not self.stream_manager.get_stream_by_id_danger(cam_id):
+                self.mailboxes.pop(cam_id, None)
+                with self.shm_mutex:
+                    self.shared_memories.pop(cam_id, None)
+
+    def decode_and_predict(self, cam_id, data, decode=None):
+        if decode is None:
+            decode = self.decode_raw
+        with timed("decode", cam_id):
+            img = decode(cam_id, data)
+        return self.predict(cam_id, img)
+
+    def decode_raw(self, cam_id, img_raw):
+        if IS_OPENCV == "true":
+            nparr = np.frombuffer(img_raw, np.uint8)
+            return nparr.reshape(-1, 960, 3)
+        return cv2.imdecode(np.frombuffer(img_raw, dtype=np.uint8), -1)
+
+    def read_shared_frame(self, cam_id, descriptor):
+        """Map the frame a CVCapture frame ring descriptor points to.
+
+        No copy is made, CVCapture keeps the slot until the request that
+        carried the descriptor has been answered.
+        """
+        name = descriptor["shm_name"]
+        with self.shm_mutex:
+            entry = self.shared_memories.get(cam_id)
+            if entry is None or entry[0] != name:
+                # first frame, or the stream was restarted with a new ring
+                shm = SharedMemoryManager(name=name, size=descriptor["shm_size"])
+                entry = (name, shm)
+                self.shared_memories[cam_id] = entry
+        shape = descriptor["shape"]
+        frame = entry[1].ReadBytes(descriptor["offset"], int(np.prod(shape)))
+        return np.frombuffer(frame, dtype=np.uint8).reshape(shape)
+
+    def get_metrics(self):
+        return {
+            "queued": self.num_queued,
+            "max_queued": self.max_queued,
+            "total_dropped": self.total_dropped,
+            "total_rejected": self.total_rejected,
+        }
 
     def predict(self, cam_id, img):
         """predict.
@@ -21,6 +164,7 @@ class HttpInferenceEngine:
             logger.info("Stream not ready yet.")
             return []
 
+        predictions = []
         try:
             stream.predict(img)
             predictions = stream.last_prediction
@@ -28,6 +172,7 @@ class HttpInferenceEngine:
         except:
             logger.error("Unexpected error: %s", sys.exc_info())
 
+        respond_start = time.time()
         results = []
         for prediction in predictions:
             tag_name = prediction["tagName"]
@@ -47,4 +192,5 @@ class HttpInferenceEngine:
                     },
                 }
             )
+        observe("respond", time.time() - respond_start, cam_id)
         return results
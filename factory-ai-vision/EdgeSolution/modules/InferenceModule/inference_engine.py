@@ -1,6 +1,7 @@
 import logging
 import multiprocessing as mp
 import os
+import queue
 import sys
 import threading
 import time
@@ -15,6 +16,7 @@ import extension_pb2_grpc
 import inferencing_pb2
 import media_pb2
 from exception_handler import PrintGetExceptionDetails
+from instrumentation import count, observe, set_gauge, timed
 from model_wrapper import ONNXRuntimeModelDeploy
 from shared_memory import SharedMemoryManager
 
@@ -23,6 +25,12 @@ from shared_memory import SharedMemoryManager
 # DEBUG = os.getenv('DEBUG')
 DEBUG_OUTPUT_FOLDER = "/lvaextensiondebug"
 
+# Frames in flight per gRPC client, 1 handles them strictly one by one
+GRPC_PIPELINE_DEPTH = int(os.environ.get("GRPC_PIPELINE_DEPTH", 2))
+# Frames later than this behind real time are acked without inference
+# when a newer frame is already waiting, 0 never skips
+GRPC_MAX_LAG_MS = float(os.environ.get("GRPC_MAX_LAG_MS", 500))
+
 
 class TransferType(Enum):
     BYTES = 1  # Embedded Content
@@ -66,6 +74,19 @@ class State:
             raise
 
 
+class PipelineJob:
+    """A MediaStreamMessage moving through the decode/infer/respond stages."""
+
+    def __init__(self, request):
+        self.request = request
+        self.received_time = time.time()
+        self.decoded_time = None
+        self.image = None
+        self.predictions = []
+        self.is_skipped = False
+        self.done = threading.Event()
+
+
 class InferenceEngine(extension_pb2_grpc.MediaGraphExtensionServicer):
     def __init__(self, stream_manager):
         # create ONNX model wrapper
@@ -267,6 +288,18 @@ class InferenceEngine(extension_pb2_grpc.MediaGraphExtensionServicer):
         )
         yield mediaStreamMessage
 
+        if GRPC_PIPELINE_DEPTH > 1:
+            yield from self.ProcessMediaStreamPipelined(
+                requestIterator,
+                context,
+                clientState,
+                instance_id,
+                stream,
+                responseSeqNum,
+            )
+            logging.info("Connection closed with peer {}.".format(context.peer()))
+            return
+
         total_time = []
         # Process rest of the MediaStream message sequence
         for mediaStreamMessageRequest in requestIterator:
@@ -276,14 +309,14 @@ class InferenceEngine(extension_pb2_grpc.MediaGraphExtensionServicer):
             # Read request id, sent by client
             requestSeqNum = mediaStreamMessageRequest.sequence_number
 
-            logging.warning("[Received] SeqNum: {:07d}".format(requestSeqNum))
+            logging.debug("[Received] SeqNum: {:07d}".format(requestSeqNum))
             s1 = time.time()
             # Get media content bytes. (bytes sent over shared memory buffer, segment or inline to message)
             cvImage = self.GetCvImageFromRawBytes(
                 clientState, mediaStreamMessageRequest.media_sample
             )
             e1 = time.time() - s1
-            logging.info("GetCvImageFromRawBytes time: {}".format(e1))
+            observe("grpc_decode", e1, instance_id)
 
             if cvImage is None:
                 message = "Can't decode received bytes."
@@ -315,7 +348,8 @@ class InferenceEngine(extension_pb2_grpc.MediaGraphExtensionServicer):
             else:
                 try:
                     # s2 = time.time()
-                    stream.predict(cvImage)
+                    with timed("grpc_infer", instance_id):
+                        stream.predict(cvImage)
                     predictions = stream.last_prediction
                     # e2 = time.time() - s2
                     # logging.info('Inference time: {0}'.format(e2))
@@ -352,8 +386,146 @@ class InferenceEngine(extension_pb2_grpc.MediaGraphExtensionServicer):
                 ss = time.time()
                 yield mediaStreamMessage
                 ee = time.time() - ss
-                logging.info("^^^^^^^^^^ Yield time: {} ^^^^^^^^^^".format(ee))
+                observe("grpc_respond", ee, instance_id)
+                observe("grpc_total", time.time() - s1, instance_id)
             else:
                 break
 
         logging.info("Connection closed with peer {}.".format(context.peer()))
+
+    def ProcessMediaStreamPipelined(
+        self, requestIterator, context, clientState, instance_id, stream, responseSeqNum
+    ):
+        """Handle the frames of a client with the stages overlapped.
+
+        A reader thread decodes frame N+1 while an inference thread runs
+        frame N and this generator sends the response of frame N-1. At most
+        GRPC_PIPELINE_DEPTH frames are in flight, responses go out in the
+        order the requests came in, and every request is acked. A frame
+        more than GRPC_MAX_LAG_MS behind real time is acked with no
+        inferences if a newer frame is already waiting.
+        """
+        in_flight = queue.Queue(maxsize=GRPC_PIPELINE_DEPTH)
+        to_infer = queue.Queue()
+        stopped = threading.Event()
+
+        def put(q, job):
+            # give up once the generator is gone, nobody drains the queue
+            while not stopped.is_set():
+                try:
+                    q.put(job, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def decode():
+            try:
+                for request in requestIterator:
+                    if stopped.is_set():
+                        break
+                    job = PipelineJob(request)
+                    logging.debug(
+                        "[Received] SeqNum: {:07d}".format(request.sequence_number)
+                    )
+                    try:
+                        job.image = self.GetCvImageFromRawBytes(
+                            clientState, request.media_sample
+                        )
+                    except Exception:
+                        job.image = None
+                    job.decoded_time = time.time()
+                    observe(
+                        "grpc_decode", job.decoded_time - job.received_time, instance_id
+                    )
+                    put(in_flight, job)
+                    to_infer.put(job)
+                    set_gauge("grpc_in_flight", in_flight.qsize(), instance_id)
+            except Exception:
+                # client went away, the request iterator is cancelled
+                logging.info("Request stream ended with peer {}".format(context.peer()))
+            finally:
+                to_infer.put(None)
+                put(in_flight, None)
+
+        def infer():
+            _stream = stream
+            timescale = clientState._mediaStreamDescriptor.media_descriptor.timescale
+            clock = None
+            while True:
+                job = to_infer.get()
+                if job is None:
+                    break
+                if job.image is None or stopped.is_set():
+                    job.done.set()
+                    continue
+
+                # how far behind real time the frame is, by its media timestamp
+                lag = 0
+                if timescale:
+                    timestamp = job.request.media_sample.timestamp / timescale
+                    now = time.time()
+                    if clock is None or now - (clock[1] + timestamp - clock[0]) < 0:
+                        clock = (timestamp, job.received_time)
+                    lag = now - (clock[1] + timestamp - clock[0])
+                if (
+                    GRPC_MAX_LAG_MS > 0
+                    and lag * 1000 > GRPC_MAX_LAG_MS
+                    and not to_infer.empty()
+                ):
+                    job.is_skipped = True
+                    count("grpc_skipped_frames", cam_id=instance_id)
+                    job.done.set()
+                    continue
+
+                if not _stream:
+                    _stream = self.stream_manager.get_stream_by_id(instance_id)
+                    print("[INFO] Stream not ready yet", flush=True)
+                else:
+                    start = time.time()
+                    observe("grpc_queue", start - job.decoded_time, instance_id)
+                    try:
+                        _stream.predict(job.image)
+                        job.predictions = _stream.last_prediction
+                    except:
+                        print("[ERROR] Unexpected error:", sys.exc_info(), flush=True)
+                        job.predictions = []
+                    observe("grpc_infer", time.time() - start, instance_id)
+                job.done.set()
+
+        threading.Thread(target=decode, daemon=True).start()
+        threading.Thread(target=infer, daemon=True).start()
+
+        try:
+            while True:
+                job = in_flight.get()
+                if job is None:
+                    break
+                job.done.wait()
+
+                if job.image is None:
+                    message = "Can't decode received bytes."
+                    logging.info(message)
+                    context.set_details(message)
+                    context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                    return
+
+                # Check client connection state
+                if not context.is_active():
+                    break
+
+                responseSeqNum += 1
+                start = time.time()
+                mediaStreamMessage = self.GetMediaStreamMessageResponse(
+                    job.predictions, job.image.shape
+                )
+                mediaStreamMessage.sequence_number = responseSeqNum
+                mediaStreamMessage.ack_sequence_number = job.request.sequence_number
+                mediaStreamMessage.media_sample.timestamp = (
+                    job.request.media_sample.timestamp
+                )
+                yield mediaStreamMessage
+                observe("grpc_respond", time.time() - start, instance_id)
+                observe("grpc_total", time.time() - job.received_time, instance_id)
+        finally:
+            stopped.set()
+            set_gauge("grpc_in_flight", 0, instance_id)
@@ -0,0 +1,235 @@
+"""Instrumentation
+
+Latency histograms of the processing stages, event counters and gauges,
+shared by the whole module. Each series can carry the cam_id of the stream
+it belongs to.
+
+    with timed("decode", cam_id):
+        image = decode(...)
+
+Frame stages of a stream, in order: receive, decode, resize, score (batch
+wait included) with preprocess, inference and postprocess inside it,
+aoi_filter, scenario, draw, encode and respond. gRPC frames also have
+grpc_queue and grpc_total.
+
+/metrics returns the JSON snapshots, /metrics/openmetrics the same data in
+the OpenMetrics text format for Prometheus.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in ms, the last bucket takes everything above
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+OPENMETRICS_PREFIX = "inference_"
+
+
+class LatencyHistogram:
+    """Cumulative latency histogram with fixed buckets."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.mutex = threading.Lock()
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        ms = seconds * 1000
+        index = bisect.bisect_left(self.buckets, ms)
+        with self.mutex:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += ms
+
+    def get_state(self):
+        with self.mutex:
+            return list(self.counts), self.count, self.sum
+
+    def snapshot(self):
+        return snapshot(self.buckets, *self.get_state())
+
+
+def snapshot(buckets, counts, count, total):
+    cumulative_counts = {}
+    cumulative = 0
+    for bound, bucket_count in zip(buckets + ("+Inf",), counts):
+        cumulative += bucket_count
+        cumulative_counts[str(bound)] = cumulative
+    return {
+        "count": count,
+        "sum_ms": total,
+        "average_ms": total / count if count else 0,
+        "buckets": cumulative_counts,
+    }
+
+
+# Keyed by (name, cam_id), cam_id is None for series of the whole module
+_histograms = {}
+_histograms_mutex = threading.Lock()
+_counters = {}
+_gauges = {}
+
+
+def get_histogram(name, cam_id=None):
+    key = (name, cam_id)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        with _histograms_mutex:
+            histogram = _histograms.get(key)
+            if histogram is None:
+                histogram = _histograms[key] = LatencyHistogram()
+    return histogram
+
+
+def observe(name, seconds, cam_id=None):
+    get_histogram(name, cam_id).observe(seconds)
+
+
+@contextmanager
+def timed(name, cam_id=None):
+    start = time.time()
+    try:
+        yield
+    finally:
+        observe(name, time.time() - start, cam_id)
+
+
+def get_histograms(cam_id=None):
+    """Histogram snapshots by name.
+
+    Args:
+        cam_id: only the series of this stream, None merges the series of
+            all streams.
+    """
+    with _histograms_mutex:
+        histograms = dict(_histograms)
+    merged = {}
+    for (name, _cam_id), histogram in histograms.items():
+        if cam_id is not None and _cam_id != cam_id:
+            continue
+        counts, count, total = histogram.get_state()
+        if name in merged:
+            merged_counts, merged_count, merged_total = merged[name]
+            counts = [a + b for a, b in zip(merged_counts, counts)]
+            count += merged_count
+            total += merged_total
+        merged[name] = (counts, count, total)
+    return {
+        name: snapshot(LATENCY_BUCKETS_MS, *merged[name]) for name in sorted(merged)
+    }
+
+
+def count(name, value=1, cam_id=None):
+    with _histograms_mutex:
+        key = (name, cam_id)
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def get_counters(cam_id=None):
+    """Counters by name, same cam_id semantics as get_histograms."""
+    with _histograms_mutex:
+        counters = dict(_counters)
+    merged = {}
+    for (name, _cam_id), value in counters.items():
+        if cam_id is None or _cam_id == cam_id:
+            merged[name] = merged.get(name, 0) + value
+    return dict(sorted(merged.items()))
+
+
+def set_gauge(name, value, cam_id=None):
+    """Current value of something, like a queue depth."""
+    _gauges[(name, cam_id)] = value
+
+
+def get_gauges(cam_id=None):
+    gauges = dict(_gauges)
+    merged = {}
+    for (name, _cam_id), value in gauges.items():
+        if cam_id is None or _cam_id == cam_id:
+            merged[name] = merged.get(name, 0) + value
+    return dict(sorted(merged.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            '{}="{}"'.format(
+                key,
+                str(value)
+                .replace("\\", "\\\\")
+                .replace('"', '\\"')
+                .replace("\n", "\\n"),
+            )
+            for key, value in labels
+        )
+        + "}"
+    )
+
+
+def _series_labels(cam_id):
+    return [] if cam_id is None else [("cam_id", cam_id)]
+
+
+def render_openmetrics():
+    """All series in the OpenMetrics text format.
+
+    Stage latencies are one histogram family, in seconds, with the stage
+    and the cam_id as labels. Counters and gauges get a family each.
+    """
+    with _histograms_mutex:
+        histograms = sorted(
+            _histograms.items(), key=lambda item: (item[0][0], str(item[0][1]))
+        )
+        counters = sorted(
+            _counters.items(), key=lambda item: (item[0][0], str(item[0][1]))
+        )
+    gauges = sorted(
+        dict(_gauges).items(), key=lambda item: (item[0][0], str(item[0][1]))
+    )
+
+    lines = []
+    family = OPENMETRICS_PREFIX + "stage_latency_seconds"
+    lines.append("# TYPE {} histogram".format(family))
+    lines.append("# UNIT {} seconds".format(family))
+    lines.append("# HELP {} Latency of the frame processing stages.".format(family))
+    for (name, cam_id), histogram in histograms:
+        labels = [("stage", name)] + _series_labels(cam_id)
+        counts, total_count, total_ms = histogram.get_state()
+        cumulative = 0
+        for bound, bucket_count in zip(histogram.buckets + (None,), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound is None else repr(bound / 1000)
+            lines.append(
+                "{}_bucket{} {}".format(
+                    family, _format_labels(labels + [("le", le)]), cumulative
+                )
+            )
+        lines.append(
+            "{}_count{} {}".format(family, _format_labels(labels), total_count)
+        )
+        lines.append(
+            "{}_sum{} {!r}".format(family, _format_labels(labels), total_ms / 1000)
+        )
+
+    for kind, series in (("counter", counters), ("gauge", gauges)):
+        last_name = None
+        for (name, cam_id), value in series:
+            family = OPENMETRICS_PREFIX + name
+            if name != last_name:
+                lines.append("# TYPE {} {}".format(family, kind))
+                last_name = name
+            sample = family + "_total" if kind == "counter" else family
+            lines.append(
+                "{}{} {}".format(sample, _format_labels(_series_labels(cam_id)), value)
+            )
+
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
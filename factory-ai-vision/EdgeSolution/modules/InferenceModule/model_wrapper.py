@@ -14,9 +14,11 @@ import onnxruntime
 import requests
 from shapely.geometry import Polygon
 
+from batch_scheduler import BatchScheduler
 from exception_handler import PrintGetExceptionDetails
 from object_detection import ObjectDetection
-from onnxruntime_predict import ONNXRuntimeObjectDetection
+from onnxruntime_predict import ONNXRuntimeObjectDetection, load_model_bytes
+from session_pool import SessionPool, get_intra_op_num_threads, get_pool_size
 from utility import get_file_zip, normalize_rtsp
 
 IMG_WIDTH = 960
@@ -27,6 +29,17 @@ CPU_MAX_FRAME_RATE = 10
 
 LVA_MODE = os.environ.get("LVA_MODE", "grpc")
 
+# Cross-stream micro-batching, MAX_BATCH_SIZE=1 disables it
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 4))
+MAX_BATCH_WAIT_MS = float(os.environ.get("MAX_BATCH_WAIT_MS", 10))
+
+# Number of inference sessions and the onnxruntime threads of each session
+SESSION_POOL_SIZE = os.environ.get("SESSION_POOL_SIZE", "auto")
+SESSION_INTRA_OP_THREADS = os.environ.get("SESSION_INTRA_OP_THREADS", "auto")
+
+# Dummy frames run through a new model before it replaces the current one
+MODEL_WARMUP_RUNS = int(os.environ.get("MODEL_WARMUP_RUNS", 2))
+
 logger = logging.getLogger(__name__)
 
 
@@ -34,7 +47,13 @@ class ONNXRuntimeModelDeploy(ObjectDetection):
     """Object Detection class for ONNX Runtime
     """
 
-    def __init__(self, cam_type="video_file", model_dir="./default_model"):
+    def __init__(
+        self,
+        cam_type="video_file",
+        model_dir="./default_model",
+        max_batch_size=MAX_BATCH_SIZE,
+        session_pool_size=SESSION_POOL_SIZE,
+    ):
         self.lock = threading.Lock()
         #self.model = self.load_model(
         #    model_dir, is_default_model=True, is_scenario_model=False
@@ -42,6 +61,13 @@ class ONNXRuntimeModelDeploy(ObjectDetection):
         self.model = None
         self.model_uri = None
         self.model_downloading = False
+        self.model_update_lock = threading.Lock()
+        # sequence number of the latest update_model request
+        self.model_update_seq = 0
+        self.model_update_metrics = {}
+        # seconds spent in session.run, across model updates
+        self.session_time_mutex = threading.Lock()
+        self.total_session_time = 0
         self.lva_mode = LVA_MODE
 
         self.image_shape = [IMG_HEIGHT, IMG_WIDTH]
@@ -57,12 +83,35 @@ class ONNXRuntimeModelDeploy(ObjectDetection):
 
         self.is_gpu = onnxruntime.get_device() == "GPU"
 
+        self.pool_size = get_pool_size(
+            session_pool_size, is_cpu=self.get_device() == "cpu")
+        self.intra_op_num_threads = get_intra_op_num_threads(
+            SESSION_INTRA_OP_THREADS, self.pool_size
+        )
+        logger.info(
+            "Session pool: %s sessions, %s intra-op threads each",
+            self.pool_size,
+            self.intra_op_num_threads,
+        )
+
         if self.is_gpu:
             self.max_total_frame_rate = GPU_MAX_FRAME_RATE
         else:
             self.max_total_frame_rate = CPU_MAX_FRAME_RATE
+        # streams -> total fps, measured by the startup benchmark
+        self.measured_throughput = {}
         self.update_frame_rate_by_number_of_streams(1)
 
+        if max_batch_size > 1:
+            self.batch_scheduler = BatchScheduler(
+                self.ScoreBatch,
+                max_batch_size,
+                MAX_BATCH_WAIT_MS / 1000,
+                num_workers=self.pool_size,
+            )
+        else:
+            self.batch_scheduler = None
+
     @property
     def is_vpu(self):
         return self.get_device() == 'vpu'
@@ -91,7 +140,7 @@ class ONNXRuntimeModelDeploy(ObjectDetection):
 
     def update_frame_rate_by_number_of_streams(self, number_of_streams):
         if number_of_streams > 0:
-            self.frame_rate = max(1, int(self.max_total_frame_rate / number_of_streams))
+            self.frame_rate = max(1, int(self.get_total_frame_rate(number_of_streams) / number_of_streams))
             print("[INFO] set frame rate as", self.frame_rate, flush=True)
         else:
             print(
@@ -100,9 +149,31 @@ class ONNXRuntimeModelDeploy(ObjectDetection):
             )
         return self.frame_rate
 
+    def set_measured_throughput(self, throughput):
+        """Use benchmark results for the recommended frame rates.
+
+        Args:
+            throughput (dict): number of streams -> total frames per second.
+        """
+        if not throughput:
+            return
+        self.measured_throughput = dict(throughput)
+        self.set_max_total_frame_rate(max(1, max(throughput.values())))
+
+    def get_total_frame_rate(self, number_of_streams):
+        """Total frame rate number_of_streams streams can sustain."""
+        if not self.measured_throughput:
+            return self.max_total_frame_rate
+        # the closest measured stream count, the lower one on a tie
+        streams = min(
+            self.measured_throughput,
+            key=lambda n: (abs(n - number_of_streams), n),
+        )
+        return max(1, self.measured_throughput[streams])
+
     def get_recommended_frame_rate(self, number_of_streams):
         if number_of_streams > 0:
-            return max(1, int(self.max_total_frame_rate / number_of_streams))
+            return max(1, int(self.get_total_frame_rate(number_of_streams) / number_of_streams))
         else:
             return self.max_total_frame_rate
 
@@ -122,38 +193,70 @@ class ONNXRuntimeModelDeploy(ObjectDetection):
         logger.info("Updating Parts ... %s", parts)
         self.parts = parts
 
-    def load_model(self, model_dir, is_default_model, is_scenario_model):
+    def load_models(self, model_dir, is_default_model, is_scenario_model):
+        """Load one model instance per session of the pool."""
         if is_default_model:
             print("[INFO] Loading Default Model ...")
 
-            model = None
-
             with open(model_dir + str("/cvexport.manifest")) as f:
                 data = json.load(f)
 
             # FIXME to check whether we need to close the previous session
             if data["DomainType"] == "ObjectDetection":
-                model = ObjectDetection(data, model_dir, None)
-                return model
+                return [
+                    ObjectDetection(
+                        data,
+                        model_dir,
+                        None,
+                        intra_op_num_threads=self.intra_op_num_threads,
+                    )
+                    for _ in range(self.pool_size)
+                ]
 
         elif is_scenario_model:
             print("[INFO] Loading Default Model ...")
             with open(model_dir + "/labels.txt", "r") as f:
                 labels = [l.strip() for l in f.readlines()]
-            model = ONNXRuntimeObjectDetection(model_dir + "/model.onnx", labels)
-
-            return model
+            model_bytes = load_model_bytes(model_dir + "/model.onnx")
+            return [
+                ONNXRuntimeObjectDetection(
+                    model_dir + "/model.onnx",
+                    labels,
+                    intra_op_num_threads=self.intra_op_num_threads,
+                    model_bytes=model_bytes,
+                )
+                for _ in range(self.pool_size)
+            ]
 
         else:
             logger.info("Load Model ...")
             with open("model/labels.txt", "r") as f:
                 labels = [l.strip() for l in f.readlines()]
-            model = ONNXRuntimeObjectDetection("model/model.onnx", labels)
+            model_bytes = load_model_bytes("model/model.onnx")
+            models = [
+                ONNXRuntimeObjectDetection(
+                    "model/model.onnx",
+                    labels,
+                    intra_op_num_threads=self.intra_op_num_threads,
+                    model_bytes=model_bytes,
+                )
+                for _ in range(self.pool_size)
+            ]
             logger.info("Load Model, success")
 
-            return model
+            return models
 
-        return None
+        return []
+
+    def warm_up(self, models):
+        """Run dummy frames so the first real frames don't pay the
+        session's cold-start cost."""
+        image = np.zeros((IMG_HEIGHT, IMG_WIDTH, 3), dtype=np.uint8)
+        for model in models:
+            for _ in range(MODEL_WARMUP_RUNS):
+                model.predict_image(image)
+            if self.batch_scheduler:
+                model.predict_image_batch([image] * self.batch_scheduler.max_batch_size)
 
     def download_and_update_model(self, model_uri, MODEL_DIR):
         print("download_and_update_model.", flush=True)
@@ -183,7 +286,27 @@ class ONNXRuntimeModelDeploy(ObjectDetection):
 
         threading.Thread(target=run, args=(self, model_uri, MODEL_DIR,)).start()
 
-    def update_model(self, model_dir):
+    def update_model(self, model_dir, background=False):
+        """Load, warm up and swap in a new model.
+
+        Frames keep running on the current sessions until the new ones are
+        ready; frames already in flight finish on the session they hold.
+
+        Args:
+            model_dir (str): directory of the model to load.
+            background (bool): return at once and update in a thread.
+        """
+        with self.lock:
+            self.model_update_seq += 1
+            seq = self.model_update_seq
+        if background:
+            threading.Thread(
+                target=self._update_model, args=(model_dir, seq), daemon=True
+            ).start()
+        else:
+            self._update_model(model_dir, seq)
+
+    def _update_model(self, model_dir, seq):
         is_default_model = "default_model" in model_dir
         is_scenario_model = "scenario_models" in model_dir
 
@@ -193,17 +316,96 @@ class ONNXRuntimeModelDeploy(ObjectDetection):
             else:
                 model_dir += '/onnx'
 
-        model = self.load_model(model_dir, is_default_model, is_scenario_model)
+        # One update at a time, an update requested before the latest one
+        # is skipped, so the last request wins
+        with self.model_update_lock:
+            if seq != self.model_update_seq:
+                logger.info("Skip update to %s, a newer one is requested", model_dir)
+                return
+            t0 = time.time()
+            models = self.load_models(model_dir, is_default_model, is_scenario_model)
+            if not models:
+                logger.error("No model loaded from %s", model_dir)
+                return
+            t1 = time.time()
+            self.warm_up(models)
+            t2 = time.time()
+
+            # Protected by Mutex
+            self.lock.acquire()
+            self.model = SessionPool(models)
+            self.lock.release()
+            t3 = time.time()
+
+            self.model_update_metrics = {
+                "model_dir": model_dir,
+                "load_time": t1 - t0,
+                "warmup_time": t2 - t1,
+                "swap_time": t3 - t2,
+                "updated_at": t3,
+            }
+            logger.info(
+                "Model updated: load %.3fs, warm-up %.3fs, swap %.6fs",
+                t1 - t0,
+                t2 - t1,
+                t3 - t2,
+            )
+
+    def get_model_update_metrics(self):
+        return self.model_update_metrics
+
+    def Score(self, image, buffer=None):
+        """Predict one frame
 
-        # Protected by Mutex
-        self.lock.acquire()
-        self.model = model
-        self.lock.release()
+        Args:
+            image: the frame, at any resolution, it is resized once to the
+                model input size.
+            buffer (PreprocessBuffer): reusable input arrays of the stream.
+        """
 
-    def Score(self, image):
+        if self.batch_scheduler:
+            return self.batch_scheduler.submit(image, buffer)
 
-        self.lock.acquire()
-        predictions, inf_time = self.model.predict_image(image)
-        self.lock.release()
+        session_pool = self.model
+        # no model loaded yet
+        if session_pool is None:
+            return [], 0
+
+        with session_pool.checkout() as model:
+            predictions, inf_time = model.predict_image(image, buffer)
+        self.add_session_time(inf_time)
 
         return predictions, inf_time
+
+    def ScoreBatch(self, images, buffers=None):
+
+        session_pool = self.model
+        if session_pool is None:
+            return [[] for _ in images], 0
+
+        with session_pool.checkout() as model:
+            predictions, inf_time = model.predict_image_batch(images, buffers)
+        self.add_session_time(inf_time)
+
+        return predictions, inf_time
+
+    def add_session_time(self, inf_time):
+        with self.session_time_mutex:
+            self.total_session_time += inf_time
+
+    def get_total_session_time(self):
+        """Seconds the sessions spent running the model, without the
+        batch and session waits.
+        """
+        with self.session_time_mutex:
+            return self.total_session_time
+
+    def get_session_pool_metrics(self):
+        if self.model:
+            return self.model.get_metrics()
+        return {}
+
+    def get_batch_metrics(self):
+        if self.batch_scheduler:
+            return self.batch_scheduler.get_metrics()
+        return {}
@@ -0,0 +1,89 @@
+"""Motion Gate
+
+Skip the model for frames that look like the last scored one, e.g. while
+the conveyor is stopped. A frame is compared through a tiny grayscale
+signature of the watched region, the AOIs when the camera has some, and
+the stream reuses the predictions of the last scored frame when the mean
+pixel difference is below the threshold.
+"""
+
+import os
+import time
+
+import cv2
+import numpy as np
+
+# Opt-in, "true" to gate the model on frame changes
+MOTION_GATING = os.environ.get("MOTION_GATING", "false")
+# Mean absolute difference (0-255) of the signatures that counts as a change
+MOTION_GATE_THRESHOLD = float(os.environ.get("MOTION_GATE_THRESHOLD", 2.0))
+# A frame is scored at least this often, in seconds, whatever the change
+MOTION_GATE_MAX_SKIP_TIME = float(os.environ.get("MOTION_GATE_MAX_SKIP_TIME", 2.0))
+
+SIGNATURE_SIZE = (32, 18)
+
+
+class MotionGate:
+    """Decide per frame whether the model has to run."""
+
+    def __init__(
+        self,
+        threshold=MOTION_GATE_THRESHOLD,
+        max_skip_time=MOTION_GATE_MAX_SKIP_TIME,
+        size=SIGNATURE_SIZE,
+    ):
+        self.threshold = threshold
+        self.max_skip_time = max_skip_time
+        self.size = size
+        self.region = None
+
+        self.last_signature = None
+        self.last_score_time = 0
+        self.total_frames = 0
+        self.total_skipped = 0
+
+    def set_region(self, region):
+        """Only watch region, (x1, y1, x2, y2) of the frame, None for all of it."""
+        self.region = region
+        self.reset()
+
+    def reset(self):
+        """Score the next frame whatever it looks like."""
+        self.last_signature = None
+
+    def signature(self, image):
+        if self.region is not None:
+            x1, y1, x2, y2 = self.region
+            image = image[max(0, y1) : y2 + 1, max(0, x1) : x2 + 1]
+            if image.size == 0:
+                return None
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(image, self.size, interpolation=cv2.INTER_AREA).astype(
+            np.int16
+        )
+
+    def should_score(self, image):
+        """Whether image changed enough since the last scored frame."""
+        self.total_frames += 1
+        signature = self.signature(image)
+        now = time.time()
+        if (
+            signature is None
+            or self.last_signature is None
+            or now - self.last_score_time >= self.max_skip_time
+            or np.abs(signature - self.last_signature).mean() > self.threshold
+        ):
+            self.last_signature = signature
+            self.last_score_time = now
+            return True
+        self.total_skipped += 1
+        return False
+
+    def get_metrics(self):
+        return {
+            "threshold": self.threshold,
+            "max_skip_time": self.max_skip_time,
+            "total_frames": self.total_frames,
+            "total_skipped": self.total_skipped,
+        }
@@ -8,19 +8,26 @@ import cv2
 import onnxruntime
 import time
 import logging
+from onnxruntime.capi.onnxruntime_pybind11_state import InvalidArgument
+
+from postprocess import extract_bb, logistic, non_maximum_suppression, postprocess
+from instrumentation import observe, timed
+from preprocess import BGR_TO_BGR, BGR_TO_RGB, to_tensor
 
 
 class ObjectDetection(object):
     """Class for Custom Vision's exported object detection model
     """
 
-    def __init__(self, data, model_dir, labels=None, prob_threshold=0.10, max_detections=20):
+    def __init__(self, data, model_dir, labels=None, prob_threshold=0.10, max_detections=20,
+                 intra_op_num_threads=0):
         """Initialize the class
 
         Args:
             labels ([str]): list of labels for the exported model.
             prob_threshold (float): threshold for class probability.
             max_detections (int): the max number of output results.
+            intra_op_num_threads (int): threads used by the session, 0 for the onnxruntime default.
         """
 
         print("Call: Constructor: ObjectDetection.__init__")
@@ -74,6 +81,9 @@ class ObjectDetection(object):
             self.input_format = "RGB"
 
         self.session = None
+        # False once the model refused a batch, e.g. batch size baked in
+        self.supports_batch = True
+        self.intra_op_num_threads = intra_op_num_threads
         self.onnxruntime_session_init(model_dir)
 
     def onnxruntime_session_init(self, model_dir):
@@ -87,8 +97,11 @@ class ObjectDetection(object):
         #super(ObjectDetection, self).__init__(labels)
         print("\n Triggering Inference...")
 
+        sess_options = onnxruntime.SessionOptions()
+        if self.intra_op_num_threads > 0:
+            sess_options.intra_op_num_threads = self.intra_op_num_threads
         self.session = onnxruntime.InferenceSession(
-            str(str(model_dir) + str('/') + str(self.model_filename)))
+            str(str(model_dir) + str('/') + str(self.model_filename)), sess_options)
 
         # Reading input width & height from onnx model file
         self.model_inp_width = self.session.get_inputs()[0].shape[2]
@@ -100,133 +113,53 @@ class ObjectDetection(object):
             print("Press Ctl+C to exit...")
 
     def _logistic(self, x):
-        return np.where(x > 0, 1 / (1 + np.exp(-x)), np.exp(x) / (1 + np.exp(x)))
+        return logistic(x)
 
     def _non_maximum_suppression(self, boxes, class_probs, max_detections):
         """Remove overlapping bouding boxes
         """
-        assert len(boxes) == len(class_probs)
-
-        max_detections = min(max_detections, len(boxes))
-        max_probs = np.amax(class_probs, axis=1)
-        max_classes = np.argmax(class_probs, axis=1)
-
-        areas = boxes[:, 2] * boxes[:, 3]
-
-        selected_boxes = []
-        selected_classes = []
-        selected_probs = []
-
-        while len(selected_boxes) < max_detections:
-            # Select the prediction with the highest probability.
-            i = np.argmax(max_probs)
-            if max_probs[i] < self.prob_threshold:
-                break
-
-            # Save the selected prediction
-            selected_boxes.append(boxes[i])
-            selected_classes.append(max_classes[i])
-            selected_probs.append(max_probs[i])
-
-            box = boxes[i]
-            other_indices = np.concatenate(
-                (np.arange(i), np.arange(i + 1, len(boxes))))
-            other_boxes = boxes[other_indices]
-
-            # Get overlap between the 'box' and 'other_boxes'
-            x1 = np.maximum(box[0], other_boxes[:, 0])
-            y1 = np.maximum(box[1], other_boxes[:, 1])
-            x2 = np.minimum(box[0] + box[2],
-                            other_boxes[:, 0] + other_boxes[:, 2])
-            y2 = np.minimum(box[1] + box[3],
-                            other_boxes[:, 1] + other_boxes[:, 3])
-            w = np.maximum(0, x2 - x1)
-            h = np.maximum(0, y2 - y1)
-
-            # Calculate Intersection Over Union (IOU)
-            overlap_area = w * h
-            iou = overlap_area / \
-                (areas[i] + areas[other_indices] - overlap_area)
-
-            # Find the overlapping predictions
-            overlapping_indices = other_indices[np.where(
-                iou > self.iou_threshold)[0]]
-            overlapping_indices = np.append(overlapping_indices, i)
-
-            # Set the probability of overlapping predictions to zero, and udpate max_probs and max_classes.
-            class_probs[overlapping_indices, max_classes[i]] = 0
-            max_probs[overlapping_indices] = np.amax(
-                class_probs[overlapping_indices], axis=1)
-            max_classes[overlapping_indices] = np.argmax(
-                class_probs[overlapping_indices], axis=1)
-
-        assert len(selected_boxes) == len(selected_classes) and len(
-            selected_boxes) == len(selected_probs)
-        return selected_boxes, selected_classes, selected_probs
+        return non_maximum_suppression(boxes, class_probs, max_detections,
+                                       self.prob_threshold, self.iou_threshold)
 
     def _extract_bb(self, prediction_output, anchors):
-        assert len(prediction_output.shape) == 3
-        num_anchor = anchors.shape[0]
-        height, width, channels = prediction_output.shape
-        assert channels % num_anchor == 0
-
-        num_class = int(channels / num_anchor) - 5
-        assert num_class == len(self.labels)
-
-        outputs = prediction_output.reshape((height, width, num_anchor, -1))
-
-        # Extract bouding box information
-        x = (self._logistic(outputs[..., 0]) +
-             np.arange(width)[np.newaxis, :, np.newaxis]) / width
-        y = (self._logistic(
-            outputs[..., 1]) + np.arange(height)[:, np.newaxis, np.newaxis]) / height
-        w = np.exp(outputs[..., 2]) * anchors[:,
-                                              0][np.newaxis, np.newaxis, :] / width
-        h = np.exp(outputs[..., 3]) * anchors[:,
-                                              1][np.newaxis, np.newaxis, :] / height
-
-        # (x,y) in the network outputs is the center of the bounding box. Convert them to top-left.
-        x = x - w / 2
-        y = y - h / 2
-        boxes = np.stack((x, y, w, h), axis=-1).reshape(-1, 4)
-
-        # Get confidence for the bounding boxes.
-        objectness = self._logistic(outputs[..., 4])
-
-        # Get class probabilities for the bounding boxes.
-        class_probs = outputs[..., 5:]
-        class_probs = np.exp(
-            class_probs - np.amax(class_probs, axis=3)[..., np.newaxis])
-        class_probs = class_probs / \
-            np.sum(class_probs, axis=3)[...,
-                                        np.newaxis] * objectness[..., np.newaxis]
-        class_probs = class_probs.reshape(-1, num_class)
-
-        assert len(boxes) == len(class_probs)
-        return (boxes, class_probs)
-
-    def predict_image(self, image):
+        return extract_bb(prediction_output, anchors, len(self.labels))
+
+    def predict_image(self, image, buffer=None):
         logging.info('predict_image')
-        inputs = self.preprocess(image)
+        with timed("preprocess"):
+            inputs = self.preprocess(image, buffer)
         prediction_outputs, infer_time = self.predict(inputs)
+        observe("inference", infer_time)
         # boxes, scores, indices = self.predict(inputs)
         return self.postprocess(prediction_outputs), infer_time
         # return boxes, scores, indices
 
-    def preprocess(self, image):
+    def predict_image_batch(self, images, buffers=None):
+        """Predict several images, returns one list of predictions per image
+        and the inference time of the whole batch
+        """
+        if buffers is None:
+            buffers = [None] * len(images)
+        with timed("preprocess"):
+            inputs = [self.preprocess(image, buffer) for image, buffer in zip(images, buffers)]
+        prediction_outputs, infer_time = self.predict_batch(inputs)
+        observe("inference", infer_time)
+        return [self.postprocess(outputs) for outputs in prediction_outputs], infer_time
+
+    def preprocess(self, image, buffer=None):
+        """Resize the frame to the model input size and write the NCHW tensor
+
+        Args:
+            image: BGR frame, or a 2D frame for GRAY models.
+            buffer (PreprocessBuffer): reusable arrays of the calling stream.
+        """
         logging.info('pre')
-        if self.input_format == "RGB":
-            image = cv2.resize(
-                image, (int(self.model_inp_width), int(self.model_inp_height)))
-        elif self.input_format == "BGR":
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            image = cv2.resize(
-                image, (int(self.model_inp_width), int(self.model_inp_height)))
-        elif self.input_format == "GRAY":
-            image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
-            image = cv2.resize(
-                image, (int(self.model_inp_width), int(self.model_inp_height)))
-        return image
+        if self.input_format == "BGR":
+            channel_order = BGR_TO_BGR
+        else:
+            channel_order = BGR_TO_RGB
+        return to_tensor(image, int(self.model_inp_width), int(self.model_inp_height),
+                         channel_order, np.float32, buffer)
 
     def predict(self, preprocessed_inputs):
         """Evaluate the model and get the output
@@ -234,12 +167,9 @@ class ObjectDetection(object):
         Need to be implemented for each platforms. i.e. TensorFlow, CoreML, etc.
         """
         logging.info('predict')
-        inputs = np.array(preprocessed_inputs, dtype=np.float32)[
-            np.newaxis, :, :, (2, 1, 0)]  # RGB -> BGR
-        inputs = np.ascontiguousarray(np.rollaxis(inputs, 3, 1))
         start = time.time()
         # outputs = self.session.run(None, {self.input_name: inputs})
-        outputs = self.session.run(None, {self.input_name: inputs})
+        outputs = self.session.run(None, {self.input_name: preprocessed_inputs})
         # logging.info(outputs[0])
         # logging.info(np.squeeze(outputs).transpose((1, 2, 0)))
 
@@ -248,6 +178,30 @@ class ObjectDetection(object):
         return np.squeeze(outputs).transpose((1, 2, 0)), inference_time
         # return boxes, scores, indices
 
+    def predict_batch(self, preprocessed_inputs):
+        """Evaluate the model on a list of inputs
+
+        The exported model has a fixed input shape, batch size included, so
+        a batch that cannot be run in one call falls back to one call per input,
+        for this batch and the next ones.
+        """
+        start = time.time()
+        outputs = None
+        if len(preprocessed_inputs) > 1 and self.supports_batch:
+            inputs = np.concatenate(preprocessed_inputs)
+            try:
+                outputs = self.session.run(None, {self.input_name: inputs})[0]
+            except InvalidArgument:
+                logging.warning('Model does not support batch inference, running inputs one by one')
+                self.supports_batch = False
+        if outputs is None:
+            outputs = np.concatenate([
+                self.session.run(None, {self.input_name: inputs})[0]
+                for inputs in preprocessed_inputs
+            ])
+        inference_time = time.time() - start
+        return [output.transpose((1, 2, 0)) for output in outputs], inference_time
+
     def postprocess(self, prediction_outputs):
         """ Extract bounding boxes from the model outputs.
 
@@ -258,25 +212,8 @@ class ObjectDetection(object):
             List of Prediction objects.
         """
         logging.info('post')
-        boxes, class_probs = self._extract_bb(prediction_outputs, self.anchors)
-
-        # Remove bounding boxes whose confidence is lower than the threshold.
-        max_probs = np.amax(class_probs, axis=1)
-        index, = np.where(max_probs > self.prob_threshold)
-        index = index[(-max_probs[index]).argsort()]
-
-        # Remove overlapping bounding boxes
-        selected_boxes, selected_classes, selected_probs = self._non_maximum_suppression(boxes[index],
-                                                                                         class_probs[index],
-                                                                                         self.max_detections)
-
-        return [{'probability': round(float(selected_probs[i]), 8),
-                 'tagId': int(selected_classes[i]),
-                 'tagName': self.labels[selected_classes[i]],
-                 'boundingBox': {
-                     'left': round(float(selected_boxes[i][0]), 8),
-                     'top': round(float(selected_boxes[i][1]), 8),
-                     'width': round(float(selected_boxes[i][2]), 8),
-                     'height': round(float(selected_boxes[i][3]), 8)
-        }
-        } for i in range(len(selected_boxes))]
+        with timed("postprocess"):
+            predictions = postprocess(prediction_outputs, self.anchors, self.labels,
+                                      self.prob_threshold, self.iou_threshold, self.max_detections)
+
+        return predictions
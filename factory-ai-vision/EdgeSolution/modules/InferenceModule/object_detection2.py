@@ -8,7 +8,10 @@ import math
 import time
 import cv2
 import logging
-from PIL import Image
+
+from postprocess import extract_bb, logistic, non_maximum_suppression, postprocess
+from instrumentation import observe, timed
+from preprocess import BGR_TO_BGR, to_tensor
 
 
 class ObjectDetection(object):
@@ -19,6 +22,8 @@ class ObjectDetection(object):
                        3.34, 5.47], [7.88, 3.53], [9.77, 9.17]])
     IOU_THRESHOLD = 0.45
     DEFAULT_INPUT_SIZE = 512 * 512
+    # Set by subclasses whose model takes float16 inputs
+    input_dtype = np.float32
 
     def __init__(self, labels, prob_threshold=0.10, max_detections=20):
         """Initialize the class
@@ -34,146 +39,67 @@ class ObjectDetection(object):
         self.labels = labels
         self.prob_threshold = prob_threshold
         self.max_detections = max_detections
-        self.pre = []
-        self.inf = []
-        self.post = []
 
     def _logistic(self, x):
-        return np.where(x > 0, 1 / (1 + np.exp(-x)), np.exp(x) / (1 + np.exp(x)))
+        return logistic(x)
 
     def _non_maximum_suppression(self, boxes, class_probs, max_detections):
         """Remove overlapping bouding boxes
         """
-        assert len(boxes) == len(class_probs)
-
-        max_detections = min(max_detections, len(boxes))
-        max_probs = np.amax(class_probs, axis=1)
-        max_classes = np.argmax(class_probs, axis=1)
-
-        areas = boxes[:, 2] * boxes[:, 3]
-
-        selected_boxes = []
-        selected_classes = []
-        selected_probs = []
-
-        while len(selected_boxes) < max_detections:
-            # Select the prediction with the highest probability.
-            i = np.argmax(max_probs)
-            if max_probs[i] < self.prob_threshold:
-                break
-
-            # Save the selected prediction
-            selected_boxes.append(boxes[i])
-            selected_classes.append(max_classes[i])
-            selected_probs.append(max_probs[i])
-
-            box = boxes[i]
-            other_indices = np.concatenate(
-                (np.arange(i), np.arange(i + 1, len(boxes))))
-            other_boxes = boxes[other_indices]
-
-            # Get overlap between the 'box' and 'other_boxes'
-            x1 = np.maximum(box[0], other_boxes[:, 0])
-            y1 = np.maximum(box[1], other_boxes[:, 1])
-            x2 = np.minimum(box[0] + box[2],
-                            other_boxes[:, 0] + other_boxes[:, 2])
-            y2 = np.minimum(box[1] + box[3],
-                            other_boxes[:, 1] + other_boxes[:, 3])
-            w = np.maximum(0, x2 - x1)
-            h = np.maximum(0, y2 - y1)
-
-            # Calculate Intersection Over Union (IOU)
-            overlap_area = w * h
-            iou = overlap_area / \
-                (areas[i] + areas[other_indices] - overlap_area)
-
-            # Find the overlapping predictions
-            overlapping_indices = other_indices[np.where(
-                iou > self.IOU_THRESHOLD)[0]]
-            overlapping_indices = np.append(overlapping_indices, i)
-
-            # Set the probability of overlapping predictions to zero, and udpate max_probs and max_classes.
-            class_probs[overlapping_indices, max_classes[i]] = 0
-            max_probs[overlapping_indices] = np.amax(
-                class_probs[overlapping_indices], axis=1)
-            max_classes[overlapping_indices] = np.argmax(
-                class_probs[overlapping_indices], axis=1)
-
-        assert len(selected_boxes) == len(selected_classes) and len(
-            selected_boxes) == len(selected_probs)
-        return selected_boxes, selected_classes, selected_probs
+        return non_maximum_suppression(boxes, class_probs, max_detections,
+                                       self.prob_threshold, self.IOU_THRESHOLD)
 
     def _extract_bb(self, prediction_output, anchors):
-        assert len(prediction_output.shape) == 3
-        num_anchor = anchors.shape[0]
-        height, width, channels = prediction_output.shape
-        assert channels % num_anchor == 0
-
-        num_class = int(channels / num_anchor) - 5
-        assert num_class == len(self.labels)
-
-        outputs = prediction_output.reshape((height, width, num_anchor, -1))
-
-        # Extract bouding box information
-        x = (self._logistic(outputs[..., 0]) +
-             np.arange(width)[np.newaxis, :, np.newaxis]) / width
-        y = (self._logistic(
-            outputs[..., 1]) + np.arange(height)[:, np.newaxis, np.newaxis]) / height
-        w = np.exp(outputs[..., 2]) * anchors[:,
-                                              0][np.newaxis, np.newaxis, :] / width
-        h = np.exp(outputs[..., 3]) * anchors[:,
-                                              1][np.newaxis, np.newaxis, :] / height
-
-        # (x,y) in the network outputs is the center of the bounding box. Convert them to top-left.
-        x = x - w / 2
-        y = y - h / 2
-        boxes = np.stack((x, y, w, h), axis=-1).reshape(-1, 4)
-
-        # Get confidence for the bounding boxes.
-        objectness = self._logistic(outputs[..., 4])
-
-        # Get class probabilities for the bounding boxes.
-        class_probs = outputs[..., 5:]
-        class_probs = np.exp(
-            class_probs - np.amax(class_probs, axis=3)[..., np.newaxis])
-        class_probs = class_probs / \
-            np.sum(class_probs, axis=3)[...,
-                                        np.newaxis] * objectness[..., np.newaxis]
-        class_probs = class_probs.reshape(-1, num_class)
-
-        assert len(boxes) == len(class_probs)
-        return (boxes, class_probs)
-
-    def predict_image(self, image):
-        start = time.time()
+        return extract_bb(prediction_output, anchors, len(self.labels))
 
-        # Convert to PIL
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        image = Image.fromarray(image)
+    def predict_image(self, image, buffer=None):
+        start = time.time()
 
-        inputs = self.preprocess(image)
+        inputs = self.preprocess(image, buffer)
         end_pre = time.time() - start
-        self.pre.append(end_pre)
+        observe("preprocess", end_pre)
         #logging.info('Preprocess time: {0}'.format(end_pre))
         start2 = time.time()
         prediction_outputs = self.predict(inputs)
 
         end = time.time()
         inference_time = end - start2
-        self.inf.append(inference_time)
+        observe("inference", inference_time)
         #logging.info('Inference time: {0}'.format(inference_time))
 
         return self.postprocess(prediction_outputs), inference_time
 
-    def preprocess(self, image):
-        image = image.convert("RGB") if image.mode != "RGB" else image
-        ratio = math.sqrt(self.DEFAULT_INPUT_SIZE / image.width / image.height)
-        new_width = int(image.width * ratio)
-        new_height = int(image.height * ratio)
+    def predict_image_batch(self, images, buffers=None):
+        """Predict several images with as few session runs as possible.
+
+        Returns:
+            (list of predictions, one per image, inference time of the batch)
+        """
+        if buffers is None:
+            buffers = [None] * len(images)
+        with timed("preprocess"):
+            inputs = [self.preprocess(image, buffer) for image, buffer in zip(images, buffers)]
+
+        start = time.time()
+        prediction_outputs = self.predict_batch(inputs)
+        inference_time = time.time() - start
+        observe("inference", inference_time)
+
+        return [self.postprocess(outputs) for outputs in prediction_outputs], inference_time
+
+    def preprocess(self, image, buffer=None):
+        """Resize the BGR frame and write the 1 x 3 x H x W input tensor.
+
+        The input keeps the aspect ratio of the frame, with about
+        DEFAULT_INPUT_SIZE pixels and both sides a multiple of 32.
+        """
+        height, width = image.shape[:2]
+        ratio = math.sqrt(self.DEFAULT_INPUT_SIZE / width / height)
+        new_width = int(width * ratio)
+        new_height = int(height * ratio)
         new_width = 32 * round(new_width / 32)
         new_height = 32 * round(new_height / 32)
-        image = image.resize((new_width, new_height))
-        return image
+        return to_tensor(image, new_width, new_height, BGR_TO_BGR, self.input_dtype, buffer)
 
     def predict(self, preprocessed_inputs):
         """Evaluate the model and get the output
@@ -182,6 +108,13 @@ class ObjectDetection(object):
         """
         raise NotImplementedError
 
+    def predict_batch(self, preprocessed_inputs):
+        """Evaluate the model on a list of inputs
+
+        Platforms without batch support fall back to one call per input.
+        """
+        return [self.predict(inputs) for inputs in preprocessed_inputs]
+
     def postprocess(self, prediction_outputs):
         """ Extract bounding boxes from the model outputs.
 
@@ -192,34 +125,10 @@ class ObjectDetection(object):
             List of Prediction objects.
         """
         start = time.time()
-        boxes, class_probs = self._extract_bb(prediction_outputs, self.ANCHORS)
-
-        # Remove bounding boxes whose confidence is lower than the threshold.
-        max_probs = np.amax(class_probs, axis=1)
-        index, = np.where(max_probs > self.prob_threshold)
-        index = index[(-max_probs[index]).argsort()]
-
-        # Remove overlapping bounding boxes
-        selected_boxes, selected_classes, selected_probs = self._non_maximum_suppression(boxes[index],
-                                                                                         class_probs[index],
-                                                                                         self.max_detections)
+        predictions = postprocess(prediction_outputs, self.ANCHORS, self.labels,
+                                  self.prob_threshold, self.IOU_THRESHOLD, self.max_detections)
 
         end_post = time.time() - start
-        self.post.append(end_post)
-        #logging.info('Postprocess time: {0}'.format(end_post))
-
-        #logging.info('***** avg *****')
-        #logging.info('[avg] pre: {0}, inf: {1}, post: {2}'.format(
-        #    np.mean(self.pre), np.mean(self.inf), np.mean(self.post)))
-        #logging.info('***** avg *****')
-
-        return [{'probability': round(float(selected_probs[i]), 8),
-                 'tagId': int(selected_classes[i]),
-                 'tagName': self.labels[selected_classes[i]],
-                 'boundingBox': {
-                     'left': round(float(selected_boxes[i][0]), 8),
-                     'top': round(float(selected_boxes[i][1]), 8),
-                     'width': round(float(selected_boxes[i][2]), 8),
-                     'height': round(float(selected_boxes[i][3]), 8)
-        }
-        } for i in range(len(selected_boxes))]
+        observe("postprocess", end_post)
+
+        return predictions
@@ -3,6 +3,7 @@
 # 2. resize network input size to (w', h')
 # 3. pass the image to network and do inference
 # (4. if inference speed is too slow for you, try to make w' x h' smaller, which is defined with DEFAULT_INPUT_SIZE (in object_detection.py or ObjectDetection.cs))
+import logging
 import os
 import sys
 import onnxruntime
@@ -10,34 +11,69 @@ import onnx
 import numpy as np
 from PIL import Image, ImageDraw
 from object_detection2 import ObjectDetection
-import tempfile
 
 MODEL_FILENAME = 'model/model.onnx'
 LABELS_FILENAME = 'model/labels.txt'
 
+logger = logging.getLogger(__name__)
+
+
+def load_model_bytes(model_filename):
+    """Load the model with dynamic batch/height/width input dimensions.
+
+    The serialized bytes can be shared by every session of a pool, so the
+    model only goes through onnx once and never touches the disk again.
+    """
+    model = onnx.load(model_filename)
+    model.graph.input[0].type.tensor_type.shape.dim[0].dim_param = 'batch'
+    model.graph.input[0].type.tensor_type.shape.dim[-1].dim_param = 'dim1'
+    model.graph.input[0].type.tensor_type.shape.dim[-2].dim_param = 'dim2'
+    return model.SerializeToString()
+
+
 class ONNXRuntimeObjectDetection(ObjectDetection):
     """Object Detection class for ONNX Runtime"""
-    def __init__(self, model_filename, labels):
+    def __init__(self, model_filename, labels, intra_op_num_threads=0, model_bytes=None):
         super(ONNXRuntimeObjectDetection, self).__init__(labels)
-        model = onnx.load(model_filename)
-        with tempfile.TemporaryDirectory() as dirpath:
-            temp = os.path.join(dirpath, os.path.basename(MODEL_FILENAME))
-            model.graph.input[0].type.tensor_type.shape.dim[-1].dim_param = 'dim1'
-            model.graph.input[0].type.tensor_type.shape.dim[-2].dim_param = 'dim2'
-            onnx.save(model, temp)
-            self.session = onnxruntime.InferenceSession(temp)
+        sess_options = onnxruntime.SessionOptions()
+        if intra_op_num_threads > 0:
+            sess_options.intra_op_num_threads = intra_op_num_threads
+        if model_bytes is None:
+            model_bytes = load_model_bytes(model_filename)
+        self.session = onnxruntime.InferenceSession(model_bytes, sess_options)
         self.input_name = self.session.get_inputs()[0].name
         self.is_fp16 = self.session.get_inputs()[0].type == 'tensor(float16)'
+        if self.is_fp16:
+            self.input_dtype = np.float16
+        self.supports_batch = True
 
     def predict(self, preprocessed_image):
-        inputs = np.array(preprocessed_image, dtype=np.float32)[np.newaxis,:,:,(2,1,0)] # RGB -> BGR
-        inputs = np.ascontiguousarray(np.rollaxis(inputs, 3, 1))
+        outputs = self.session.run(None, {self.input_name: preprocessed_image})
+        return np.squeeze(outputs).transpose((1,2,0)).astype(np.float32)
 
-        if self.is_fp16:
-            inputs = inputs.astype(np.float16)
+    def predict_batch(self, preprocessed_images):
+        """Run same-sized inputs together as one NCHW batch."""
+        groups = {}
+        for i, tensor in enumerate(preprocessed_images):
+            groups.setdefault(tensor.shape, []).append(i)
 
-        outputs = self.session.run(None, {self.input_name: inputs})
-        return np.squeeze(outputs).transpose((1,2,0)).astype(np.float32)
+        outputs = [None] * len(preprocessed_images)
+        for indices in groups.values():
+            if len(indices) > 1 and self.supports_batch:
+                try:
+                    batch = np.concatenate([preprocessed_images[i] for i in indices])
+                    results = self.session.run(None, {self.input_name: batch})[0]
+                    for j, i in enumerate(indices):
+                        outputs[i] = results[j].transpose((1,2,0)).astype(np.float32)
+                    continue
+                except Exception:
+                    # Some exported graphs have the batch size baked in
+                    logger.warning('Model does not support batch inference, running frames one by one')
+                    self.supports_batch = False
+            for i in indices:
+                results = self.session.run(None, {self.input_name: preprocessed_images[i]})
+                outputs[i] = np.squeeze(results).transpose((1,2,0)).astype(np.float32)
+        return outputs
 
 #def main(image_filename):
 #    # Load labels
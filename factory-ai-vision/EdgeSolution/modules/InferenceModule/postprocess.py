@@ -0,0 +1,207 @@
+"""Postprocess
+
+Vectorized YOLO region decoding and non-maximum suppression shared by
+object_detection.py and object_detection2.py.
+"""
+
+import os
+
+import numpy as np
+
+# Opt-in cap on the candidates kept for NMS, 0 for all of them. A frame with
+# more candidates above prob_threshold than this may get other results than
+# a full NMS.
+PRE_NMS_TOP_K = int(os.environ.get("PRE_NMS_TOP_K", 0)) or None
+
+
+def logistic(x):
+    """Numerically stable sigmoid with a single exp over the input."""
+    e = np.exp(-np.abs(x))
+    return np.where(x > 0, 1 / (1 + e), e / (1 + e))
+
+
+def extract_bb(prediction_output, anchors, num_labels, prob_threshold=None):
+    """Decode the region output into boxes and class probabilities.
+
+    Args:
+        prediction_output: Output from the object detection model. (H x W x C)
+        anchors: Anchor boxes. (num_anchor x 2)
+        num_labels (int): number of labels of the model.
+        prob_threshold (float): skip boxes whose objectness is not above it.
+            Class probabilities are scaled by objectness, so these boxes could
+            never pass the same threshold later on.
+
+    Returns:
+        (boxes, class_probs) in the [left, top, width, height] form, rows in
+        the same order as the full H x W x anchor grid.
+    """
+    assert len(prediction_output.shape) == 3
+    num_anchor = anchors.shape[0]
+    height, width, channels = prediction_output.shape
+    assert channels % num_anchor == 0
+
+    num_class = int(channels / num_anchor) - 5
+    assert num_class == num_labels
+
+    outputs = prediction_output.reshape((-1, num_class + 5))
+    objectness = logistic(outputs[:, 4])
+
+    if prob_threshold is None:
+        index = np.arange(len(outputs))
+    else:
+        index = np.flatnonzero(objectness > prob_threshold)
+    outputs = outputs[index]
+    objectness = objectness[index]
+
+    # Position of each row in the (height, width, anchor) grid
+    anchor_index = index % num_anchor
+    grid_x = (index // num_anchor) % width
+    grid_y = index // (num_anchor * width)
+
+    x = (logistic(outputs[:, 0]) + grid_x) / width
+    y = (logistic(outputs[:, 1]) + grid_y) / height
+    w = np.exp(outputs[:, 2]) * anchors[anchor_index, 0] / width
+    h = np.exp(outputs[:, 3]) * anchors[anchor_index, 1] / height
+
+    # (x,y) in the network outputs is the center of the bounding box.
+    # Convert them to top-left.
+    x = x - w / 2
+    y = y - h / 2
+    boxes = np.stack((x, y, w, h), axis=-1)
+
+    # Get class probabilities for the bounding boxes.
+    class_probs = outputs[:, 5:]
+    class_probs = np.exp(class_probs - np.amax(class_probs, axis=1)[:, np.newaxis])
+    class_probs = (
+        class_probs
+        / np.sum(class_probs, axis=1)[:, np.newaxis]
+        * objectness[:, np.newaxis]
+    )
+
+    assert len(boxes) == len(class_probs)
+    return boxes, class_probs
+
+
+def iou_row(x1, y1, x2, y2, areas, i):
+    """IoU of box i against all boxes, corners and areas precomputed."""
+    w = np.maximum(0, np.minimum(x2[i], x2) - np.maximum(x1[i], x1))
+    h = np.maximum(0, np.minimum(y2[i], y2) - np.maximum(y1[i], y1))
+    overlap_area = w * h
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return overlap_area / (areas[i] + areas - overlap_area)
+
+
+def non_maximum_suppression(
+    boxes, class_probs, max_detections, prob_threshold, iou_threshold, top_k=None
+):
+    """Class-aware NMS
+
+    A selected box only suppresses the class it was selected for, an
+    overlapping box can still be picked later for another class.
+
+    Args:
+        boxes: candidate boxes, sorted by descending max class probability.
+        class_probs: class probabilities of the candidates.
+        max_detections (int): the max number of output results.
+        prob_threshold (float): threshold for class probability.
+        iou_threshold (float): boxes overlapping more than this are suppressed.
+        top_k (int): the max number of candidates considered, None for all.
+
+    Returns:
+        (selected_boxes, selected_classes, selected_probs)
+    """
+    assert len(boxes) == len(class_probs)
+
+    if top_k is not None:
+        boxes = boxes[:top_k]
+        class_probs = class_probs[:top_k]
+
+    max_detections = min(max_detections, len(boxes))
+    if max_detections == 0:
+        return [], [], []
+
+    class_probs = np.array(class_probs)
+    max_probs = np.amax(class_probs, axis=1)
+    max_classes = np.argmax(class_probs, axis=1)
+
+    # Corners and areas are computed once, each selection then costs a
+    # single vectorized IoU row over the remaining candidates
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = boxes[:, 0] + boxes[:, 2]
+    y2 = boxes[:, 1] + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+
+    selected_boxes = []
+    selected_classes = []
+    selected_probs = []
+
+    while len(selected_boxes) < max_detections:
+        # Select the prediction with the highest probability.
+        i = np.argmax(max_probs)
+        if max_probs[i] < prob_threshold:
+            break
+
+        # Save the selected prediction
+        selected_boxes.append(boxes[i])
+        selected_classes.append(max_classes[i])
+        selected_probs.append(max_probs[i])
+
+        # Set the probability of overlapping predictions to zero, and udpate
+        # max_probs and max_classes.
+        overlaps = iou_row(x1, y1, x2, y2, areas, i) > iou_threshold
+        # Every selected box overlaps itself
+        overlaps[i] = True
+        overlapping_indices = np.flatnonzero(overlaps)
+        class_probs[overlapping_indices, max_classes[i]] = 0
+        overlapping_probs = class_probs[overlapping_indices]
+        max_probs[overlapping_indices] = np.amax(overlapping_probs, axis=1)
+        max_classes[overlapping_indices] = np.argmax(overlapping_probs, axis=1)
+
+    assert len(selected_boxes) == len(selected_classes) and len(selected_boxes) == len(
+        selected_probs
+    )
+    return selected_boxes, selected_classes, selected_probs
+
+
+def postprocess(
+    prediction_outputs, anchors, labels, prob_threshold, iou_threshold, max_detections
+):
+    """Extract the predictions from the model outputs.
+
+    Returns:
+        List of Prediction objects.
+    """
+    boxes, class_probs = extract_bb(
+        prediction_outputs, anchors, len(labels), prob_threshold
+    )
+
+    # Remove bounding boxes whose confidence is lower than the threshold.
+    max_probs = np.amax(class_probs, axis=1) if len(class_probs) else np.empty(0)
+    (index,) = np.where(max_probs > prob_threshold)
+    index = index[(-max_probs[index]).argsort()]
+
+    # Remove overlapping bounding boxes
+    selected_boxes, selected_classes, selected_probs = non_maximum_suppression(
+        boxes[index],
+        class_probs[index],
+        max_detections,
+        prob_threshold,
+        iou_threshold,
+        top_k=PRE_NMS_TOP_K,
+    )
+
+    return [
+        {
+            "probability": round(float(selected_probs[i]), 8),
+            "tagId": int(selected_classes[i]),
+            "tagName": labels[selected_classes[i]],
+            "boundingBox": {
+                "left": round(float(selected_boxes[i][0]), 8),
+                "top": round(float(selected_boxes[i][1]), 8),
+                "width": round(float(selected_boxes[i][2]), 8),
+                "height": round(float(selected_boxes[i][3]), 8),
+            },
+        }
+        for i in range(len(selected_boxes))
+    ]
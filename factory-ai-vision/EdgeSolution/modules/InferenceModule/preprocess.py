@@ -0,0 +1,73 @@
+"""Preprocess
+
+Turn a camera frame into the NCHW input tensor of the model with a single
+resize, writing into buffers that are reused from one frame to the next.
+"""
+
+import cv2
+import numpy as np
+
+# Source channel written to each tensor channel, frames from cv2 are BGR
+BGR_TO_RGB = (2, 1, 0)
+BGR_TO_BGR = (0, 1, 2)
+
+
+class PreprocessBuffer:
+    """Reusable arrays of one stream.
+
+    A stream predicts one frame at a time and waits for the result, so the
+    tensor written for a frame is never touched again before the model is
+    done with it. The arrays are reallocated only when the model input
+    shape or dtype changes, e.g. after a model update.
+    """
+
+    def __init__(self):
+        self.arrays = {}
+
+    def get(self, name, shape, dtype):
+        array = self.arrays.get(name)
+        if array is None or array.shape != shape or array.dtype != dtype:
+            array = np.empty(shape, dtype=dtype)
+            self.arrays[name] = array
+        return array
+
+
+def to_tensor(
+    image, width, height, channel_order=BGR_TO_RGB, dtype=np.float32, buffer=None
+):
+    """Resize image to width x height and write it as a 1 x 3 x H x W tensor.
+
+    Args:
+        image: source frame, H x W x 3 (BGR) or H x W (GRAY).
+        width (int): model input width.
+        height (int): model input height.
+        channel_order: source channel of each tensor channel, the channel
+            swap happens while the tensor is written.
+        dtype: np.float32 or np.float16.
+        buffer (PreprocessBuffer): arrays to write into, None allocates
+            new ones.
+
+    Returns:
+        The tensor, owned by buffer.
+    """
+    if buffer is None:
+        buffer = PreprocessBuffer()
+
+    if image.shape[:2] == (height, width):
+        resized = image
+    else:
+        # INTER_AREA avoids aliasing when shrinking a full resolution frame
+        if width < image.shape[1]:
+            interpolation = cv2.INTER_AREA
+        else:
+            interpolation = cv2.INTER_LINEAR
+        resized = buffer.get("resized", (height, width) + image.shape[2:], image.dtype)
+        cv2.resize(image, (width, height), dst=resized, interpolation=interpolation)
+
+    tensor = buffer.get("tensor", (1, 3, height, width), np.dtype(dtype))
+    if resized.ndim == 2:
+        tensor[0, :] = resized
+    else:
+        for channel, source_channel in enumerate(channel_order):
+            tensor[0, channel] = resized[:, :, source_channel]
+    return tensor
@@ -0,0 +1,85 @@
+"""Relabel Sender
+
+Posts the relabel images of the streams to the WebModule from a thread of
+its own, as multipart JPEG bytes, so Stream.predict never waits for it.
+At most RELABEL_QUEUE_SIZE images wait to be sent, the newer ones are
+dropped while it is full.
+"""
+
+import logging
+import os
+import queue
+import threading
+
+import requests
+
+from instrumentation import count, timed
+
+# Images waiting to be sent, at most
+RELABEL_QUEUE_SIZE = int(os.environ.get("RELABEL_QUEUE_SIZE", 10))
+RELABEL_TIMEOUT = 10
+
+logger = logging.getLogger(__name__)
+
+
+class RelabelSender:
+    def __init__(self, endpoint, queue_size=RELABEL_QUEUE_SIZE):
+        """
+        Args:
+            endpoint (str): the upload_relabel_image url of the WebModule.
+        """
+        self.endpoint = endpoint
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.session = requests.Session()
+
+        self.total_sent = 0
+        self.total_failed = 0
+        self.total_dropped = 0
+
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def send(self, jpg, tag, labels, confidence, cam_id):
+        """Queue a relabel image, never blocks."""
+        try:
+            self.queue.put_nowait((jpg, tag, labels, confidence, cam_id))
+        except queue.Full:
+            self.total_dropped += 1
+            count("relabel_dropped", cam_id=cam_id)
+
+    def _run(self):
+        while True:
+            jpg, tag, labels, confidence, cam_id = self.queue.get()
+            logger.info("Sending Image to relabeling %s", tag)
+            try:
+                with timed("relabel_send", cam_id):
+                    res = self.session.post(
+                        self.endpoint,
+                        data={
+                            "confidence": confidence,
+                            "labels": labels,
+                            "part_name": tag,
+                            "is_relabel": True,
+                            "camera_id": cam_id,
+                        },
+                        files={"img": ("relabel.jpg", jpg, "image/jpeg")},
+                        timeout=RELABEL_TIMEOUT,
+                    )
+            except requests.exceptions.RequestException:
+                logger.warning("Failed to update image for relabeling")
+                self.total_failed += 1
+                count("relabel_failed", cam_id=cam_id)
+                continue
+            if not res.ok:
+                logger.warning("Relabel image rejected: %s", res.text)
+                self.total_failed += 1
+                count("relabel_failed", cam_id=cam_id)
+                continue
+            self.total_sent += 1
+
+    def get_metrics(self):
+        return {
+            "queued": self.queue.qsize(),
+            "total_sent": self.total_sent,
+            "total_failed": self.total_failed,
+            "total_dropped": self.total_dropped,
+        }
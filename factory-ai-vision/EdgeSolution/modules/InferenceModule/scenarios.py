@@ -1,8 +1,10 @@
+import copy
 import time
 from collections import namedtuple
 
 import cv2
 
+from geometry import RectIndex, compute_centers
 from tracker import Line, Rect, Tracker
 from tracker import bb_intersection_over_union as compute_iou
 from utility import draw_label
@@ -10,6 +12,19 @@ from utility import draw_label
 Detection = namedtuple("Detection", ["tag", "x1", "y1", "x2", "y2", "score"])
 
 
+class TrackerSnapshot:
+    """The tracked objects of a Tracker at one time."""
+
+    def __init__(self, tracker):
+        self.objs, self.classes = copy.deepcopy(tracker.get_objs_and_classes())
+
+    def get_objs(self):
+        return self.objs
+
+    def get_objs_and_classes(self):
+        return self.objs, self.classes
+
+
 class Scenario:
     def __init__(self):
         pass
@@ -17,6 +32,14 @@ class Scenario:
     def update(self):
         raise NotImplementedError
 
+    def snapshot(self):
+        """A copy of what draw_counter and draw_objs read, for the renderer
+        thread while update goes on.
+        """
+        snapshot = copy.copy(self)
+        snapshot.tracker = TrackerSnapshot(self.tracker)
+        return snapshot
+
     def reset_metrics(self):
         raise NotImplementedError
 
@@ -25,33 +48,32 @@ class Scenario:
 
 class PartDetection(Scenario):
     def __init__(self, threshold=0.3, max_age=5, min_hits=2, iou_threshold=0.3):
-        #self.tracker = Tracker(
-        #    max_age=max_age, min_hits=min_hits, iou_threshold=iou_threshold
-        #)
+        # one tracker for all the parts, tracks only match their own part
+        self.tracker = Tracker(
+            max_age=max_age, min_hits=min_hits, iou_threshold=iou_threshold
+        )
         self.detected = {}
         self.counter = 0
         self.threshold = threshold
         self.max_age = max_age
         self.min_hits = min_hits
         self.iou_threshold = iou_threshold
-        self.trackers = {}
         self.parts = []
+        self.part_ids = {}
 
     def set_parts(self, parts):
         self.parts = parts
-        self.trackers = {}
-        for part in parts:
-            self.trackers[part] = Tracker(
-                max_age=self.max_age, min_hits=self.min_hits, iou_threshold=self.iou_threshold
-            )
+        self.part_ids = {part: i for i, part in enumerate(parts)}
+        self.tracker = Tracker(
+            max_age=self.max_age, min_hits=self.min_hits, iou_threshold=self.iou_threshold
+        )
         #print(self.parts)
 
     def update(self, detections):
-        for part in self.parts:
-            _detections = list(d for d in detections if (d.score > self.threshold and d.tag in self.parts))
-            _detections = list([d.x1, d.y1, d.x2, d.y2, d.score] for d in _detections)
-            self.trackers[part].update(_detections)
-            #objs = self.tracker.get_objs()
+        _detections = list(d for d in detections if (d.score > self.threshold and d.tag in self.part_ids))
+        classes = list(self.part_ids[d.tag] for d in _detections)
+        _detections = list([d.x1, d.y1, d.x2, d.y2, d.score] for d in _detections)
+        self.tracker.update(_detections, classes)
 
     def reset_metrics(self):
         return
@@ -66,25 +88,25 @@ class PartDetection(Scenario):
         return
 
     def draw_objs(self, img, is_id=True, is_rect=True):
-        for part in self.parts:
-            #print(part)
-            for obj in self.trackers[part].get_objs():
-                #print(obj)
-                font = cv2.FONT_HERSHEY_DUPLEX
-                font_scale = 0.7
-                thickness = 1
-                x1, y1, x2, y2, oid = obj
-                x1 = int(x1)
-                y1 = int(y1)
-                x2 = int(x2)
-                y2 = int(y2)
-                oid = int(oid)
-                x = x1
-                y = y1 - 5
-                if is_id:
-                    img = draw_label(img, str(part), (x, y))
-                if is_rect:
-                    img = cv2.rectangle(img, (x1, y1), (x2, y2), (255, 255, 255), thickness)
+        objs, part_ids = self.tracker.get_objs_and_classes()
+        for obj, part_id in zip(objs, part_ids):
+            #print(obj)
+            part = self.parts[part_id]
+            font = cv2.FONT_HERSHEY_DUPLEX
+            font_scale = 0.7
+            thickness = 1
+            x1, y1, x2, y2, oid = obj
+            x1 = int(x1)
+            y1 = int(y1)
+            x2 = int(x2)
+            y2 = int(y2)
+            oid = int(oid)
+            x = x1
+            y = y1 - 5
+            if is_id:
+                img = draw_label(img, str(part), (x, y))
+            if is_rect:
+                img = cv2.rectangle(img, (x1, y1), (x2, y2), (255, 255, 255), thickness)
         return img
 
 
@@ -111,6 +133,12 @@ class PartCounter(Scenario):
     def set_line(self, x1, y1, x2, y2):
         self.line = Line(x1, y1, x2, y2)
 
+    def compute_sides(self, xcs, ycs):
+        # side of the line of every object center, in one go
+        if self.line is None:
+            return [0] * len(xcs)
+        return self.line.compute_side(xcs, ycs)
+
     def update(self, detections):
         if len(detections) == 0:
             return
@@ -118,16 +146,15 @@ class PartCounter(Scenario):
         detections = list([d.x1, d.y1, d.x2, d.y2, d.score] for d in detections)
         self.tracker.update(detections)
         objs = self.tracker.get_objs()
+        xcs, ycs = compute_centers(objs[:, :4])
+        sides = self.compute_sides(xcs, ycs)
         counted = []
-        for obj in objs:
+        for obj, xc, yc, side in zip(objs, xcs, ycs, sides):
             x1, y1, x2, y2, oid = obj
-            xc, yc = compute_center(x1, y1, x2, y2)
             if oid in self.detected:
                 if self.detected[oid]["expired"] is False:
                     if self.line and (
-                        not self.line.is_same_side(
-                            xc, yc, self.detected[oid]["xc"], self.detected[oid]["yc"]
-                        )
+                        not self.line.are_same_side(side, self.detected[oid]["side"])
                     ):
                         self.detected[oid]["expired"] = True
                         print("*** new object counted", flush=True)
@@ -139,8 +166,9 @@ class PartCounter(Scenario):
                     else:
                         self.detected[oid]["xc"] = xc
                         self.detected[oid]["yc"] = yc
+                        self.detected[oid]["side"] = side
             else:
-                self.detected[oid] = {"xc": xc, "yc": yc, "expired": False}
+                self.detected[oid] = {"xc": xc, "yc": yc, "side": side, "expired": False}
 
         return self.counter, objs, counted
 
@@ -236,6 +264,12 @@ class DefeatDetection(Scenario):
     def set_line(self, x1, y1, x2, y2):
         self.line = Line(x1, y1, x2, y2)
 
+    def compute_sides(self, xcs, ycs):
+        # side of the line of every object center, in one go
+        if self.line is None:
+            return [0] * len(xcs)
+        return self.line.compute_side(xcs, ycs)
+
     def update(self, detections):
         detections = list(d for d in detections if d.score > self.threshold)
         # delete overlayed ok & ng
@@ -269,8 +303,10 @@ class DefeatDetection(Scenario):
         _detections = list([d.x1, d.y1, d.x2, d.y2, d.score] for d in detections)
         self.tracker.update(_detections)
         objs = self.tracker.get_objs()
+        xcs, ycs = compute_centers(objs[:, :4])
+        sides = self.compute_sides(xcs, ycs)
 
-        for obj in objs:
+        for obj, xc, yc, side in zip(objs, xcs, ycs, sides):
             x1, y1, x2, y2, oid = obj
             tag = self.ok_name
             score = 0.0
@@ -284,17 +320,13 @@ class DefeatDetection(Scenario):
                     score = d.score
                     break
 
-            xc, yc = compute_center(x1, y1, x2, y2)
-
             if oid in self.detected:
                 self.detected[oid]["score"] = score
                 if tag == self.ng_name:
                     self.detected[oid]["tag"] = tag
                 if self.detected[oid]["expired"] is False:
                     if self.line and (
-                        not self.line.is_same_side(
-                            xc, yc, self.detected[oid]["xc"], self.detected[oid]["yc"]
-                        )
+                        not self.line.are_same_side(side, self.detected[oid]["side"])
                     ):
                         self.detected[oid]["expired"] = True
                         if self.detected[oid]["tag"] == self.ok_name:
@@ -305,10 +337,12 @@ class DefeatDetection(Scenario):
                     else:
                         self.detected[oid]["xc"] = xc
                         self.detected[oid]["yc"] = yc
+                        self.detected[oid]["side"] = side
             else:
                 self.detected[oid] = {
                     "xc": xc,
                     "yc": yc,
+                    "side": side,
                     "expired": False,
                     "tag": tag,
                     "score": score,
@@ -356,6 +390,16 @@ class DefeatDetection(Scenario):
                 thickness,
             )
 
+    def snapshot(self):
+        snapshot = super().snapshot()
+        # only the tags and scores of the objects drawn
+        snapshot.detected = {
+            int(obj[4]): dict(self.detected[int(obj[4])])
+            for obj in snapshot.tracker.get_objs()
+            if int(obj[4]) in self.detected
+        }
+        return snapshot
+
     def draw_objs(self, img, is_id=False, is_rect=True, is_tag=True):
         for obj in self.tracker.get_objs():
             font = cv2.FONT_HERSHEY_SIMPLEX
@@ -402,6 +446,7 @@ class DangerZone(Scenario):
         self.detected = {}
         self.counter = 0
         self.zones = []
+        self.zone_index = RectIndex([])
         self.targets = []
         self.threshold = threshold
         self.has_new_event = False
@@ -423,12 +468,10 @@ class DangerZone(Scenario):
         for zone in zones:
             x1, y1, x2, y2 = zone
             self.zones.append(Rect(x1, y1, x2, y2))
+        self.zone_index = RectIndex(zones)
 
     def is_inside_zones(self, x1, y1, x2, y2):
-        for zone in self.zones:
-            if zone.is_inside(x1, y1, x2, y2):
-                return True
-        return False
+        return bool(self.zone_index.contains([x1, y1, x2, y2])[0])
 
     def update(self, detections):
         detections = list(d for d in detections if d.score > self.threshold)
@@ -440,13 +483,14 @@ class DangerZone(Scenario):
 
         self.tracker.update(detections)
         objs = self.tracker.get_objs()
+        is_inside = self.zone_index.contains(objs[:, :4])
         counted = []
         has_new_event = False
-        for obj in objs:
+        for obj, inside in zip(objs, is_inside):
             x1, y1, x2, y2, oid = obj
             if oid in self.detected:
                 if self.detected[oid]["expired"] is False:
-                    if self.is_inside_zones(x1, y1, x2, y2):
+                    if inside:
                         self.detected[oid]["expired"] = True
                         print("*** new object counted", flush=True)
                         has_new_event = True
@@ -19,24 +19,36 @@ import onnxruntime
 import uvicorn
 import zmq
 from fastapi import BackgroundTasks, FastAPI, Request
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 
 import extension_pb2_grpc
 from api.models import (
     CamerasModel,
+    ConfigurationModel,
     PartDetectionModeEnum,
     PartsModel,
     StreamModel,
     UploadModelBody,
 )
 from arguments import ArgumentParser, ArgumentsType
+from benchmark import startup_benchmark
 from exception_handler import PrintGetExceptionDetails
-from http_inference_engine import HttpInferenceEngine
+from frame_rate_controller import ADAPTIVE_FRAME_RATE, FrameRateController
+from http_inference_engine import HttpInferenceEngine, Overloaded
 from inference_engine import InferenceEngine
+from instrumentation import (
+    OPENMETRICS_CONTENT_TYPE,
+    get_counters,
+    get_gauges,
+    get_histograms,
+    observe,
+    render_openmetrics,
+)
 from invoke import gm
 from logging_conf import logging_config
 from model_wrapper import ONNXRuntimeModelDeploy
 from stream_manager import StreamManager
+from streams import relabel_sender, telemetry
 from utility import is_edge
 
 # sys.path.insert(0, '../lib')
@@ -75,6 +87,7 @@ app = FastAPI(
 ## FIXME ##
 # injest to flask/fastapi context
 http_inference_engine = HttpInferenceEngine(stream_manager)
+frame_rate_controller = FrameRateController(stream_manager, onnx)
 
 
 @app.get("/get_streams")
@@ -97,19 +110,41 @@ def prediction(cam_id: str):
 @app.post("/predict")
 async def predict(camera_id: str, request: Request):
     """predict."""
+    start = time.time()
     img_raw = await request.body()
-    if IS_OPENCV:
-        nparr = np.frombuffer(img_raw, np.uint8)
-        img = nparr.reshape(-1, 960, 3)
-    else:
-        img = cv2.imdecode(np.frombuffer(img_raw, dtype=np.uint8), -1)
-    # img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    results = http_inference_engine.predict(camera_id, img)
+    observe("receive", time.time() - start, camera_id)
+    # decode and inference run in the engine's workers, not on the event loop
+    try:
+        results = await http_inference_engine.predict_async(camera_id, img_raw)
+    except Overloaded:
+        return Response(status_code=429)
+    return predict_response(results)
+
+
+@app.post("/predict_shm")
+async def predict_shm(camera_id: str, request: Request):
+    """predict a frame from the CVCaptureModule shared memory ring."""
+    start = time.time()
+    descriptor = await request.json()
+    observe("receive", time.time() - start, camera_id)
+    try:
+        results = await http_inference_engine.predict_async(
+            camera_id, descriptor, http_inference_engine.read_shared_frame
+        )
+    except Overloaded:
+        return Response(status_code=429)
+    return predict_response(results)
+
+
+def predict_response(results):
+    if results is None:
+        # replaced by a newer frame of the same camera
+        return Response(status_code=204)
     if int(time.time()) % 5 == 0:
         logger.warning(results)
     if len(results) > 0:
         return json.dumps({"inferences": results}), 200
-    return "", 204
+    return Response(status_code=204)
 
 
 @app.get("/metrics")
@@ -120,6 +155,9 @@ def metrics(cam_id: str):
     total = 0
     success_rate = 0
     average_inference_time = 0
+    average_request_latency = 0
+    video_feed_metrics = {}
+    motion_gate_metrics = {}
     last_prediction_count = {}
     is_gpu = onnx.is_gpu
     scenario_metrics = []
@@ -132,6 +170,11 @@ def metrics(cam_id: str):
         unidentified_num = stream.detection_unidentified_num
         total = stream.detection_total
         average_inference_time = stream.average_inference_time
+        average_request_latency = stream.average_request_latency
+        video_feed_metrics = stream.broadcaster.get_metrics()
+        video_feed_metrics["renderer"] = stream.renderer.get_metrics()
+        if stream.motion_gate:
+            motion_gate_metrics = stream.motion_gate.get_metrics()
         last_prediction_count = stream.last_prediction_count
         scenario_metrics = stream.get_scenario_metrics()
         if total == 0:
@@ -145,11 +188,31 @@ def metrics(cam_id: str):
         "is_gpu": is_gpu,
         "device": device,
         "average_inference_time": average_inference_time,
+        "average_request_latency": average_request_latency,
+        "batch_metrics": onnx.get_batch_metrics(),
+        "session_pool_metrics": onnx.get_session_pool_metrics(),
+        "video_feed_metrics": video_feed_metrics,
+        "motion_gate_metrics": motion_gate_metrics,
+        "http_predict_metrics": http_inference_engine.get_metrics(),
+        "frame_rate_metrics": frame_rate_controller.get_metrics(),
+        "telemetry_metrics": telemetry.get_metrics(),
+        "relabel_metrics": relabel_sender.get_metrics(),
+        "latency_histograms": get_histograms(),
+        "counters": get_counters(),
+        "gauges": get_gauges(),
+        "stream_latency_histograms": get_histograms(cam_id),
+        "stream_counters": get_counters(cam_id),
         "last_prediction_count": last_prediction_count,
         "scenario_metrics": scenario_metrics,
     }
 
 
+@app.get("/metrics/openmetrics")
+def openmetrics():
+    """Stage latencies, counters and gauges of all streams, for Prometheus."""
+    return Response(content=render_openmetrics(), media_type=OPENMETRICS_CONTENT_TYPE)
+
+
 @app.get("/update_part_detection_id")
 def update_part_detection_id(part_detection_id: int):
     """update_part_detection_id."""
@@ -204,7 +267,7 @@ def update_model(request_body: UploadModelBody):
 
         if model_uri == onnx.model_uri:
             logger.info("Model Uri unchanged.")
-            onnx.update_model("model")
+            onnx.update_model("model", background=True)
             return "ok", 200
         if onnx.model_downloading:
             logger.info("Already have a thread downloading project.")
@@ -224,8 +287,8 @@ def update_model(request_body: UploadModelBody):
     if request_body.model_dir:
         logger.info("Got Model DIR %s", request_body.model_dir)
         onnx.set_is_scenario(True)
-        onnx.update_model(request_body.model_dir)
-        logger.info("Update Finished ...")
+        onnx.update_model(request_body.model_dir, background=True)
+        logger.info("Updating in background ...")
         return "ok"
 
 
@@ -298,9 +361,13 @@ def update_cams(request_body: CamerasModel):
             int(cam.send_video_to_cloud_threshold) * 0.01
         )
         stream.use_tracker = cam.enable_tracking
+        frame_rate_controller.set_weight(cam_id, cam.priority)
         # recording_duration is set in topology, sould be handled in s.update_cam, not here
         # stream.recording_duration = int(cam.recording_duration*60)
 
+    # cameras changed, start over from the benchmarked throughput
+    frame_rate_controller.reset()
+
     logger.info("Streams %s", stream_manager.streams)
     return "ok"
 
@@ -376,6 +443,7 @@ def get_scenario():
         "streams_status": streams_status,
         "parts": onnx.parts,
         "scenario": onnx.detection_mode,
+        "model_update": onnx.get_model_update_metrics(),
     }
 
 
@@ -398,6 +466,86 @@ def update_prob_threshold(prob_threshold: int):
     return "ok"
 
 
+# Sections of the last applied ConfigurationModel
+applied_configuration = {}
+applied_configuration_version = -1
+configuration_mutex = threading.Lock()
+
+
+@app.post("/apply_configuration")
+def apply_configuration(configuration: ConfigurationModel):
+    """apply_configuration.
+
+    Apply a whole deploy at once, only the sections that differ from the
+    last applied configuration are updated.
+    """
+    global applied_configuration_version
+
+    with configuration_mutex:
+        if configuration.version < applied_configuration_version:
+            logger.warning(
+                "Configuration %s older than %s, ignored",
+                configuration.version,
+                applied_configuration_version,
+            )
+            return {"version": applied_configuration_version, "applied": []}
+
+        sections = configuration.dict(exclude={"version"}, exclude_unset=True)
+        changed = [
+            name
+            for name, value in sections.items()
+            if value is not None and applied_configuration.get(name) != value
+        ]
+        # update_cams rebuilds the scenario and parts of each stream
+        if (
+            sections.get("cameras") is not None
+            and "cameras" not in changed
+            and {"part_detection_mode", "model", "parts"} & set(changed)
+        ):
+            changed.append("cameras")
+        if "cameras" in changed:
+            # new streams start with defaults, give them the stream settings
+            for name in ("retrain_parameters", "iothub_parameters", "prob_threshold"):
+                if sections.get(name) is not None and name not in changed:
+                    changed.append(name)
+        logger.info("Applying configuration %s: %s", configuration.version, changed)
+
+        # model and mode first, streams are set up for them
+        if "part_detection_mode" in changed:
+            update_part_detection_mode(configuration.part_detection_mode)
+        if "model" in changed:
+            result = update_model(configuration.model)
+            if isinstance(result, tuple) and result[1] == 400:
+                # e.g. still downloading the previous one, retried next time
+                logger.warning("Model not updated: %s", result[0])
+                changed.remove("model")
+        if "parts" in changed:
+            update_parts(configuration.parts)
+        if "cameras" in changed:
+            update_cams(configuration.cameras)
+        if "retrain_parameters" in changed:
+            update_retrain_parameters(**sections["retrain_parameters"])
+        if "iothub_parameters" in changed:
+            update_iothub_parameters(**sections["iothub_parameters"])
+        if "prob_threshold" in changed:
+            update_prob_threshold(configuration.prob_threshold)
+
+        for name in changed:
+            applied_configuration[name] = sections[name]
+        applied_configuration_version = configuration.version
+        return {"version": configuration.version, "applied": changed}
+
+
+@app.get("/configuration")
+def get_configuration():
+    """get_configuration."""
+    with configuration_mutex:
+        return {
+            "version": applied_configuration_version,
+            "configuration": applied_configuration,
+        }
+
+
 @app.get("/get_recommended_fps")
 def get_recommended_fps(number_of_cameras: int):
     """get_recommended_fps.
@@ -547,71 +695,6 @@ def local_main():
     uvicorn.run(app, host="0.0.0.0", port=5000)
 
 
-def benchmark():
-    """benchmark."""
-    # app.run(host='0.0.0.0', debug=False)
-    # s.update_cam(cam_type, cam_source, frame_rate, cam_id, has_aoi, aoi_info,
-    SAMPLE_VIDEO = "./sample_video/video.mp4"
-    SCENARIO1_MODEL = "scenario_models/1"
-
-    n_threads = 3
-    n_images = 15
-    logger.info("============= BenchMarking (Begin) ==================")
-    logger.info("--- Settings ----")
-    logger.info("%s threads", n_threads)
-    logger.info("%s images", n_images)
-
-    stream_ids = list(str(i + 10000) for i in range(n_threads))
-    stream_manager.update_streams(stream_ids)
-    onnx.set_is_scenario(True)
-    onnx.update_model(SCENARIO1_MODEL)
-    for s in stream_manager.get_streams():
-        s.set_is_benchmark(True)
-        s.update_cam("video", SAMPLE_VIDEO, 30,
-                     s.cam_id, False, None, "PC", [], [])
-
-    def _f():
-        logger.info("--- Thread %s started---", threading.current_thread())
-        t0_t = time.time()
-        img = cv2.imread("img.png")
-        for i in range(n_images):
-            s.predict(img)
-        t1_t = time.time()
-        print("---- Thread", threading.current_thread(), "----", flush=True)
-        print("Processing", n_images, "images in",
-              t1_t - t0_t, "seconds", flush=True)
-        print("  Avg:", (t1_t - t0_t) / n_images *
-              1000, "ms per image", flush=True)
-
-    threads = []
-    for i in range(n_threads):
-        threads.append(threading.Thread(target=_f))
-    t0 = time.time()
-    for i in range(n_threads):
-        threads[i].start()
-    for i in range(n_threads):
-        threads[i].join()
-    t1 = time.time()
-    # print(t1-t0)
-    stream_manager.update_streams([])
-
-    discount = 0.75
-    max_total_frame_rate = discount * (n_images * n_threads) / (t1 - t0)
-
-    logger.info("---- Overall ----")
-    logger.info("Processing %s images in %s seconds",
-                n_images * n_threads, t1 - t0)
-    logger.info("  Avg: %s ms per image", (t1 - t0) /
-                (n_images * n_threads) * 1000)
-    logger.info("  Recommended Total FPS: %s", max_total_frame_rate)
-    logger.info("============= BenchMarking (End) ==================")
-
-    stream_manager.update_streams([])
-
-    max_total_frame_rate = max(1, max_total_frame_rate)
-    onnx.set_max_total_frame_rate(max_total_frame_rate)
-
-
 def cvcapture_url():
     if is_edge():
         ip = socket.gethostbyname("CVCaptureModule")
@@ -713,7 +796,12 @@ if __name__ == "__main__":
     else:
         logging.config.dictConfig(logging_config.LOGGING_CONFIG_DEV)
 
-    benchmark()
+    # frames are scored with the scenario model until a model is deployed
+    onnx.set_is_scenario(True)
+    onnx.update_model("scenario_models/1")
+    startup_benchmark(onnx)
+    if ADAPTIVE_FRAME_RATE == "true":
+        frame_rate_controller.start()
 
     logger.info("is_edge: %s", is_edge())
 
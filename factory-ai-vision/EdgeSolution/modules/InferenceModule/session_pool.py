@@ -0,0 +1,66 @@
+"""Session Pool
+
+A fixed set of model instances that inference callers check out one at a
+time, so concurrent streams run on different sessions instead of queueing
+behind a single lock.
+"""
+
+import logging
+import os
+import queue
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def get_pool_size(pool_size, is_cpu):
+    """Resolve the SESSION_POOL_SIZE setting.
+
+    "auto" gives one session per 4 cores on CPU and a single session on
+    GPU/VPU, where the device already runs one kernel at a time.
+    """
+    if pool_size == "auto":
+        if not is_cpu:
+            return 1
+        return max(1, (os.cpu_count() or 1) // 4)
+    return max(1, int(pool_size))
+
+
+def get_intra_op_num_threads(intra_op_num_threads, pool_size):
+    """Resolve the SESSION_INTRA_OP_THREADS setting.
+
+    "auto" splits the cores evenly between the sessions of the pool, 0 lets
+    onnxruntime decide.
+    """
+    if intra_op_num_threads == "auto":
+        return max(1, (os.cpu_count() or 1) // pool_size)
+    return max(0, int(intra_op_num_threads))
+
+
+class SessionPool:
+    """Pool of model instances sharing the same weights."""
+
+    def __init__(self, models):
+        assert len(models) >= 1, "At least 1 model is required"
+        self.models = list(models)
+        self.idle_models = queue.Queue()
+        for model in self.models:
+            self.idle_models.put(model)
+
+    def __len__(self):
+        return len(self.models)
+
+    @contextmanager
+    def checkout(self):
+        """Borrow a model, blocks until one is idle."""
+        model = self.idle_models.get()
+        try:
+            yield model
+        finally:
+            self.idle_models.put(model)
+
+    def get_metrics(self):
+        return {
+            "pool_size": len(self.models),
+            "idle_sessions": self.idle_models.qsize(),
+        }
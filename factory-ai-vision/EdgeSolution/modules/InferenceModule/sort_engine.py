@@ -0,0 +1,196 @@
+"""Sort Engine
+
+SORT with the state of every track kept in contiguous arrays. A frame costs
+one vectorized Kalman predict over all tracks, one class-aware association
+pass and one vectorized Kalman update over the matched tracks, instead of a
+KalmanFilter object per track. Same motion model and parameters as sort.py.
+"""
+
+import numpy as np
+
+from sort import iou_batch, linear_assignment
+
+# Constant velocity model, the state is [x, y, s, r, vx, vy, vs] with (x, y)
+# the centre, s the area and r the aspect ratio of the box
+F = np.eye(7)
+F[0, 4] = F[1, 5] = F[2, 6] = 1
+H = np.eye(4, 7)
+R = np.diag([1.0, 1.0, 10.0, 10.0])
+Q = np.diag([1.0, 1.0, 1.0, 1.0, 0.01, 0.01, 0.0001])
+# High uncertainty for the unobservable initial velocities
+P0 = np.diag([10.0, 10.0, 10.0, 10.0, 10000.0, 10000.0, 10000.0])
+I7 = np.eye(7)
+
+
+def boxes_to_z(boxes):
+    """[x1, y1, x2, y2] rows to [x, y, s, r] rows."""
+    w = boxes[:, 2] - boxes[:, 0]
+    h = boxes[:, 3] - boxes[:, 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.stack(
+            (boxes[:, 0] + w / 2, boxes[:, 1] + h / 2, w * h, w / h), axis=1
+        )
+
+
+def x_to_boxes(x):
+    """[x, y, s, r, ...] rows to [x1, y1, x2, y2] rows, NaN for invalid states."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        w = np.sqrt(x[:, 2] * x[:, 3])
+        h = x[:, 2] / w
+    return np.stack(
+        (x[:, 0] - w / 2, x[:, 1] - h / 2, x[:, 0] + w / 2, x[:, 1] + h / 2), axis=1
+    )
+
+
+def associate(det_boxes, det_classes, trk_boxes, trk_classes, iou_threshold=0.3):
+    """Match detections to the predicted track boxes of the same class.
+
+    Returns:
+        (matches, unmatched_detections), matches rows are
+        [detection index, track index].
+    """
+    if len(trk_boxes) == 0 or len(det_boxes) == 0:
+        return np.empty((0, 2), dtype=int), np.arange(len(det_boxes))
+
+    iou_matrix = iou_batch(det_boxes, trk_boxes)
+    iou_matrix[det_classes[:, np.newaxis] != trk_classes[np.newaxis, :]] = 0
+
+    above = iou_matrix > iou_threshold
+    if above.sum(1).max() <= 1 and above.sum(0).max() <= 1:
+        # Unambiguous, the usual case, no assignment needed
+        matched = np.argwhere(above)
+    else:
+        matched = linear_assignment(-iou_matrix).reshape(-1, 2).astype(int)
+
+    is_match = iou_matrix[matched[:, 0], matched[:, 1]] >= iou_threshold
+    is_assigned = np.zeros(len(det_boxes), dtype=bool)
+    is_assigned[matched[:, 0]] = True
+    unmatched = np.concatenate((np.flatnonzero(~is_assigned), matched[~is_match, 0]))
+    return matched[is_match], unmatched
+
+
+class SortEngine:
+    """SORT tracker of all the objects of a scenario.
+
+    Tracks only match detections of their own class, so a single engine can
+    track several parts at once.
+    """
+
+    # Object ids are unique across engines, like KalmanBoxTracker.count
+    count = 0
+
+    def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3):
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.iou_threshold = iou_threshold
+        self.frame_count = 0
+
+        self.x = np.empty((0, 7))
+        self.P = np.empty((0, 7, 7))
+        self.ids = np.empty(0, dtype=int)
+        self.classes = np.empty(0, dtype=int)
+        self.hits = np.empty(0, dtype=int)
+        self.hit_streak = np.empty(0, dtype=int)
+        self.age = np.empty(0, dtype=int)
+        self.time_since_update = np.empty(0, dtype=int)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _select(self, index):
+        self.x = self.x[index]
+        self.P = self.P[index]
+        self.ids = self.ids[index]
+        self.classes = self.classes[index]
+        self.hits = self.hits[index]
+        self.hit_streak = self.hit_streak[index]
+        self.age = self.age[index]
+        self.time_since_update = self.time_since_update[index]
+
+    def _add(self, z, classes):
+        n = len(z)
+        x = np.zeros((n, 7))
+        x[:, :4] = z
+        self.x = np.concatenate((self.x, x))
+        self.P = np.concatenate((self.P, np.broadcast_to(P0, (n, 7, 7))))
+        self.ids = np.concatenate((self.ids, SortEngine.count + np.arange(n)))
+        SortEngine.count += n
+        self.classes = np.concatenate((self.classes, classes))
+        zeros = np.zeros(n, dtype=int)
+        self.hits = np.concatenate((self.hits, zeros))
+        self.hit_streak = np.concatenate((self.hit_streak, zeros))
+        self.age = np.concatenate((self.age, zeros))
+        self.time_since_update = np.concatenate((self.time_since_update, zeros))
+
+    def predict(self):
+        """Advance every track one frame, returns the predicted boxes."""
+        self.x[self.x[:, 6] + self.x[:, 2] <= 0, 6] = 0
+        self.x = self.x @ F.T
+        self.P = F @ self.P @ F.T + Q
+        self.age += 1
+        self.hit_streak[self.time_since_update > 0] = 0
+        self.time_since_update += 1
+        return x_to_boxes(self.x)
+
+    def correct(self, index, z):
+        """Update the tracks at index with their observed [x, y, s, r]."""
+        if len(index) == 0:
+            return
+        x = self.x[index]
+        P = self.P[index]
+        # H only selects the first 4 state variables, so P H^T and H P H^T
+        # are slices of P
+        S = P[:, :4, :4] + R
+        K = P[:, :, :4] @ np.linalg.inv(S)
+        self.x[index] = x + (K @ (z - x[:, :4])[:, :, np.newaxis])[:, :, 0]
+        I_KH = I7 - K @ H
+        KT = K.transpose(0, 2, 1)
+        self.P[index] = I_KH @ P @ I_KH.transpose(0, 2, 1) + K @ R @ KT
+
+        self.time_since_update[index] = 0
+        self.hits[index] += 1
+        self.hit_streak[index] += 1
+
+    def update(self, dets, classes=None):
+        """
+        Args:
+            dets: detections, [[x1, y1, x2, y2, score], ...]. Must be called
+                once per frame, with np.empty((0, 5)) for frames without
+                detections.
+            classes: class index of each detection, None for a single class.
+
+        Returns:
+            (objs, classes), objs rows are [x1, y1, x2, y2, object id].
+        """
+        self.frame_count += 1
+        dets = np.asarray(dets, dtype=float).reshape(-1, 5)
+        if classes is None:
+            classes = np.zeros(len(dets), dtype=int)
+        else:
+            classes = np.asarray(classes, dtype=int)
+
+        trk_boxes = self.predict()
+        is_valid = ~np.isnan(trk_boxes).any(axis=1)
+        if not is_valid.all():
+            self._select(is_valid)
+            trk_boxes = trk_boxes[is_valid]
+
+        matches, unmatched = associate(
+            dets[:, :4], classes, trk_boxes, self.classes, self.iou_threshold
+        )
+        self.correct(matches[:, 1], boxes_to_z(dets[matches[:, 0], :4]))
+        self._add(boxes_to_z(dets[unmatched, :4]), classes[unmatched])
+
+        is_visible = (self.time_since_update < 1) & (
+            (self.hit_streak >= self.min_hits) | (self.frame_count <= self.min_hits)
+        )
+        # Newest tracks first, like sort.Sort
+        visible = np.flatnonzero(is_visible)[::-1]
+        objs = np.concatenate(
+            (x_to_boxes(self.x[visible]), self.ids[visible, np.newaxis] + 1), axis=1
+        )
+        objs_classes = self.classes[visible]
+
+        # Remove dead tracks
+        self._select(self.time_since_update <= self.max_age)
+        return objs, objs_classes
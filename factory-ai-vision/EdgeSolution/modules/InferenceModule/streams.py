@@ -1,5 +1,4 @@
 import asyncio
-import base64
 import json
 import logging
 import os
@@ -10,16 +9,23 @@ import cv2
 import numpy as np
 import requests
 from azure.iot.device import IoTHubModuleClient, Message
-from shapely.geometry import Polygon
 
 from api.models import StreamModel
 from exception_handler import PrintGetExceptionDetails
+from frame_broadcaster import FrameBroadcaster
+from frame_renderer import FrameRenderer
+from geometry import AoiIndex
+from instrumentation import count, observe, timed
+from motion_gate import MOTION_GATING, MotionGate
 from invoke import gm
 from object_detection import ObjectDetection
 from onnxruntime_predict import ONNXRuntimeObjectDetection
+from preprocess import PreprocessBuffer
+from relabel_sender import RelabelSender
 
 # from tracker import Tracker
 from scenarios import DangerZone, DefeatDetection, Detection, PartCounter, PartDetection
+from telemetry_publisher import TelemetryPublisher
 from utility import draw_label, get_file_zip, is_edge, normalize_rtsp
 
 DETECTION_TYPE_NOTHING = "nothing"
@@ -34,12 +40,16 @@ LVA_MODE = os.environ.get("LVA_MODE", "grpc")
 IS_OPENCV = os.environ.get("IS_OPENCV", "false")
 
 DISPLAY_KEEP_ALIVE_THRESHOLD = 10  # seconds
+UPDATE_FPS_TIMEOUT = 3  # seconds
 
 try:
     iot = IoTHubModuleClient.create_from_edge_environment()
 except:
     iot = None
 
+# IoT Hub messages are sent from the publisher thread, not from predict
+telemetry = TelemetryPublisher(iot)
+
 logger = logging.getLogger(__name__)
 
 
@@ -61,8 +71,6 @@ class Stream:
         self.send_video_to_cloud_parts = []
         self.recording_duration = 60
 
-        self.render = False
-
         self.mutex = threading.Lock()
 
         self.cam_type = cam_type
@@ -71,6 +79,12 @@ class Stream:
             self.frameRate = 30
         else:
             self.frameRate = 10
+        # frameRate asked by update_cam, frameRate itself can be lowered
+        # by the FrameRateController
+        self.requested_frame_rate = self.frameRate
+        # frames predicted and the seconds spent on them, for the controller
+        self.total_predicted = 0
+        self.total_predict_time = 0
         # self.cam = cv2.VideoCapture(normalize_rtsp(cam_source))
         self.cam_is_alive = True
         self.last_display_keep_alive = None
@@ -81,8 +95,18 @@ class Stream:
 
         self.last_img = None
         self.last_recv_img = None
+        # Model input tensor, reused for every frame of the stream
+        self.preprocess_buffer = PreprocessBuffer()
+        # Skips the model on static frames, the last scored predictions are
+        # reused for them
+        self.motion_gate = MotionGate() if MOTION_GATING == "true" else None
+        self.last_scored_predictions = []
         # self.last_edge_img = None
         self.last_drawn_img = None
+        # JPEG encoded once per frame for all viewers and the zmq sender
+        self.broadcaster = FrameBroadcaster(cam_id=cam_id)
+        # draws the latest frame for the broadcaster, off the predict path
+        self.renderer = FrameRenderer(self.render_frame, self.broadcaster)
         self.last_prediction = []
         self.last_prediction_count = {}
 
@@ -103,11 +127,13 @@ class Stream:
 
         self.has_aoi = False
         self.aoi_info = None
+        self.aoi_index = AoiIndex(None)
         # Part that we want to detect
         self.parts = []
 
         # self.is_gpu = (onnxruntime.get_device() == 'GPU')
         self.average_inference_time = 0
+        self.average_request_latency = 0
 
         # IoT Hub
         self.iothub_is_send = False
@@ -161,33 +187,22 @@ class Stream:
     def start_zmq(self):
         def run(self):
 
-            while "flags" not in dir(self.last_drawn_img):
-                logger.info("not sending last_drawn_img")
-                time.sleep(2)
             cnt = 0
-            while self.cam_is_alive:
-
-                if self.last_send == self.last_update:
-                    time.sleep(0.03)
-                    continue
-                cnt += 1
-                if cnt % 30 == 1:
-                    logging.info(
-                        "send through channel {}".format(
-                            bytes(self.cam_id, "utf-8"))
+            frame_id = 0
+            with self.broadcaster.subscribe():
+                while self.cam_is_alive:
+                    frame_id, jpg = self.broadcaster.wait(frame_id, timeout=1)
+                    if jpg is None:
+                        continue
+                    cnt += 1
+                    if cnt % 30 == 1:
+                        logging.info(
+                            "send through channel {}".format(
+                                bytes(self.cam_id, "utf-8"))
+                        )
+                    self.zmq_sender.send_multipart(
+                        [bytes(self.cam_id, "utf-8"), jpg]
                     )
-                # self.mutex.acquire()
-                # FIXME may find a better way to deal with encoding
-                self.zmq_sender.send_multipart(
-                    [
-                        bytes(self.cam_id, "utf-8"),
-                        cv2.imencode(".jpg", self.last_drawn_img)[1].tobytes(),
-                    ]
-                )
-                self.last_send = self.last_update
-                # self.mutex.release()
-                # FIXME need to fine tune this value
-                time.sleep(0.03)
 
         threading.Thread(target=run, args=(self,)).start()
 
@@ -231,15 +246,16 @@ class Stream:
         #    return
         if (
             self.cam_source != cam_source
-            or round(self.frameRate) != round(frameRate)
+            or round(self.requested_frame_rate) != round(frameRate)
             or self.lva_mode != lva_mode
             or self.recording_duration != recording_duration
         ):
             self.cam_source = cam_source
             self.frameRate = frameRate
+            self.requested_frame_rate = frameRate
             self.lva_mode = lva_mode
             self.recording_duration = recording_duration
-            if IS_OPENCV == "true":
+            if IS_OPENCV == "true" and not self.is_benchmark:
                 logger.info("post to CVModule")
                 data = {
                     "stream_id": self.cam_id,
@@ -256,6 +272,10 @@ class Stream:
         self.name = cam_name
         self.has_aoi = has_aoi
         self.aoi_info = aoi_info
+        # compiled once here instead of for every detection of every frame
+        self.aoi_index = AoiIndex(aoi_info if has_aoi else None)
+        if self.motion_gate:
+            self.motion_gate.set_region(self.aoi_index.get_bounds())
 
         detection_mode = self.model.get_detection_mode()
         if detection_mode == "PD":
@@ -399,6 +419,36 @@ class Stream:
             )
         )
 
+    def set_frame_rate(self, frame_rate):
+        """Ask the camera source for another frame rate, the rest of the
+        camera settings stay.
+        """
+        if round(frame_rate) == round(self.frameRate):
+            return
+        if self.is_benchmark:
+            self.frameRate = frame_rate
+            return
+        if IS_OPENCV == "true":
+            try:
+                res = requests.get(
+                    "http://CVCaptureModule:9000/update_fps/" + self.cam_id,
+                    params={"fps": frame_rate},
+                    timeout=UPDATE_FPS_TIMEOUT,
+                )
+                res.raise_for_status()
+            except requests.exceptions.RequestException as err:
+                logger.warning("Stream %s frame rate not updated: %s", self.cam_id, err)
+                return
+            if res.json() != "ok":
+                logger.warning("Stream %s frame rate not updated: %s", self.cam_id, res.text)
+                return
+        else:
+            self._update_instance(
+                normalize_rtsp(self.cam_source), str(frame_rate), str(self.recording_duration)
+            )
+        # only once the camera source took it
+        self.frameRate = frame_rate
+
     def update_retrain_parameters(
         self, is_retrain, confidence_min, confidence_max, max_images
     ):
@@ -433,6 +483,8 @@ class Stream:
     def delete(self):
         # self.mutex.acquire()
         self.cam_is_alive = False
+        self.renderer.stop()
+        self.broadcaster.stop()
         # self.mutex.release()
 
         if IS_OPENCV == "true":
@@ -445,6 +497,7 @@ class Stream:
         logger.info("Deactivate stream {}".format(self.cam_id))
 
     def predict(self, image):
+        predict_start = time.time()
 
         width = self.IMG_WIDTH
         ratio = self.IMG_WIDTH / image.shape[1]
@@ -454,11 +507,25 @@ class Stream:
             ratio = self.IMG_HEIGHT / image.shape[0]
             width = int(image.shape[1] * ratio + 0.000001)
 
-        image = cv2.resize(image, (width, height))
+        # The model resizes the source frame straight to its input size,
+        # this one is for display, retrain images and AOI
+        frame = image
+        with timed("resize", self.cam_id):
+            image = cv2.resize(image, (width, height))
 
         # prediction
         # self.mutex.acquire()
-        predictions, inf_time = self.model.Score(image)
+        is_scored = self.motion_gate is None or self.motion_gate.should_score(image)
+        if is_scored:
+            score_start = time.time()
+            predictions, inf_time = self.model.Score(frame, self.preprocess_buffer)
+            request_latency = time.time() - score_start
+            observe("score", request_latency, self.cam_id)
+            self.last_scored_predictions = predictions
+        else:
+            # nothing moved, the tracker still advances on the same detections
+            predictions = self.last_scored_predictions
+            count("gated_frames", cam_id=self.cam_id)
         # print('predictions', predictions, flush=True)
         # self.mutex.release()
 
@@ -468,17 +535,19 @@ class Stream:
 
         # check whether it's inside aoi (if has)
         if self.has_aoi:
-            _predictions = []
+            aoi_start = time.time()
+            boxes = []
             for p in predictions:
                 (x1, y1), (x2, y2) = parse_bbox(p, width, height)
-                if is_inside_aoi(x1, y1, x2, y2, self.aoi_info):
-                    _predictions.append(p)
-            predictions = _predictions
+                boxes.append([x1, y1, x2, y2])
+            is_inside = self.aoi_index.contains(boxes, width, height)
+            predictions = list(p for p, inside in zip(predictions, is_inside) if inside)
+            observe("aoi_filter", time.time() - aoi_start, self.cam_id)
 
         # update detection status before filter out by threshold
         self.update_detection_status(predictions)
 
-        if self.is_retrain:
+        if self.is_retrain and is_scored:
             self.process_retrain_image(predictions, image)
 
         # check whether it's larger than threshold
@@ -511,16 +580,15 @@ class Stream:
                 Detection(tag, x1, y1, x2, y2, prediction["probability"])
             )
         if self.scenario:
-            self.scenario.update(_detections)
-
-        self.draw_img()
+            with timed("scenario", self.cam_id):
+                self.scenario.update(_detections)
 
-        if self.scenario:
-            self.scenario.draw_counter(self.last_drawn_img)
-            if self.get_mode() == "DD":
-                self.scenario.draw_objs(self.last_drawn_img)
-            if self.get_mode() == 'PD' and self.use_tracker is True:
-                self.scenario.draw_objs(self.last_drawn_img)
+        # drawn in the renderer thread, and only if someone is watching,
+        # with the scenario as it is now
+        scenario = None
+        if self.scenario and self.broadcaster.has_subscribers():
+            scenario = self.scenario.snapshot()
+        self.renderer.submit(image, predictions, scenario)
 
         if self.iothub_is_send:
             if self.get_mode() == 'ES':
@@ -536,11 +604,19 @@ class Stream:
             else:
                 self.precess_send_signal_to_lva()
 
-        # update avg inference time (moving avg)
-        inf_time_ms = inf_time * 1000
-        self.average_inference_time = (
-            1 / 16 * inf_time_ms + 15 / 16 * self.average_inference_time
-        )
+        # update avg inference time (moving avg), of the scored frames only
+        if is_scored:
+            inf_time_ms = inf_time * 1000
+            self.average_inference_time = (
+                1 / 16 * inf_time_ms + 15 / 16 * self.average_inference_time
+            )
+            # includes the time waiting for a batch to fill
+            request_latency_ms = request_latency * 1000
+            self.average_request_latency = (
+                1 / 16 * request_latency_ms + 15 / 16 * self.average_request_latency
+            )
+        self.total_predicted += 1
+        self.total_predict_time += time.time() - predict_start
 
     def process_retrain_image(self, predictions, img):
         for prediction in predictions:
@@ -571,15 +647,15 @@ class Stream:
                     break
 
     def process_send_message_to_iothub(self, predictions):
-        if self.iothub_last_send_time + self.iothub_interval < time.time():
-            predictions = list(
-                p for p in predictions if p["probability"] >= self.threshold
-            )
-            if len(predictions) > 0:
-                message_body = {'camera_name': self.name,
-                                'inferences': predictions}
-                send_message_to_iothub(message_body)
-                self.iothub_last_send_time = time.time()
+        # the publisher coalesces the events within iothub_interval
+        predictions = list(
+            p for p in predictions if p["probability"] >= self.threshold
+        )
+        if len(predictions) > 0:
+            message_body = {'camera_name': self.name,
+                            'inferences': predictions}
+            telemetry.publish(self.cam_id, message_body, self.iothub_interval)
+            self.iothub_last_send_time = time.time()
 
     def precess_send_signal_to_lva(self):
         if self.lva_last_send_time + self.lva_interval < time.time():
@@ -604,12 +680,33 @@ class Stream:
                 self.lva_last_send_time = time.time()
                 self.lva_interval = 60
 
-    def draw_img(self):
+    def render_frame(self, image, predictions, scenario=None):
+        """Draw a predicted frame with the scenario on top, for the viewers.
 
-        img = self.last_img.copy()
+        Args:
+            scenario: snapshot of the scenario taken with the frame, the
+                live one is updated by predict meanwhile.
+        """
+        draw_start = time.time()
+        img = self.draw_img(image, predictions)
+
+        if scenario:
+            scenario.draw_counter(img)
+            if self.get_mode() == "DD":
+                scenario.draw_objs(img)
+            if self.get_mode() == 'PD' and self.use_tracker is True:
+                scenario.draw_objs(img)
+        observe("draw", time.time() - draw_start, self.cam_id)
+        return img
+
+    def draw_img(self, image=None, predictions=None):
+        if image is None:
+            image = self.last_img
+            predictions = self.last_prediction
+
+        img = image.copy()
 
         height, width = img.shape[0], img.shape[1]
-        predictions = self.last_prediction
 
         if self.has_aoi:
             draw_aoi(img, self.aoi_info)
@@ -630,6 +727,7 @@ class Stream:
 
         self.last_drawn_img = img
         self.last_update = time.time()
+        return img
 
     def to_api_model(self):
         return StreamModel(
@@ -646,18 +744,15 @@ class Stream:
         return self.last_display_keep_alive + DISPLAY_KEEP_ALIVE_THRESHOLD > time.time()
 
     def gen(self):
-        while self.cam_is_alive and self.display_is_alive():
-            if self.last_drawn_img is not None and self.last_update > self.last_send:
-                self.last_send = self.last_update
-                jpg = cv2.imencode(".jpg", self.last_drawn_img)[1].tobytes()
-                logger.warning(
-                    '===== sneding jpg to browser, size: {}'.format(len(jpg)))
+        frame_id = 0
+        with self.broadcaster.subscribe():
+            while self.cam_is_alive and self.display_is_alive():
+                frame_id, jpg = self.broadcaster.wait(frame_id, timeout=1)
+                if jpg is None:
+                    continue
                 yield (
                     b"--frame\r\n" b"Content-Type: image/jpeg\r\n\r\n" + jpg + b"\r\n"
                 )
-                time.sleep(1/self.frameRate)
-            else:
-                time.sleep(0.04)
 
 
 def web_module_url():
@@ -667,6 +762,11 @@ def web_module_url():
         return "localhost:8000"
 
 
+relabel_sender = RelabelSender(
+    "http://" + web_module_url() + "/api/part_detections/1/upload_relabel_image/"
+)
+
+
 def draw_aoi(img, aoi_info):
     for aoi_area in aoi_info:
         aoi_type = aoi_area["type"]
@@ -689,35 +789,6 @@ def draw_aoi(img, aoi_info):
                 cv2.line(img, p1, p2, (255, 255, 255), 2)
 
 
-def is_inside_aoi(x1, y1, x2, y2, aoi_info):
-
-    obj_shape = Polygon([[x1, y1], [x2, y1], [x2, y2], [x1, y2]])
-
-    for aoi_area in aoi_info:
-        aoi_type = aoi_area["type"]
-        label = aoi_area["label"]
-
-        if aoi_area["type"] == "BBox":
-            if (
-                (label["x1"] <= x1 <= label["x2"]) or (
-                    label["x1"] <= x2 <= label["x2"])
-            ) and (
-                (label["y1"] <= y1 <= label["y2"]) or (
-                    label["y1"] <= y2 <= label["y2"])
-            ):
-                return True
-
-        elif aoi_area["type"] == "Polygon":
-            points = []
-            for point in label:
-                points.append([point["x"], point["y"]])
-            aoi_shape = Polygon(points)
-            if aoi_shape.is_valid and aoi_shape.intersects(obj_shape):
-                return True
-
-    return False
-
-
 def parse_bbox(prediction, width, height):
     x1 = int(prediction["boundingBox"]["left"] * width)
     y1 = int(prediction["boundingBox"]["top"] * height)
@@ -750,10 +821,7 @@ def draw_confidence_level(img, prediction):
 
 def send_message_to_iothub(predictions):
     if iot:
-        try:
-            iot.send_message_to_output(json.dumps(predictions), "metrics")
-        except:
-            print("[ERROR] Failed to send message to iothub", flush=True)
+        telemetry.send_signal(json.dumps(predictions), "metrics")
         print("[INFO] sending metrics to iothub", flush=True)
     else:
         # print('[METRICS]', json.dumps(predictions_to_send))
@@ -762,13 +830,10 @@ def send_message_to_iothub(predictions):
 
 def send_message_to_lva(cam_id):
     if iot:
-        try:
-            target = "/graphInstances/" + str(cam_id)
-            msg = Message("")
-            msg.custom_properties["eventTarget"] = target
-            iot.send_message_to_output(msg, "InferenceToLVA")
-        except:
-            print("[ERROR] Failed to send signal to LVA", flush=True)
+        target = "/graphInstances/" + str(cam_id)
+        msg = Message("")
+        msg.custom_properties["eventTarget"] = target
+        telemetry.send_signal(msg, "InferenceToLVA")
         print("[INFO] sending signal to LVA", flush=True)
     else:
         # print('[INFO] Cannot detect IoT module')
@@ -776,21 +841,4 @@ def send_message_to_lva(cam_id):
 
 
 def send_retrain_image_to_webmodule(jpg, tag, labels, confidence, cam_id):
-    print("[INFO] Sending Image to relabeling", tag, flush=True)
-    try:
-        # requests.post('http://'+web_module_url()+'/api/relabel', data={
-        res = requests.post(
-            "http://"
-            + web_module_url()
-            + "/api/part_detections/1/upload_relabel_image/",
-            data={
-                "confidence": confidence,
-                "labels": labels,
-                "part_name": tag,
-                "is_relabel": True,
-                "img": base64.b64encode(jpg),
-                "camera_id": cam_id,
-            },
-        )
-    except:
-        print("[ERROR] Failed to update image for relabeling", flush=True)
+    relabel_sender.send(jpg, tag, labels, confidence, cam_id)
@@ -0,0 +1,234 @@
+"""Telemetry Publisher
+
+Sends the inference events of the streams to the IoT Hub from a thread of
+its own, so a slow or disconnected hub never holds up Stream.predict.
+
+Events are queued per camera and coalesced: each camera sends at most one
+message per interval (60 / iothub_fpm seconds), holding its latest
+TELEMETRY_MAX_BATCH events. While the hub can't be reached the messages are spilled
+to TELEMETRY_SPILL_DIR and sent, oldest first, once it is back.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from instrumentation import count, observe, set_gauge
+
+# Events kept per camera between two messages, older ones are dropped
+TELEMETRY_QUEUE_SIZE = int(os.environ.get("TELEMETRY_QUEUE_SIZE", 100))
+# Events sent in one message, at most
+TELEMETRY_MAX_BATCH = int(os.environ.get("TELEMETRY_MAX_BATCH", 10))
+# Where messages wait while the hub is offline, "" to drop them instead
+TELEMETRY_SPILL_DIR = os.environ.get("TELEMETRY_SPILL_DIR", "/tmp/telemetry")
+# Spilled messages kept, the oldest go first
+TELEMETRY_SPILL_MAX_FILES = int(os.environ.get("TELEMETRY_SPILL_MAX_FILES", 1000))
+
+RETRY_MIN = 1
+RETRY_MAX = 60
+
+logger = logging.getLogger(__name__)
+
+
+class TelemetryPublisher:
+    def __init__(
+        self,
+        client,
+        queue_size=TELEMETRY_QUEUE_SIZE,
+        max_batch=TELEMETRY_MAX_BATCH,
+        spill_dir=TELEMETRY_SPILL_DIR,
+        spill_max_files=TELEMETRY_SPILL_MAX_FILES,
+    ):
+        """
+        Args:
+            client (IoTHubModuleClient): None when not running on the edge,
+                everything is then dropped.
+        """
+        self.client = client
+        self.queue_size = queue_size
+        self.max_batch = max(1, max_batch)
+        self.spill_dir = spill_dir
+        self.spill_max_files = spill_max_files
+
+        self.condition = threading.Condition()
+        # cam_id: deque of (time, message body)
+        self.queues = {}
+        self.intervals = {}
+        self.last_send_times = {}
+        # (time, message, output) to send as soon as possible, not batched
+        self.signals = deque(maxlen=100)
+
+        self.is_online = True
+        self.retry_time = 0
+        self.retry_delay = 0
+        self.spilled = []
+
+        self.total_sent = 0
+        self.total_coalesced = 0
+        self.total_spilled = 0
+        self.total_failed = 0
+        self.average_delivery_latency = 0
+
+        if self.client:
+            if self.spill_dir:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                self.spilled = sorted(os.listdir(self.spill_dir))
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def publish(self, cam_id, body, interval):
+        """Queue an event of a stream, never blocks.
+
+        Args:
+            cam_id (str): the stream.
+            body (dict): the event, e.g. camera_name and inferences.
+            interval (float): min seconds between two messages of the stream.
+        """
+        if not self.client:
+            return
+        with self.condition:
+            queue = self.queues.get(cam_id)
+            if queue is None:
+                queue = self.queues[cam_id] = deque(maxlen=self.queue_size)
+                self.last_send_times[cam_id] = 0
+            if len(queue) == queue.maxlen:
+                self.total_coalesced += 1
+            queue.append((time.time(), body))
+            self.intervals[cam_id] = interval
+            set_gauge("telemetry_queued", len(queue), cam_id)
+            self.condition.notify()
+
+    def send_signal(self, message, output):
+        """Send message to output as soon as possible, dropped if offline."""
+        if not self.client:
+            return
+        with self.condition:
+            self.signals.append((time.time(), message, output))
+            self.condition.notify()
+
+    def _next_batches(self, now):
+        batches = []
+        for cam_id, queue in self.queues.items():
+            if not queue or self.last_send_times[cam_id] + self.intervals[cam_id] > now:
+                continue
+            events = list(queue)[-self.max_batch :]
+            self.total_coalesced += len(queue) - len(events)
+            queue.clear()
+            set_gauge("telemetry_queued", 0, cam_id)
+            self.last_send_times[cam_id] = now
+            batches.append((cam_id, events))
+        return batches
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait(1)
+                now = time.time()
+                signals = list(self.signals)
+                self.signals.clear()
+                batches = self._next_batches(now)
+
+            for signal_time, message, output in signals:
+                if self._can_send():
+                    self._send(message, output, signal_time)
+
+            for cam_id, events in batches:
+                message = dict(events[-1][1])
+                message["timestamp"] = events[-1][0]
+                message["events"] = [
+                    {"timestamp": t, "inferences": body.get("inferences", [])}
+                    for t, body in events
+                ]
+                message = json.dumps(message)
+                if not self._can_send() or not self._send(
+                    message, "metrics", events[0][0], cam_id
+                ):
+                    self._spill(message)
+
+            if self.spilled and self._can_send():
+                # one per round, the hub has a message quota too
+                self._send_spilled()
+
+    def _can_send(self):
+        # offline, only try again once the retry delay is over
+        return self.is_online or time.time() >= self.retry_time
+
+    def _send(self, message, output, event_time, cam_id=None):
+        try:
+            self.client.send_message_to_output(message, output)
+        except Exception as e:
+            self.total_failed += 1
+            count("telemetry_failed", cam_id=cam_id)
+            self._set_offline(e)
+            return False
+        latency = time.time() - event_time
+        observe("telemetry_delivery", latency, cam_id)
+        self.average_delivery_latency = (
+            1 / 16 * latency * 1000 + 15 / 16 * self.average_delivery_latency
+        )
+        self.total_sent += 1
+        self.is_online = True
+        self.retry_delay = 0
+        return True
+
+    def _set_offline(self, error):
+        if self.is_online:
+            logger.warning("Cannot send telemetry to the IoT Hub: %s", error)
+        self.is_online = False
+        self.retry_delay = min(RETRY_MAX, max(RETRY_MIN, self.retry_delay * 2))
+        self.retry_time = time.time() + self.retry_delay
+
+    def _spill(self, message):
+        if not self.spill_dir:
+            count("telemetry_dropped")
+            return
+        name = "{:.6f}.json".format(time.time())
+        try:
+            with open(os.path.join(self.spill_dir, name), "w") as f:
+                f.write(message)
+        except OSError:
+            logger.exception("Cannot spill telemetry")
+            count("telemetry_dropped")
+            return
+        self.spilled.append(name)
+        self.total_spilled += 1
+        count("telemetry_spilled")
+        while len(self.spilled) > self.spill_max_files:
+            self._remove_spilled(self.spilled.pop(0))
+            count("telemetry_dropped")
+
+    def _remove_spilled(self, name):
+        try:
+            os.remove(os.path.join(self.spill_dir, name))
+        except OSError:
+            pass
+
+    def _send_spilled(self):
+        name = self.spilled[0]
+        path = os.path.join(self.spill_dir, name)
+        try:
+            with open(path) as f:
+                message = f.read()
+        except OSError:
+            self.spilled.pop(0)
+            return
+        # sending is also the probe of whether the hub is back
+        if self._send(message, "metrics", os.path.getmtime(path)):
+            self.spilled.pop(0)
+            self._remove_spilled(name)
+
+    def get_metrics(self):
+        with self.condition:
+            queued = sum(len(queue) for queue in self.queues.values())
+        return {
+            "is_online": self.is_online,
+            "queued": queued,
+            "spilled": len(self.spilled),
+            "total_sent": self.total_sent,
+            "total_coalesced": self.total_coalesced,
+            "total_spilled": self.total_spilled,
+            "total_failed": self.total_failed,
+            "average_delivery_latency": self.average_delivery_latency,
+        }
@@ -0,0 +1,8 @@
+"""Conftest
+"""
+
+import os
+import sys
+
+# the modules of the InferenceModule are imported by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,88 @@
+"""Frame rate controller tests.
+"""
+
+from unittest import mock
+
+import frame_rate_controller
+from frame_rate_controller import FrameRateController
+
+
+class FakeClock:
+    """Stands for the time module of frame_rate_controller."""
+
+    def __init__(self):
+        self.now = 0
+
+    def time(self):
+        """time."""
+        return self.now
+
+
+def fake_stream(cam_id):
+    """fake_stream."""
+    return mock.MagicMock(
+        cam_id=cam_id,
+        cam_is_alive=True,
+        total_predicted=0,
+        average_request_latency=0,
+        requested_frame_rate=30,
+        frameRate=10,
+    )
+
+
+def test_utilization_from_session_time(monkeypatch):
+    """test_utilization_from_session_time.
+
+    The utilization is the session run time over the interval, whatever
+    time the streams spent waiting for a batch or a session.
+    """
+    clock = FakeClock()
+    monkeypatch.setattr(frame_rate_controller, "time", clock)
+    streams = [fake_stream("cam_1"), fake_stream("cam_2")]
+    model = mock.MagicMock(pool_size=1)
+    model.get_total_frame_rate.return_value = 20
+    model.get_total_session_time.return_value = 0
+    stream_manager = mock.MagicMock()
+    stream_manager.get_streams.return_value = streams
+    controller = FrameRateController(stream_manager, model)
+
+    controller.step()
+    clock.now = 10
+    for stream in streams:
+        stream.total_predicted = 50
+        # the waits of both streams overlap, they would read 180% busy
+        stream.total_predict_time = 9
+    model.get_total_session_time.return_value = 5
+    controller.step()
+
+    assert controller.get_metrics()["utilization"] == 0.5
+    # 10 fps at 50% is 18 fps at 90%, moved half way from 20
+    assert controller.get_metrics()["total_frame_rate"] == 19
+
+
+def test_failed_stream_not_skip_others(monkeypatch):
+    """test_failed_stream_not_skip_others.
+
+    A stream that can't take its frame rate doesn't hold the others.
+    """
+    clock = FakeClock()
+    monkeypatch.setattr(frame_rate_controller, "time", clock)
+    streams = [fake_stream("cam_1"), fake_stream("cam_2")]
+    streams[0].set_frame_rate.side_effect = RuntimeError("fake error")
+    model = mock.MagicMock(pool_size=1)
+    model.get_total_frame_rate.return_value = 10
+    model.get_total_session_time.return_value = 0
+    stream_manager = mock.MagicMock()
+    stream_manager.get_streams.return_value = streams
+    controller = FrameRateController(stream_manager, model)
+
+    controller.step()
+    clock.now = 10
+    model.get_total_session_time.return_value = 9
+    for stream in streams:
+        stream.total_predicted = 50
+        stream.average_request_latency = 1000
+    controller.step()
+
+    streams[0].set_frame_rate.assert_called_once()
+    streams[1].set_frame_rate.assert_called_once()
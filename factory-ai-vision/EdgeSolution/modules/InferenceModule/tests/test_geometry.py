@@ -0,0 +1,31 @@
+"""Geometry tests.
+"""
+
+from geometry import AoiIndex
+
+
+def polygon_aoi(x1, y1, x2, y2):
+    """polygon_aoi."""
+    return {
+        "type": "Polygon",
+        "label": [
+            {"x": x1, "y": y1},
+            {"x": x2, "y": y1},
+            {"x": x2, "y": y2},
+            {"x": x1, "y": y2},
+        ],
+    }
+
+
+def test_overlapping_polygons():
+    """test_overlapping_polygons.
+
+    A box where two polygon AOIs overlap is inside.
+    """
+    aoi_index = AoiIndex([polygon_aoi(0, 0, 60, 60), polygon_aoi(40, 40, 100, 100)])
+
+    inside = aoi_index.contains(
+        [[45, 45, 55, 55], [10, 10, 20, 20], [150, 150, 160, 160]], 200, 200
+    )
+
+    assert inside.tolist() == [True, True, False]
@@ -0,0 +1,52 @@
+"""Model wrapper tests.
+"""
+
+import threading
+from unittest import mock
+
+from model_wrapper import ONNXRuntimeModelDeploy
+
+
+def test_stale_model_update_skipped():
+    """test_stale_model_update_skipped.
+
+    Updates queued behind a running one are skipped but the latest, so the
+    last request wins.
+    """
+    onnx = ONNXRuntimeModelDeploy.__new__(ONNXRuntimeModelDeploy)
+    onnx.lock = threading.Lock()
+    onnx.model = None
+    onnx.model_update_lock = threading.Lock()
+    onnx.model_update_seq = 0
+    onnx.model_update_metrics = {}
+    onnx.warm_up = mock.MagicMock()
+    loading = threading.Event()
+    release = threading.Event()
+    loaded = []
+
+    def load_models(model_dir, is_default_model, is_scenario_model):
+        loaded.append(model_dir)
+        if model_dir == "model_1":
+            loading.set()
+            release.wait(timeout=5)
+        return [mock.MagicMock()]
+
+    onnx.load_models = load_models
+
+    first = threading.Thread(target=onnx.update_model, args=("model_1",))
+    first.start()
+    loading.wait(timeout=5)
+    threads = [
+        threading.Thread(target=onnx.update_model, args=(model_dir,))
+        for model_dir in ("model_2", "model_3")
+    ]
+    for thread in threads:
+        thread.start()
+        # model_3 is requested after model_2
+        thread.join(timeout=0.1)
+    release.set()
+    for thread in [first] + threads:
+        thread.join()
+
+    assert loaded == ["model_1", "model_3"]
+    assert onnx.get_model_update_metrics()["model_dir"] == "model_3"
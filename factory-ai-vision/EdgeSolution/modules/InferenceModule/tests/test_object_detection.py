@@ -0,0 +1,60 @@
+"""Object detection tests.
+"""
+
+from unittest import mock
+
+import numpy as np
+import pytest
+from onnxruntime.capi.onnxruntime_pybind11_state import InvalidArgument
+
+from object_detection import ObjectDetection
+
+
+def fake_model(run):
+    """fake_model.
+
+    An ObjectDetection of 1x3x4x4 inputs on a fake session.
+    """
+    model = ObjectDetection.__new__(ObjectDetection)
+    model.session = mock.MagicMock()
+    model.session.run.side_effect = run
+    model.input_name = "data"
+    model.supports_batch = True
+    return model
+
+
+def fixed_batch_run(_, feeds):
+    """A session with the batch size baked in."""
+    inputs = feeds["data"]
+    if inputs.shape[0] != 1:
+        raise InvalidArgument("Got invalid dimensions for input: data")
+    return [np.zeros((1, 5, 2, 2), np.float32)]
+
+
+def test_fixed_batch_model():
+    """test_fixed_batch_model.
+
+    A model that refused a batch runs the next ones input by input.
+    """
+    model = fake_model(fixed_batch_run)
+    inputs = [np.zeros((1, 3, 4, 4), np.float32) for _ in range(4)]
+
+    outputs, _ = model.predict_batch(inputs)
+    assert len(outputs) == 4
+    assert model.session.run.call_count == 5
+
+    model.predict_batch(inputs)
+    assert model.session.run.call_count == 9
+
+
+def test_runtime_error_raised():
+    """test_runtime_error_raised.
+
+    Other errors of the session are not hidden by the fallback.
+    """
+    model = fake_model(RuntimeError("fake error"))
+    inputs = [np.zeros((1, 3, 4, 4), np.float32) for _ in range(2)]
+
+    with pytest.raises(RuntimeError):
+        model.predict_batch(inputs)
+    assert model.supports_batch
@@ -0,0 +1,45 @@
+"""Postprocess tests.
+"""
+
+import numpy as np
+
+from postprocess import non_maximum_suppression
+
+
+def crowded_candidates(num_overlapping):
+    """crowded_candidates.
+
+    num_overlapping boxes of class 0 on top of each other, then one box of
+    class 1 away from them with the lowest probability.
+    """
+    boxes = np.array([[0.1, 0.1, 0.2, 0.2]] * num_overlapping + [[0.6, 0.6, 0.2, 0.2]])
+    class_probs = np.zeros((num_overlapping + 1, 2))
+    class_probs[:num_overlapping, 0] = np.linspace(0.9, 0.5, num_overlapping)
+    class_probs[num_overlapping, 1] = 0.4
+    return boxes, class_probs
+
+
+def test_nms_exact_by_default():
+    """test_nms_exact_by_default.
+
+    Every candidate is considered, however crowded the frame.
+    """
+    boxes, class_probs = crowded_candidates(400)
+
+    _, selected_classes, _ = non_maximum_suppression(boxes, class_probs, 20, 0.1, 0.45)
+
+    assert list(selected_classes) == [0, 1]
+
+
+def test_nms_top_k():
+    """test_nms_top_k.
+
+    With top_k, only the top_k most probable candidates are considered.
+    """
+    boxes, class_probs = crowded_candidates(400)
+
+    _, selected_classes, _ = non_maximum_suppression(
+        boxes, class_probs, 20, 0.1, 0.45, top_k=300
+    )
+
+    assert list(selected_classes) == [0]
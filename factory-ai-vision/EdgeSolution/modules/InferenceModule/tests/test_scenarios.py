@@ -0,0 +1,29 @@
+"""Scenario tests.
+"""
+
+from scenarios import Detection, PartCounter
+
+
+def test_snapshot_not_updated():
+    """test_snapshot_not_updated.
+
+    A snapshot keeps the counter and objects it was taken with while the
+    scenario goes on.
+    """
+    scenario = PartCounter(min_hits=1)
+    scenario.set_line(480, 0, 480, 540)
+    detection = Detection("part", 100, 100, 200, 200, 0.9)
+    for _ in range(3):
+        scenario.update([detection])
+    snapshot = scenario.snapshot()
+    counter = snapshot.counter
+    objs = [list(obj) for obj in snapshot.tracker.get_objs()]
+    assert objs
+
+    scenario.counter += 1
+    moved = Detection("part", 110, 100, 210, 200, 0.9)
+    scenario.update([moved])
+
+    assert snapshot.counter == counter
+    assert [list(obj) for obj in snapshot.tracker.get_objs()] == objs
+    assert [list(obj) for obj in scenario.tracker.get_objs()] != objs
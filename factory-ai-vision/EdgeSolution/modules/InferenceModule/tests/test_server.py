@@ -0,0 +1,93 @@
+"""Server tests.
+"""
+
+from unittest import mock
+
+import pytest
+
+import server
+from api.models import ConfigurationModel
+
+CAMERAS = {
+    "lva_mode": "http",
+    "fps": 10,
+    "cameras": [
+        {
+            "id": "1",
+            "name": "cam_1",
+            "type": "rtsp",
+            "source": "rtsp://fake",
+            "lines": "",
+            "zones": "",
+            "send_video_to_cloud": False,
+            "send_video_to_cloud_parts": [],
+            "enable_tracking": False,
+        }
+    ],
+}
+PARTS = {"parts": [{"id": "1", "name": "part_1"}]}
+
+
+@pytest.fixture
+def updates(monkeypatch):
+    """updates.
+
+    Record the updates apply_configuration makes, from a clean state.
+    """
+    monkeypatch.setattr(server, "applied_configuration", {})
+    monkeypatch.setattr(server, "applied_configuration_version", -1)
+    recorded = mock.MagicMock()
+    for name in (
+        "update_part_detection_mode",
+        "update_model",
+        "update_parts",
+        "update_cams",
+    ):
+        monkeypatch.setattr(server, name, getattr(recorded, name))
+    return recorded
+
+
+def apply(version, **sections):
+    """apply."""
+    return server.apply_configuration(ConfigurationModel(version=version, **sections))
+
+
+def test_apply_same_configuration_twice(updates):
+    """test_apply_same_configuration_twice.
+
+    Sections already applied are not updated again.
+    """
+    apply(1, part_detection_mode="PD", parts=PARTS, cameras=CAMERAS)
+    updates.reset_mock()
+
+    result = apply(2, part_detection_mode="PD", parts=PARTS, cameras=CAMERAS)
+
+    assert result["applied"] == []
+    updates.update_cams.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "sections",
+    [
+        {"part_detection_mode": "PC", "parts": PARTS},
+        {"part_detection_mode": "PD", "parts": {"parts": []}},
+        {
+            "part_detection_mode": "PD",
+            "parts": PARTS,
+            "model": {"model_dir": "scenario_models/2"},
+        },
+    ],
+)
+def test_apply_configuration_update_cams(updates, sections):
+    """test_apply_configuration_update_cams.
+
+    The streams are set up again when the mode, model or parts change, even
+    on the same cameras.
+    """
+    apply(1, part_detection_mode="PD", parts=PARTS, cameras=CAMERAS)
+    updates.reset_mock()
+
+    result = apply(2, cameras=CAMERAS, **sections)
+
+    assert "cameras" in result["applied"]
+    updates.update_cams.assert_called_once()
@@ -0,0 +1,81 @@
+"""Stream tests.
+"""
+
+from unittest import mock
+
+import numpy as np
+import pytest
+import requests
+
+import streams
+from streams import Stream
+
+
+def test_published_frame_reaches_subscriber():
+    """test_published_frame_reaches_subscriber.
+
+    A predicted frame is drawn by the renderer and encoded for the viewers.
+    """
+    model = mock.MagicMock(is_gpu=False, detection_mode="PD")
+    stream = Stream("cam_1", model, sender=None)
+    try:
+        with stream.broadcaster.subscribe():
+            image = np.zeros((540, 960, 3), np.uint8)
+            predictions = [
+                {
+                    "probability": 0.9,
+                    "tagName": "part",
+                    "boundingBox": {
+                        "left": 0.1,
+                        "top": 0.1,
+                        "width": 0.2,
+                        "height": 0.2,
+                    },
+                }
+            ]
+            stream.renderer.submit(image, predictions)
+            frame_id, jpg = stream.broadcaster.wait(0, timeout=5)
+        assert frame_id > 0
+        assert jpg[:2] == b"\xff\xd8"
+        assert stream.renderer.get_metrics()["total_rendered"] == 1
+    finally:
+        stream.renderer.stop()
+        stream.broadcaster.stop()
+
+
+@pytest.fixture
+def opencv_stream(monkeypatch):
+    """opencv_stream."""
+    monkeypatch.setattr(streams, "IS_OPENCV", "true")
+    model = mock.MagicMock(is_gpu=False, detection_mode="PD")
+    stream = Stream("cam_1", model, sender=None)
+    yield stream
+    stream.renderer.stop()
+    stream.broadcaster.stop()
+
+
+def test_set_frame_rate_failed(opencv_stream, monkeypatch):
+    """test_set_frame_rate_failed.
+
+    A frame rate the camera source didn't take is not recorded.
+    """
+    frame_rate = opencv_stream.frameRate
+    get = mock.MagicMock(side_effect=requests.exceptions.Timeout)
+    monkeypatch.setattr(streams.requests, "get", get)
+
+    opencv_stream.set_frame_rate(frame_rate + 5)
+
+    assert opencv_stream.frameRate == frame_rate
+    assert get.call_args[1]["timeout"] == streams.UPDATE_FPS_TIMEOUT
+
+
+def test_set_frame_rate(opencv_stream, monkeypatch):
+    """test_set_frame_rate."""
+    frame_rate = opencv_stream.frameRate
+    response = mock.MagicMock()
+    response.json.return_value = "ok"
+    monkeypatch.setattr(streams.requests, "get", mock.MagicMock(return_value=response))
+
+    opencv_stream.set_frame_rate(frame_rate + 5)
+
+    assert opencv_stream.frameRate == frame_rate + 5
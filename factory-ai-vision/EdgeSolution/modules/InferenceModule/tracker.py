@@ -2,6 +2,7 @@ from collections import namedtuple
 import numpy as np
 import cv2
 from sort import *
+from sort_engine import SortEngine
 
 #_m = (170 - 1487) / (680 - 815)
 #_b = 680/2 - _m * 170/2
@@ -13,19 +14,30 @@ from sort import *
 
 class Tracker():
     def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3):
-        self.tracker = Sort(max_age=max_age, min_hits=min_hits, iou_threshold=0.3)
+        self.tracker = SortEngine(max_age=max_age, min_hits=min_hits, iou_threshold=0.3)
         self.objs = []
+        self.classes = []
+        self.result = (self.objs, self.classes)
 
-    def update(self, detections):
+    def update(self, detections, classes=None):
         #_detections = list([d.x1, d.x2, d.y1, d.y2, d.score] for d in detections)
         if len(detections) > 0:
-            self.objs = self.tracker.update(np.array(detections))
+            result = self.tracker.update(np.array(detections), classes)
         else:
-            self.objs = self.tracker.update(np.empty((0, 5)))
+            result = self.tracker.update(np.empty((0, 5)))
+        # the pair is replaced at once, for readers in other threads
+        self.result = result
+        self.objs, self.classes = result
 
     def get_objs(self):
         return self.objs
 
+    def get_objs_and_classes(self):
+        return self.result
+
+    def get_classes(self):
+        return self.classes
+
 
 class Line():
     def __init__(self, x1, y1, x2, y2):
@@ -44,10 +56,15 @@ class Line():
         return 'Line: (%d,%d) -> (%d,%d), m: %s, b: %s' % (self.x1, self.y1, self.x2, self.y2, self.m, self.b)
 
     def compute_side(self, x, y):
+        # x and y can be arrays, to get the side of many points at once
         return self.m * x + self.b - y
 
     def is_same_side(self, x1, y1, x2, y2):
-        return 0.000000001 < (self.compute_side(x1, y1) * self.compute_side(x2, y2))
+        return self.are_same_side(self.compute_side(x1, y1), self.compute_side(x2, y2))
+
+    @staticmethod
+    def are_same_side(side1, side2):
+        return 0.000000001 < (side1 * side2)
 
 def bb_intersection_over_union(boxA, boxB):
     # determine the (x, y)-coordinates of the intersection rectangle
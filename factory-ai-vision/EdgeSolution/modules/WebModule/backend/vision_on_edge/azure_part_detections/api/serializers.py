@@ -3,7 +3,7 @@
 
 import logging
 
-from drf_extra_fields.fields import Base64ImageField
+from drf_extra_fields.fields import HybridImageField
 from rest_framework import serializers
 
 from ...camera_tasks.api.serializers import CameraTaskSerializer
@@ -132,7 +132,7 @@ class UploadRelabelSerializer(serializers.Serializer):
 
     part_name = serializers.CharField()
     labels = serializers.CharField()
-    img = Base64ImageField(required=True)
+    img = HybridImageField(required=True)
     confidence = serializers.FloatField()
     is_relabel = serializers.BooleanField()
     camera_id = serializers.IntegerField()
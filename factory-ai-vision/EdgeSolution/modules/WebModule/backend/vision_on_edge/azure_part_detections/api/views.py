@@ -6,7 +6,6 @@ from __future__ import absolute_import, unicode_literals
 import logging
 
 import requests
-from django.core.files.images import ImageFile
 from django.utils import timezone
 from drf_yasg2 import openapi
 from drf_yasg2.utils import swagger_auto_schema
@@ -25,7 +24,6 @@ from ...general.api.serializers import (
     SimpleOKSerializer,
 )
 from ...general.shortcuts import drf_get_object_or_404
-from ...images.models import Image
 from ..exceptions import (
     PdExportInfereceReadTimeout,
     PdInferenceModuleUnreachable,
@@ -33,10 +31,11 @@ from ..exceptions import (
     PdProbThresholdOutOfRange,
     PdRelabelConfidenceOutOfRange,
     PdRelabelDemoProjectError,
-    PdRelabelImageFull,
+    PdRelabelQueueFull,
     PdRelabelWithoutProject,
 )
 from ..models import PartDetection, PDScenario
+from ..relabel_queue import RELABEL_QUEUE, RelabelImage
 from ..utils import if_trained_then_deploy_helper
 from .serializers import (
     ExportSerializer,
@@ -143,15 +142,9 @@ class PartDetectionViewSet(FiltersMixin, viewsets.ModelViewSet):
                 }
             )
         try:
-            res = requests.get(
-                "http://" + inference_module_obj.url + "/metrics",
-                params={"cam_id": cam_id},
-                timeout=3,
-            )
-            data = res.json()
+            data = inference_module_obj.metrics(cam_id)
             success_rate = int(data["success_rate"] * 100) / 100
             inference_num = data["inference_num"]
-            device = inference_module_obj.device()
             unidentified_num = data["unidentified_num"]
             average_inference_time = data["average_inference_time"]
             last_prediction_count = data["last_prediction_count"]
@@ -160,7 +153,6 @@ class PartDetectionViewSet(FiltersMixin, viewsets.ModelViewSet):
             raise PdInferenceModuleUnreachable from err
         except ReadTimeout as err:
             raise PdExportInfereceReadTimeout from err
-        deploy_status_obj.save()
         logger.info(
             "Deploy status: %s, %s", deploy_status_obj.status, deploy_status_obj.log
         )
@@ -238,9 +230,6 @@ class PartDetectionViewSet(FiltersMixin, viewsets.ModelViewSet):
         if project_obj.is_demo:
             raise PdRelabelDemoProjectError
 
-        # Relabel images count does not exceed project.maxImages
-        # Handled by signals
-
         confidence_float = serializer.validated_data["confidence"] * 100
         # Confidence check
         if (
@@ -250,70 +239,23 @@ class PartDetectionViewSet(FiltersMixin, viewsets.ModelViewSet):
             logger.error("Inferenece confidence %s out of range", confidence_float)
             raise PdRelabelConfidenceOutOfRange
 
-        # Relabel images count does not exceed project.maxImages
-        if (
-            instance.maxImages
-            > Image.objects.filter(
-                project=project_obj, part=part, is_relabel=True
-            ).count()
-        ):
-            img_io = serializer.validated_data["img"].file
-
-            img = ImageFile(img_io)
-            img.name = str(timezone.now()) + ".jpg"
-            img_obj = Image(
-                image=img,
-                part_id=part.id,
-                camera_id=serializer.validated_data["camera_id"],
-                labels=serializer.validated_data["labels"],
-                confidence=serializer.validated_data["confidence"],
-                project=instance.project,
-                is_relabel=True,
-            )
-            img_obj.save()
-            return Response({"status": "ok"})
-
-        # User is not relabling and exceed maxImages
-        # queue...
-        logger.info(project_obj.relabel_expired_time)
-        logger.info(timezone.now())
-        if project_obj.relabel_expired_time < timezone.now():
-            logger.info("Queuing relabel images...")
-            img_io = serializer.validated_data["img"].file
-            img = ImageFile(img_io)
-            img.name = str(timezone.now()) + ".jpg"
-            img_obj = Image(
-                image=img,
-                camera_id=serializer.validated_data["camera_id"],
-                part_id=part.id,
-                labels=serializer.validated_data["labels"],
-                confidence=serializer.validated_data["confidence"],
-                project=project_obj,
-                is_relabel=True,
-            )
-            img_obj.save()
-            # pop
-            earliest_img = (
-                Image.objects.filter(project=project_obj, part=part, is_relabel=True)
-                .order_by("timestamp")
-                .first()
-            )
-            if earliest_img is not None:
-                earliest_img.delete()
-            return Response({"status": "ok"})
-            # pop image
-
-        # User is relabeling and exceed maxImages
-        for _ in range(
-            Image.objects.filter(
-                project=project_obj, part=part, is_relabel=True
-            ).count()
-            - instance.maxImages
-        ):
-            Image.objects.filter(
-                project=project_obj, part=part, is_relabel=True
-            ).order_by("timestamp").last().delete()
-        raise PdRelabelImageFull
+        # Relabel images count does not exceed maxImages
+        # Handled by the relabel queue
+        img = serializer.validated_data["img"]
+        img.seek(0)
+        relabel_image = RelabelImage(
+            project_id=project_obj.id,
+            part_id=part.id,
+            camera_id=serializer.validated_data["camera_id"],
+            labels=serializer.validated_data["labels"],
+            confidence=serializer.validated_data["confidence"],
+            jpg=img.read(),
+            max_images=instance.maxImages,
+            is_relabeling=project_obj.relabel_expired_time >= timezone.now(),
+        )
+        if not RELABEL_QUEUE.put(relabel_image):
+            raise PdRelabelQueueFull
+        return Response({"status": "ok"})
 
 
 class PDScenarioViewSet(viewsets.ReadOnlyModelViewSet):
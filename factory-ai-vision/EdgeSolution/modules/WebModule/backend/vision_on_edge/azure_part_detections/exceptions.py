@@ -65,6 +65,12 @@ class PdRelabelImageFull(APIException):
     default_code = "pd_relabel_image_full"
 
 
+class PdRelabelQueueFull(APIException):
+    status_code = 503
+    default_detail = "Too many relabel images waiting to be saved."
+    default_code = "pd_relabel_queue_full"
+
+
 class PdDeployToInfereceError(APIException):
     status_code = 503
     default_detail = (
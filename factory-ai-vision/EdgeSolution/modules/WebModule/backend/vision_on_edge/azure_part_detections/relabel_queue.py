@@ -0,0 +1,220 @@
+"""App relabel queue.
+
+The inference module posts relabel images from its inference threads.
+upload_relabel_image only validates them and puts them in a bounded
+queue. A worker thread drops the near identical frames of a camera and
+part, then saves the rest in batches, keeping the latest maxImages
+relabel images of each part.
+"""
+
+import logging
+import queue
+import threading
+import time
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image as PILImage
+
+from ..images.models import Image
+
+logger = logging.getLogger(__name__)
+
+RELABEL_QUEUE_SIZE = 64
+RELABEL_BATCH_SIZE = 16
+RELABEL_BATCH_WAIT = 1  # Seconds
+# Max differing bits between the hashes of two near identical frames
+DEDUP_DISTANCE = 4
+# The last hash of a camera and part not seen for that long is forgotten
+DEDUP_IDLE_TIMEOUT = 600  # Seconds
+
+
+class RelabelImage:
+    """An uploaded relabel image.
+
+    Args:
+        jpg (bytes): the image.
+        max_images: relabel images kept for the part.
+        is_relabeling: someone is labeling the relabel images, they are
+            not replaced then.
+    """
+
+    def __init__(
+        self,
+        project_id,
+        part_id,
+        camera_id,
+        labels,
+        confidence,
+        jpg,
+        max_images,
+        is_relabeling,
+    ):
+        self.project_id = project_id
+        self.part_id = part_id
+        self.camera_id = camera_id
+        self.labels = labels
+        self.confidence = confidence
+        self.jpg = jpg
+        self.max_images = max_images
+        self.is_relabeling = is_relabeling
+
+
+def dhash(jpg) -> int:
+    """64 bits difference hash of an image."""
+    with PILImage.open(BytesIO(jpg)) as img:
+        pixels = list(img.convert("L").resize((9, 8)).getdata())
+    result = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            result = result << 1 | (left > right)
+    return result
+
+
+class RelabelQueue:
+    """RelabelQueue."""
+
+    def __init__(self, maxsize=RELABEL_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.mutex = threading.Lock()
+        self.worker = None
+        # (part_id, camera_id): (hash of the last image kept, last seen)
+        self.last_hashes = {}
+        self.total_saved = 0
+        self.total_duplicated = 0
+        self.total_dropped = 0
+
+    def put(self, relabel_image: RelabelImage) -> bool:
+        """Queue an image, never blocks.
+
+        Returns:
+            False if the queue is full and the image is dropped.
+        """
+        with self.mutex:
+            if self.worker is None:
+                self.worker = threading.Thread(
+                    target=self._run, name="relabel_queue", daemon=True
+                )
+                self.worker.start()
+        try:
+            self.queue.put_nowait(relabel_image)
+        except queue.Full:
+            self.total_dropped += 1
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            items = [self.queue.get()]
+            deadline = time.time() + RELABEL_BATCH_WAIT
+            while len(items) < RELABEL_BATCH_SIZE:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            # the thread lives long, its connection may have been closed
+            # or broken since the last batch
+            close_old_connections()
+            try:
+                self.save_batch(items)
+            except Exception:
+                logger.exception("Save relabel images failed")
+            finally:
+                close_old_connections()
+
+    def save_batch(self, items):
+        """Deduplicate and save a batch of RelabelImage."""
+        parts = {}
+        for item in self.deduplicate(items):
+            parts.setdefault((item.project_id, item.part_id), []).append(item)
+        for (project_id, part_id), part_items in parts.items():
+            self._save_part(project_id, part_id, part_items)
+
+    def deduplicate(self, items):
+        """Drop the images near identical to the last one of their camera
+        and part.
+        """
+        now = time.time()
+        self._prune_hashes(now)
+        result = []
+        for item in items:
+            try:
+                item_hash = dhash(item.jpg)
+            except Exception:
+                logger.exception("Invalid relabel image")
+                continue
+            key = (item.part_id, item.camera_id)
+            last_hash, _ = self.last_hashes.get(key, (None, None))
+            if (
+                last_hash is not None
+                and bin(last_hash ^ item_hash).count("1") <= DEDUP_DISTANCE
+            ):
+                self.last_hashes[key] = (last_hash, now)
+                self.total_duplicated += 1
+                continue
+            self.last_hashes[key] = (item_hash, now)
+            result.append(item)
+        return result
+
+    def _prune_hashes(self, now):
+        """Forget the cameras and parts idle for DEDUP_IDLE_TIMEOUT."""
+        for key, (_, last_seen) in list(self.last_hashes.items()):
+            if last_seen + DEDUP_IDLE_TIMEOUT < now:
+                del self.last_hashes[key]
+
+    def _save_part(self, project_id, part_id, items):
+        # the settings of the latest upload apply
+        max_images = max(0, items[-1].max_images)
+        image_ids = list(
+            Image.objects.filter(
+                project_id=project_id, part_id=part_id, is_relabel=True
+            )
+            .order_by("-timestamp")
+            .values_list("id", flat=True)
+        )
+        if items[-1].is_relabeling:
+            kept = items[: max(0, max_images - len(image_ids))]
+        else:
+            kept = items[len(items) - min(len(items), max_images) :]
+        self.total_dropped += len(items) - len(kept)
+        items = kept
+        # image_ids are newest first, the oldest go
+        to_delete = image_ids[max(0, max_images - len(items)) :]
+
+        with transaction.atomic():
+            if to_delete:
+                Image.objects.filter(id__in=to_delete).delete()
+            Image.objects.bulk_create(
+                [
+                    Image(
+                        image=ContentFile(item.jpg, name=str(timezone.now()) + ".jpg"),
+                        project_id=project_id,
+                        part_id=part_id,
+                        camera_id=item.camera_id,
+                        labels=item.labels,
+                        confidence=item.confidence,
+                        is_relabel=True,
+                    )
+                    for item in items
+                ]
+            )
+        self.total_saved += len(items)
+
+    def get_metrics(self):
+        return {
+            "queued": self.queue.qsize(),
+            "total_saved": self.total_saved,
+            "total_duplicated": self.total_duplicated,
+            "total_dropped": self.total_dropped,
+            "hashes": len(self.last_hashes),
+        }
+
+
+RELABEL_QUEUE = RelabelQueue()
@@ -0,0 +1,122 @@
+"""App relabel queue tests.
+"""
+
+import pytest
+
+from ...images.models import Image
+from .. import relabel_queue
+from ..relabel_queue import RelabelImage, RelabelQueue
+
+pytestmark = pytest.mark.django_db
+
+with open("vision_on_edge/cameras/tests/test.png", "rb") as f:
+    PNG = f.read()
+
+
+@pytest.fixture(autouse=True)
+def mock_dhash(monkeypatch):
+    """mock_dhash.
+
+    The last byte of an image picks its hash, 16 bits away from the others.
+    """
+    monkeypatch.setattr(relabel_queue, "dhash", lambda jpg: 0xFF << (8 * jpg[-1]))
+
+
+def relabel_image(project, part, frame, max_images=3, is_relabeling=False):
+    """relabel_image."""
+    return RelabelImage(
+        project_id=project.id,
+        part_id=part.id,
+        camera_id=None,
+        labels="[]",
+        confidence=0.5,
+        jpg=PNG + bytes([frame]),
+        max_images=max_images,
+        is_relabeling=is_relabeling,
+    )
+
+
+def test_keep_latest_max_images(project, part):
+    """test_keep_latest_max_images.
+
+    Each part keeps its latest max_images relabel images.
+    """
+    queue = RelabelQueue()
+    queue.save_batch([relabel_image(project, part, frame) for frame in range(2)])
+    queue.save_batch([relabel_image(project, part, frame) for frame in range(2, 5)])
+
+    images = Image.objects.filter(project=project, part=part, is_relabel=True)
+    assert images.count() == 3
+    assert sorted(image.image.read()[-1] for image in images) == [2, 3, 4]
+
+
+def test_drop_duplicated_frames(project, part):
+    """test_drop_duplicated_frames."""
+    queue = RelabelQueue()
+    queue.save_batch([relabel_image(project, part, 1) for _ in range(3)])
+
+    assert Image.objects.filter(is_relabel=True).count() == 1
+    assert queue.get_metrics()["total_duplicated"] == 2
+
+
+def test_not_replace_while_relabeling(project, part):
+    """test_not_replace_while_relabeling.
+
+    While someone is relabeling, new images only fill the free slots.
+    """
+    queue = RelabelQueue()
+    queue.save_batch([relabel_image(project, part, frame) for frame in range(2)])
+    queue.save_batch(
+        [
+            relabel_image(project, part, frame, is_relabeling=True)
+            for frame in range(2, 5)
+        ]
+    )
+
+    images = Image.objects.filter(project=project, part=part, is_relabel=True)
+    assert sorted(image.image.read()[-1] for image in images) == [0, 1, 2]
+
+
+def test_forget_idle_hashes(project, part, monkeypatch):
+    """test_forget_idle_hashes.
+
+    The last hash of a camera and part idle for DEDUP_IDLE_TIMEOUT is
+    dropped, a new image is not compared with it anymore.
+    """
+    queue = RelabelQueue()
+    queue.save_batch([relabel_image(project, part, 1)])
+    assert queue.get_metrics()["hashes"] == 1
+
+    now = relabel_queue.time.time()
+    monkeypatch.setattr(
+        relabel_queue.time,
+        "time",
+        lambda: now + relabel_queue.DEDUP_IDLE_TIMEOUT + 1,
+    )
+    queue.save_batch([relabel_image(project, part, 1)])
+
+    assert queue.get_metrics()["total_duplicated"] == 0
+    assert Image.objects.filter(is_relabel=True).count() == 2
+
+
+def test_close_old_connections(monkeypatch):
+    """test_close_old_connections.
+
+    The worker closes stale connections around each batch.
+    """
+    queue = RelabelQueue()
+    calls = []
+    monkeypatch.setattr(
+        relabel_queue, "close_old_connections", lambda: calls.append("close")
+    )
+
+    def save_batch(items):
+        calls.append("save")
+        raise SystemExit
+
+    monkeypatch.setattr(queue, "save_batch", save_batch)
+    queue.queue.put(None)
+    with pytest.raises(SystemExit):
+        queue._run()
+
+    assert calls == ["close", "save", "close"]
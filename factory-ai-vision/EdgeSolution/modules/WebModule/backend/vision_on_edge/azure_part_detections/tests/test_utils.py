@@ -0,0 +1,83 @@
+"""App utilities tests.
+"""
+
+from unittest import mock
+
+import pytest
+
+from .. import utils
+from ..utils import deploy_configuration
+
+CONFIGURATION = {
+    "version": 1,
+    "part_detection_id": 1,
+    "part_detection_mode": "PD",
+    "parts": {"parts": []},
+    "retrain_parameters": {},
+    "iothub_parameters": {},
+    "cameras": {"fps": 10, "lva_mode": "http", "cameras": []},
+    "prob_threshold": 60,
+}
+
+
+def fake_response(status_code, json_data=None):
+    """fake_response."""
+    response = mock.MagicMock(status_code=status_code)
+    response.json.return_value = json_data
+    return response
+
+
+@pytest.fixture
+def mock_requests(monkeypatch):
+    """mock_requests.
+
+    inference-1 has /apply_configuration, inference-2 does not.
+    """
+    post = mock.MagicMock(
+        side_effect=lambda url, **kwargs: fake_response(404)
+        if url.startswith("http://inference-2/apply_configuration")
+        else fake_response(200, {"version": 1, "applied": ["parts"]})
+    )
+    get = mock.MagicMock(return_value=fake_response(200))
+    monkeypatch.setattr(utils.requests, "post", post)
+    monkeypatch.setattr(utils.requests, "get", get)
+    return post, get
+
+
+def test_deploy_configuration_to_several_modules(mock_requests):
+    """test_deploy_configuration_to_several_modules.
+
+    Every inference module gets the configuration, the ones without
+    /apply_configuration one setting at a time.
+    """
+    post, get = mock_requests
+    results = deploy_configuration(["inference-1", "inference-2"], CONFIGURATION)
+
+    assert results["inference-1"] == ["parts"]
+    assert "cameras" in results["inference-2"]
+    post_urls = [
+        call[0][0] if call[0] else call[1]["url"] for call in post.call_args_list
+    ]
+    assert "http://inference-1/apply_configuration" in post_urls
+    assert "http://inference-2/update_cams" in post_urls
+    assert "http://inference-1/update_cams" not in post_urls
+    get_urls = [call[0][0] for call in get.call_args_list]
+    assert all(url.startswith("http://inference-2/") for url in get_urls)
+
+
+def test_deploy_configuration_failure(monkeypatch):
+    """test_deploy_configuration_failure.
+
+    A module that can't be reached doesn't stop the others.
+    """
+
+    def post(url, **kwargs):
+        if url.startswith("http://down/"):
+            raise ConnectionError("down")
+        return fake_response(200, {"version": 1, "applied": []})
+
+    monkeypatch.setattr(utils.requests, "post", post)
+    results = deploy_configuration(["down", "up"], CONFIGURATION)
+
+    assert isinstance(results["down"], ConnectionError)
+    assert results["up"] == []
@@ -6,6 +6,7 @@ import logging
 import threading
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 from django.utils import timezone
@@ -13,11 +14,19 @@ from django.utils import timezone
 from ..azure_pd_deploy_status import progress as deploy_progress
 from ..azure_pd_deploy_status.utils import upcreate_deploy_status
 from ..azure_training_status.models import TrainingStatus
+from ..azure_training_status.utils import (
+    get_training_status_version,
+    wait_training_status_update,
+)
 from .api.serializers import UpdateCamBodySerializer
 from .models import PartDetection
 
 logger = logging.getLogger(__name__)
 
+# Seconds between two reads of the training status when nothing wakes us
+TRAINING_STATUS_TIMEOUT = 30
+REQUEST_TIMEOUT = 60
+
 
 def if_trained_then_deploy_worker(part_detection_id):
     """if_trained_then_deploy_worker.
@@ -33,8 +42,8 @@ def if_trained_then_deploy_worker(part_detection_id):
     part_detection_obj = PartDetection.objects.get(pk=part_detection_id)
     project_obj = part_detection_obj.project
     last_log = None
+    version = get_training_status_version(project_obj.id)
     while True:
-        time.sleep(1)
         training_status_obj = TrainingStatus.objects.get(project=project_obj)
         logger.info("Listening on Training Status: %s", training_status_obj)
         if training_status_obj.status in ["ok", "failed"]:
@@ -46,6 +55,10 @@ def if_trained_then_deploy_worker(part_detection_id):
                 log=training_status_obj.log,
             )
             last_log = training_status_obj.log
+        # woken by the training worker, the timeout covers other writers
+        version = wait_training_status_update(
+            project_obj.id, version, timeout=TRAINING_STATUS_TIMEOUT
+        )
 
     # =====================================================
     # 2. Project training failed                        ===
@@ -88,18 +101,15 @@ def if_trained_then_deploy_worker(part_detection_id):
     )
 
 
-def deploy_worker(part_detection_id):
-    """deploy.
+def get_deploy_configuration(instance: PartDetection) -> dict:
+    """get_deploy_configuration.
+
+    Everything a deploy sets on an inference module, as one document for
+    its /apply_configuration.
 
     Args:
-        part_detection_obj: Part Detection Objects
+        instance (PartDetection): a configured part detection
     """
-    REQUEST_TIMEOUT = 60
-    instance: PartDetection = PartDetection.objects.get(pk=part_detection_id)
-    if not instance.has_configured:
-        logger.error("This PartDetection is not configured")
-        logger.error("Not sending any request to inference")
-        return
     confidence_min = getattr(instance, "accuracyRangeMin", 30)
     confidence_max = getattr(instance, "accuracyRangeMax", 80)
     max_images = getattr(instance, "maxImages", 10)
@@ -108,84 +118,47 @@ def deploy_worker(part_detection_id):
     metrics_frame_per_minutes = getattr(instance, "metrics_frame_per_minutes", 6)
     need_retraining = getattr(instance, "needRetraining", False)
 
-    # =====================================================
-    # 1. Update params                                  ===
-    # =====================================================
-    requests.get(
-        "http://" + str(instance.inference_module.url) + "/update_part_detection_id",
-        params={"part_detection_id": instance.id},
-        timeout=REQUEST_TIMEOUT,
-    )
-    requests.get(
-        "http://" + str(instance.inference_module.url) + "/update_part_detection_mode",
-        params={"part_detection_mode": instance.inference_mode},
-        timeout=REQUEST_TIMEOUT,
-    )
+    configuration = {
+        # newer deploys win on the inference module
+        "version": int(time.time() * 1000),
+        "part_detection_id": instance.id,
+        "part_detection_mode": instance.inference_mode,
+    }
 
     # =====================================================
-    # 2. Update model                                  ===
+    # 1. Model                                          ===
     # =====================================================
     if not instance.project:
         pass
     elif instance.project.is_demo:
-        requests.post(
-            "http://" + str(instance.inference_module.url) + "/update_model",
-            json={"model_dir": instance.project.download_uri},
-            timeout=REQUEST_TIMEOUT,
-        )
-
+        configuration["model"] = {"model_dir": instance.project.download_uri}
     elif not instance.inference_module.is_vpu():
-        requests.post(
-            "http://" + str(instance.inference_module.url) + "/update_model",
-            json={"model_uri": instance.project.download_uri},
-            timeout=REQUEST_TIMEOUT,
-        )
+        configuration["model"] = {"model_uri": instance.project.download_uri}
     else:
-        requests.post(
-            "http://" + str(instance.inference_module.url) + "/update_model",
-            json={"model_uri": instance.project.download_uri_fp16},
-            timeout=REQUEST_TIMEOUT,
-        )
+        configuration["model"] = {"model_uri": instance.project.download_uri_fp16}
 
     # =====================================================
-    # 3. Update parts                                   ===
+    # 2. Parts and params                               ===
     # =====================================================
-    logger.info("Update Parts!!!")
-    parts = instance.parts.all()
-    res_data = {"parts": []}
-
-    for part in parts.all():
-        res_data["parts"].append({"id": part.id, "name": part.name})
-    requests.post(
-        url="http://" + instance.inference_module.url + "/update_parts",
-        json=res_data,
-        timeout=REQUEST_TIMEOUT,
-    )
-
-    requests.get(
-        "http://" + instance.inference_module.url + "/update_retrain_parameters",
-        params={
-            "is_retrain": need_retraining,
-            "confidence_min": confidence_min,
-            "confidence_max": confidence_max,
-            "max_images": max_images,
-        },
-        timeout=REQUEST_TIMEOUT,
-    )
-    requests.get(
-        "http://" + instance.inference_module.url + "/update_iothub_parameters",
-        params={
-            "is_send": metrics_is_send_iothub,
-            "threshold": metrics_accuracy_threshold,
-            "fpm": metrics_frame_per_minutes,
-        },
-        timeout=REQUEST_TIMEOUT,
-    )
+    configuration["parts"] = {
+        "parts": [{"id": part.id, "name": part.name} for part in instance.parts.all()]
+    }
+    configuration["retrain_parameters"] = {
+        "is_retrain": need_retraining,
+        "confidence_min": confidence_min,
+        "confidence_max": confidence_max,
+        "max_images": max_images,
+    }
+    configuration["iothub_parameters"] = {
+        "is_send": metrics_is_send_iothub,
+        "threshold": metrics_accuracy_threshold,
+        "fpm": metrics_frame_per_minutes,
+    }
+    configuration["prob_threshold"] = instance.prob_threshold
 
     # =====================================================
-    # 4. Update cams                                    ===
+    # 3. Cams                                           ===
     # =====================================================
-    logger.info("Update Cam!!!")
     cameras = instance.cameras.all()
     res_data = {
         "fps": instance.fps,
@@ -194,6 +167,7 @@ def deploy_worker(part_detection_id):
     }
 
     for cam in cameras.all():
+        camera_task = cam.cameratask_set.first()
         cam_info = {
             "id": cam.id,
             "name": cam.name,
@@ -201,14 +175,13 @@ def deploy_worker(part_detection_id):
             "source": cam.rtsp,
             "lines": cam.lines,
             "zones": cam.danger_zones,
-            "send_video_to_cloud": cam.cameratask_set.first().send_video_to_cloud,
+            "send_video_to_cloud": camera_task.send_video_to_cloud,
             "send_video_to_cloud_parts": [
-                {"id": part.id, "name": part.name}
-                for part in cam.cameratask_set.first().parts.all()
+                {"id": part.id, "name": part.name} for part in camera_task.parts.all()
             ],
-            "send_video_to_cloud_threshold": cam.cameratask_set.first().send_video_to_cloud_threshold,
-            "recording_duration": cam.cameratask_set.first().recording_duration,
-            "enable_tracking": cam.cameratask_set.first().enable_tracking,
+            "send_video_to_cloud_threshold": camera_task.send_video_to_cloud_threshold,
+            "recording_duration": camera_task.recording_duration,
+            "enable_tracking": camera_task.enable_tracking,
         }
         if cam.area:
             cam_info["aoi"] = cam.area
@@ -217,19 +190,124 @@ def deploy_worker(part_detection_id):
     serializer = UpdateCamBodySerializer(data=res_data)
     serializer.is_valid(raise_exception=True)
     logger.info(serializer.validated_data)
+    configuration["cameras"] = json.loads(json.dumps(serializer.validated_data))
+    return configuration
+
+
+def apply_configuration_by_parts(url, configuration: dict, timeout=REQUEST_TIMEOUT):
+    """apply_configuration_by_parts.
+
+    Send a configuration one setting at a time, for inference modules
+    without /apply_configuration.
+    """
+    requests.get(
+        "http://" + url + "/update_part_detection_id",
+        params={"part_detection_id": configuration["part_detection_id"]},
+        timeout=timeout,
+    )
+    requests.get(
+        "http://" + url + "/update_part_detection_mode",
+        params={"part_detection_mode": configuration["part_detection_mode"]},
+        timeout=timeout,
+    )
+    if "model" in configuration:
+        requests.post(
+            "http://" + url + "/update_model",
+            json=configuration["model"],
+            timeout=timeout,
+        )
+    logger.info("Update Parts!!!")
     requests.post(
-        url="http://" + instance.inference_module.url + "/update_cams",
-        json=dict(serializer.validated_data),
-        timeout=REQUEST_TIMEOUT,
+        url="http://" + url + "/update_parts",
+        json=configuration["parts"],
+        timeout=timeout,
+    )
+    requests.get(
+        "http://" + url + "/update_retrain_parameters",
+        params=configuration["retrain_parameters"],
+        timeout=timeout,
     )
-    # =====================================================
-    # 5. Update prob_threshold                          ===
-    # =====================================================
     requests.get(
-        "http://" + instance.inference_module.url + "/update_prob_threshold",
-        params={"prob_threshold": instance.prob_threshold},
-        timeout=REQUEST_TIMEOUT,
+        "http://" + url + "/update_iothub_parameters",
+        params=configuration["iothub_parameters"],
+        timeout=timeout,
     )
+    logger.info("Update Cam!!!")
+    requests.post(
+        url="http://" + url + "/update_cams",
+        json=configuration["cameras"],
+        timeout=timeout,
+    )
+    requests.get(
+        "http://" + url + "/update_prob_threshold",
+        params={"prob_threshold": configuration["prob_threshold"]},
+        timeout=timeout,
+    )
+
+
+def apply_configuration(url, configuration: dict, timeout=REQUEST_TIMEOUT) -> list:
+    """apply_configuration.
+
+    Send a configuration to an inference module in one request.
+
+    Returns:
+        list: the sections the inference module changed
+    """
+    res = requests.post(
+        "http://" + url + "/apply_configuration",
+        json=configuration,
+        timeout=timeout,
+    )
+    if res.status_code == 404:
+        logger.info("%s has no /apply_configuration, sending settings one by one", url)
+        apply_configuration_by_parts(url, configuration, timeout=timeout)
+        return [key for key in configuration if key != "version"]
+    res.raise_for_status()
+    return res.json()["applied"]
+
+
+def deploy_configuration(urls, configuration: dict) -> dict:
+    """deploy_configuration.
+
+    Apply a configuration on several inference modules at the same time.
+
+    Returns:
+        dict: url to the sections applied, or to the exception raised
+    """
+    results = {}
+    if not urls:
+        return results
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        futures = {
+            url: executor.submit(apply_configuration, url, configuration)
+            for url in urls
+        }
+        for url, future in futures.items():
+            try:
+                results[url] = future.result()
+                logger.info("%s applied %s", url, results[url])
+            except Exception as error:
+                logger.exception("Deploy to %s failed", url)
+                results[url] = error
+    return results
+
+
+def deploy_worker(part_detection_id):
+    """deploy.
+
+    Args:
+        part_detection_obj: Part Detection Objects
+    """
+    instance: PartDetection = PartDetection.objects.get(pk=part_detection_id)
+    if not instance.has_configured:
+        logger.error("This PartDetection is not configured")
+        logger.error("Not sending any request to inference")
+        return
+    configuration = get_deploy_configuration(instance)
+    results = deploy_configuration([instance.inference_module.url], configuration)
+    for error in results.values():
+        if isinstance(error, Exception):
+            raise error
 
 
 def if_trained_then_deploy_catcher(part_detection_id):
@@ -0,0 +1,197 @@
+"""App job tracker.
+
+One scheduler thread polls Custom Vision for every training and export
+job in flight, instead of a one second loop per job. A job is polled
+again after an interval growing from MIN_INTERVAL to MAX_INTERVAL while
+nothing changes, and back to MIN_INTERVAL when its state changes.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MIN_INTERVAL = 1
+MAX_INTERVAL = 15
+BACKOFF = 1.5
+
+
+class Job:
+    """Job.
+
+    Args:
+        poll: called by the scheduler, returns (is_done, state). state is
+            compared between polls to detect progress, it is the result
+            of the job once done.
+        on_done: called by the scheduler with the job once done.
+        timeout: seconds before the job fails with TimeoutError.
+    """
+
+    def __init__(self, poll, on_done=None, timeout=None):
+        self.poll = poll
+        self.on_done = on_done
+        self.deadline = time.time() + timeout if timeout else None
+        self.interval = MIN_INTERVAL
+        self.state = None
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self):
+        """Block until the job is done and return its result.
+
+        Raises:
+            the exception of poll, or TimeoutError.
+        """
+        self.done.wait()
+        if self.error:
+            raise self.error
+        return self.result
+
+
+class JobTracker:
+    """JobTracker."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        # heap of (due time, seq, job)
+        self.jobs = []
+        self.seq = itertools.count()
+        self.worker = None
+
+    def add(self, poll, on_done=None, timeout=None) -> Job:
+        """Track a job, the first poll happens after MIN_INTERVAL."""
+        job = Job(poll=poll, on_done=on_done, timeout=timeout)
+        with self.condition:
+            if self.worker is None:
+                self.worker = threading.Thread(
+                    target=self._run, name="job_tracker", daemon=True
+                )
+                self.worker.start()
+            self._schedule(job)
+        return job
+
+    def wait(self, poll, timeout=None):
+        """Track a job and block until it is done, see Job.wait."""
+        return self.add(poll=poll, timeout=timeout).wait()
+
+    def get_job_count(self) -> int:
+        """Jobs in flight."""
+        with self.condition:
+            return len(self.jobs)
+
+    def _schedule(self, job):
+        heapq.heappush(self.jobs, (time.time() + job.interval, next(self.seq), job))
+        self.condition.notify()
+
+    def _next_job(self):
+        with self.condition:
+            while True:
+                if not self.jobs:
+                    self.condition.wait()
+                    continue
+                delay = self.jobs[0][0] - time.time()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                return heapq.heappop(self.jobs)[2]
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            try:
+                is_done, state = job.poll()
+            except Exception as error:
+                logger.exception("Job poll failed")
+                job.error = error
+                is_done, state = True, None
+            if not is_done and job.deadline and time.time() > job.deadline:
+                job.error = TimeoutError("Job timed out")
+                is_done = True
+            if is_done:
+                job.result = state
+                self._finish(job)
+                continue
+            if state != job.state:
+                job.interval = MIN_INTERVAL
+            else:
+                job.interval = min(MAX_INTERVAL, job.interval * BACKOFF)
+            job.state = state
+            with self.condition:
+                self._schedule(job)
+
+    @staticmethod
+    def _finish(job):
+        if job.on_done:
+            try:
+                job.on_done(job)
+            except Exception:
+                logger.exception("Job on_done failed")
+        job.done.set()
+
+
+def poll_iteration(trainer, customvision_id):
+    """Poll until the project has an iteration, the result is the latest."""
+
+    def _poll():
+        iterations = trainer.get_iterations(customvision_id)
+        if len(iterations) > 0:
+            return True, iterations[0]
+        return False, None
+
+    return _poll
+
+
+def poll_training(trainer, customvision_id):
+    """Poll until the latest iteration is trained, the result is the
+    iteration, None if the project has no iteration.
+    """
+
+    def _poll():
+        iterations = trainer.get_iterations(customvision_id)
+        if len(iterations) == 0:
+            return True, None
+        iteration = iterations[0]
+        if iteration.exportable and iteration.status == "Completed":
+            return True, iteration
+        logger.info("Still training...")
+        return False, iteration.status
+
+    return _poll
+
+
+def poll_exports(project_obj, iteration_id):
+    """Poll until the ONNX and ONNXFloat16 exports of an iteration are
+    ready, the result is the list of exports. Missing exports are
+    requested.
+    """
+
+    def _poll():
+        try:
+            exports = project_obj.get_exports(iteration_id)
+        except Exception:
+            logger.exception("get_exports exception")
+            return False, None
+        if len(exports) >= 2 and exports[0].download_uri and exports[1].download_uri:
+            return True, exports
+        flavors = [export.flavor or "" for export in exports]
+        for flavor in ["", "ONNXFloat16"]:
+            if flavor in flavors:
+                continue
+            try:
+                project_obj.export_iteration(iteration_id, flavor=flavor)
+            except Exception:
+                logger.exception("Export already in queue")
+        logger.info("Status: exporting model")
+        return False, tuple(
+            (export.flavor, export.status, bool(export.download_uri))
+            for export in exports
+        )
+
+    return _poll
+
+
+JOB_TRACKER = JobTracker()
@@ -3,8 +3,6 @@
 
 import datetime
 import logging
-import threading
-import time
 
 import requests
 from azure.cognitiveservices.vision.customvision.training.models import (
@@ -28,6 +26,7 @@ from .exceptions import (
     ProjectTrainWithoutParts,
     ProjectWithoutSettingError,
 )
+from .job_tracker import JOB_TRACKER, poll_exports, poll_training
 
 logger = logging.getLogger(__name__)
 
@@ -350,70 +349,59 @@ class Task(models.Model):
     project = models.ForeignKey(Project, on_delete=models.CASCADE)
 
     def start_exporting(self):
-        """start_exporting."""
-
-        def _export_worker(self):
-            """Export Model Worker"""
-            project_obj = self.project
-            trainer = project_obj.setting.get_trainer_obj()
-            customvision_id = project_obj.customvision_id
-            while True:
-                time.sleep(1)
-                iterations = trainer.get_iterations(customvision_id)
-                if len(iterations) == 0:
-                    logger.error("failed: not yet trained")
-                    self.status = "running"
-                    self.log = "failed: not yet trained"
-                    self.save()
-                    return
-
-                iteration = iterations[0]
-                if not iteration.exportable or iteration.status != "Completed":
-                    self.status = "running"
-                    self.log = "Status : training model"
-                    self.save()
-                    continue
-                try:
-                    project_obj.export_iteration(iteration.id)
-                    project_obj.export_iteration(iteration.id, flavor="ONNXFloat16")
-                except Exception:
-                    logger.exception("Export already in queue")
-                exports = project_obj.get_exports(iteration.id)
-                if (
-                    len(exports) < 2
-                    or not exports[0].download_uri
-                    or not exports[1].download_uri
-                ):
-                    logger.info("Status: exporting model")
-                    self.status = "running"
-                    self.log = "Status : exporting model"
-                    self.save()
-                    continue
-
-                logger.info(
-                    "Successfully export model. download_uri: %s",
-                    exports[0].download_uri,
-                )
-                logger.info(
-                    "Successfully export model. download_uri: %s",
-                    exports[1].download_uri,
-                )
-                self.status = "ok"
-                self.log = "Status : work done"
-                self.save()
-                # Get the latest object
-                project_obj = Project.objects.get(pk=project_obj.id)
-                if not exports[0].flavor:
-                    project_obj.download_uri = exports[0].download_uri
-                    project_obj.download_uri_fp16 = exports[1].download_uri
-                else:
-                    project_obj.download_uri = exports[1].download_uri
-                    project_obj.download_uri_fp16 = exports[0].download_uri
-                project_obj.save()
-                break
-            return
+        """start_exporting.
 
-        threading.Thread(target=_export_worker, args=(self,), daemon=True).start()
+        Wait for the latest iteration to be trained, then export it. Both
+        are polled by the job tracker, the task is saved on each stage.
+        """
+        project_obj = self.project
+        trainer = project_obj.setting.get_trainer_obj()
+        customvision_id = project_obj.customvision_id
+
+        def _set_status(status, log):
+            self.status = status
+            self.log = log
+            self.save()
+
+        def _on_exported(job):
+            if job.error:
+                _set_status("failed", "failed: " + str(job.error))
+                return
+            exports = job.result
+            logger.info(
+                "Successfully export model. download_uri: %s",
+                exports[0].download_uri,
+            )
+            logger.info(
+                "Successfully export model. download_uri: %s",
+                exports[1].download_uri,
+            )
+            _set_status("ok", "Status : work done")
+            # Get the latest object
+            latest_project_obj = Project.objects.get(pk=project_obj.id)
+            if not exports[0].flavor:
+                latest_project_obj.download_uri = exports[0].download_uri
+                latest_project_obj.download_uri_fp16 = exports[1].download_uri
+            else:
+                latest_project_obj.download_uri = exports[1].download_uri
+                latest_project_obj.download_uri_fp16 = exports[0].download_uri
+            latest_project_obj.save()
+
+        def _on_trained(job):
+            iteration = job.result
+            if job.error or iteration is None:
+                logger.error("failed: not yet trained")
+                _set_status("running", "failed: not yet trained")
+                return
+            _set_status("running", "Status : exporting model")
+            JOB_TRACKER.add(
+                poll=poll_exports(project_obj, iteration.id), on_done=_on_exported
+            )
+
+        _set_status("running", "Status : training model")
+        JOB_TRACKER.add(
+            poll=poll_training(trainer, customvision_id), on_done=_on_trained
+        )
 
 
 pre_save.connect(Project.pre_save, Project, dispatch_uid="Project_pre")
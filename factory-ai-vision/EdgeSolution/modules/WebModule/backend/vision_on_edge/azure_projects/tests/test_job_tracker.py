@@ -0,0 +1,76 @@
+"""App job tracker tests.
+"""
+
+import threading
+
+import pytest
+
+from .. import job_tracker
+from ..job_tracker import JobTracker
+
+
+@pytest.fixture(autouse=True)
+def fast_intervals(monkeypatch):
+    """fast_intervals."""
+    monkeypatch.setattr(job_tracker, "MIN_INTERVAL", 0.01)
+    monkeypatch.setattr(job_tracker, "MAX_INTERVAL", 0.05)
+
+
+def test_wait_returns_result():
+    """test_wait_returns_result.
+
+    A job is polled until it is done, wait returns its result.
+    """
+    polls = []
+
+    def poll():
+        polls.append(1)
+        return len(polls) >= 3, "result" if len(polls) >= 3 else None
+
+    assert JobTracker().wait(poll=poll) == "result"
+    assert len(polls) == 3
+
+
+def test_wait_raises_poll_error():
+    """test_wait_raises_poll_error."""
+
+    def poll():
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        JobTracker().wait(poll=poll)
+
+
+def test_wait_timeout():
+    """test_wait_timeout."""
+    with pytest.raises(TimeoutError):
+        JobTracker().wait(poll=lambda: (False, None), timeout=0.1)
+
+
+def test_jobs_share_one_scheduler():
+    """test_jobs_share_one_scheduler.
+
+    Jobs are all polled from the tracker thread and call on_done.
+    """
+    tracker = JobTracker()
+    poll_threads = set()
+    done = []
+
+    def make_poll(n):
+        polls = []
+
+        def poll():
+            poll_threads.add(threading.current_thread().name)
+            polls.append(1)
+            return len(polls) >= n, n
+
+        return poll
+
+    jobs = [
+        tracker.add(poll=make_poll(n), on_done=lambda job: done.append(job.result))
+        for n in range(1, 5)
+    ]
+    assert [job.wait() for job in jobs] == [1, 2, 3, 4]
+    assert sorted(done) == [1, 2, 3, 4]
+    assert poll_threads == {"job_tracker"}
+    assert tracker.get_job_count() == 0
@@ -0,0 +1,78 @@
+"""App utilities tests.
+"""
+
+import json
+from unittest import mock
+
+import pytest
+
+from ...azure_settings.models import Setting
+from ...azure_training_status.models import TrainingStatus
+from .. import job_tracker, utils
+from ..models import Project
+from ..utils import train_project_worker
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def trainer(monkeypatch):
+    """trainer.
+
+    A Custom Vision project with one trained iteration.
+    """
+    iteration = mock.MagicMock(id="fake_iteration_id", exportable=True)
+    iteration.status = "Completed"
+    fake_trainer = mock.MagicMock()
+    fake_trainer.get_tags.return_value = []
+    fake_trainer.get_tagged_image_count.return_value = 0
+    fake_trainer.get_iterations.return_value = [iteration]
+    fake_trainer.get_iteration_performance.return_value.as_dict.return_value = {
+        "precision": 1.0
+    }
+    monkeypatch.setattr(
+        Setting, "get_trainer_obj", mock.MagicMock(return_value=fake_trainer)
+    )
+    monkeypatch.setattr(job_tracker, "MIN_INTERVAL", 0.01)
+    monkeypatch.setattr(job_tracker, "MAX_INTERVAL", 0.05)
+    monkeypatch.setattr(
+        utils, "batch_upload_parts_to_customvision", mock.MagicMock(return_value=True)
+    )
+    monkeypatch.setattr(
+        utils, "upload_images_to_customvision", mock.MagicMock(return_value=False)
+    )
+    monkeypatch.setattr(utils, "update_app_insight_counter", mock.MagicMock())
+    monkeypatch.setattr(Project, "train_project", mock.MagicMock(return_value=True))
+    monkeypatch.setattr(
+        Project,
+        "get_exports",
+        mock.MagicMock(
+            return_value=[
+                mock.MagicMock(flavor=None, download_uri="fake_uri"),
+                mock.MagicMock(flavor="ONNXFloat16", download_uri="fake_uri_fp16"),
+            ]
+        ),
+    )
+    return fake_trainer
+
+
+def test_train_project_worker(project, trainer):
+    """test_train_project_worker.
+
+    A training goes through export and saves the model and performance.
+    """
+    project.setting.is_trainer_valid = True
+    project.setting.save()
+    project.customvision_id = "fake_project_id"
+    project.save()
+    TrainingStatus.objects.create(project=project)
+
+    train_project_worker(project_id=project.id)
+
+    project = Project.objects.get(pk=project.id)
+    assert project.download_uri == "fake_uri"
+    assert project.download_uri_fp16 == "fake_uri_fp16"
+    assert project.training_counter == 1
+    training_status = TrainingStatus.objects.get(project=project)
+    assert training_status.status == "ok"
+    assert json.loads(training_status.performance) == [{"precision": 1.0}]
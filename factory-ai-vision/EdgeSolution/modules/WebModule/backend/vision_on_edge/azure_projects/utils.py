@@ -17,12 +17,16 @@ from ..azure_settings.exceptions import SettingCustomVisionAccessFailed
 from ..azure_training_status import progress
 from ..azure_training_status.utils import upcreate_training_status
 from ..images.models import Image
-from ..images.utils import upload_images_to_customvision_helper
+from ..images.utils import upload_images_to_customvision
 from .exceptions import ProjectAlreadyTraining, ProjectRemovedError
+from .job_tracker import JOB_TRACKER, poll_exports, poll_iteration, poll_training
 from .models import Project, Task
 
 logger = logging.getLogger(__name__)
 
+# Seconds to wait for Custom Vision to create the iteration of a training
+MAX_WAIT_PREPARE = 60
+
 
 def update_app_insight_counter(
     project_obj,
@@ -331,13 +335,11 @@ def train_project_worker(project_id):
     # =====================================================
     # 4. Upload images to Custom Vision Project         ===
     # =====================================================
-    for part_id in part_ids:
-        logger.info("Uploading images with part_id %s", part_id)
-        has_new_images = upload_images_to_customvision_helper(
-            project_id=project_obj.id, part_id=part_id
-        )
-        if has_new_images:
-            project_changed = True
+    has_new_images = upload_images_to_customvision(
+        project_id=project_obj.id, part_ids=part_ids
+    )
+    if has_new_images:
+        project_changed = True
 
     # =====================================================
     # 5. Submit Training Task to Custom Vision          ===
@@ -372,87 +374,47 @@ def train_project_worker(project_id):
     # =====================================================
     logger.info("Finding Iteration")
     customvision_id = project_obj.customvision_id
-    wait_prepare = 0
-    max_wait_prepare = 60
-    status_init = False
-    while True:
-        time.sleep(1)
-        wait_prepare += 1
-        iterations = trainer.get_iterations(customvision_id)
-        if not status_init:
-            upcreate_training_status(
-                project_id=project_obj.id,
-                need_to_send_notification=True,
-                **progress.PROGRESS_6_PREPARING_CUSTOM_VISION_ENV,
-            )
-            status_init = True
-        if len(iterations) > 0:
-            logger.info("Iteration Found %s", iterations[0])
-            break
-        if wait_prepare > max_wait_prepare:
-            logger.info("Something went wrong...")
-            upcreate_training_status(
-                project_id=project_obj.id,
-                status="failed",
-                log="Get iteration from Custom Vision occurs error.",
-                need_to_send_notification=True,
-            )
-            break
+    upcreate_training_status(
+        project_id=project_obj.id,
+        need_to_send_notification=True,
+        **progress.PROGRESS_6_PREPARING_CUSTOM_VISION_ENV,
+    )
+    try:
+        iteration = JOB_TRACKER.wait(
+            poll=poll_iteration(trainer, customvision_id),
+            timeout=MAX_WAIT_PREPARE,
+        )
+    except TimeoutError:
+        logger.info("Something went wrong...")
+        upcreate_training_status(
+            project_id=project_obj.id,
+            status="failed",
+            log="Get iteration from Custom Vision occurs error.",
+            need_to_send_notification=True,
+        )
+        return
+    logger.info("Iteration Found %s", iteration)
 
     # =====================================================
     # 6. Training (Waiting)                             ===
     # =====================================================
     logger.info("Training")
-    status_init = False
-    while True:
-        time.sleep(1)
-        iterations = trainer.get_iterations(customvision_id)
-        iteration = iterations[0]
-        if not status_init:
-            upcreate_training_status(
-                project_id=project_obj.id,
-                need_to_send_notification=True,
-                **progress.PROGRESS_7_TRAINING,
-            )
-            status_init = True
-        if iteration.exportable and iteration.status == "Completed":
-            break
-        logger.info("Still training...")
+    upcreate_training_status(
+        project_id=project_obj.id,
+        need_to_send_notification=True,
+        **progress.PROGRESS_7_TRAINING,
+    )
+    iteration = JOB_TRACKER.wait(poll=poll_training(trainer, customvision_id))
 
     # =====================================================
     # 7. Exporting                                      ===
     # =====================================================
-    status_init = False
-    while True:
-        time.sleep(1)
-        if not status_init:
-            upcreate_training_status(
-                project_id=project_obj.id,
-                need_to_send_notification=True,
-                **progress.PROGRESS_8_EXPORTING,
-            )
-            status_init = True
-        try:
-            project_obj.export_iteration(iteration.id)
-        except Exception:
-            logger.exception("Export already in queue")
-        try:
-            project_obj.export_iteration(iteration.id, flavor="ONNXFloat16")
-        except Exception:
-            logger.exception("Export already in queue")
-        try:
-            exports = project_obj.get_exports(iteration.id)
-        except:
-            logger.exception("get_exports exception")
-            continue
-        if (
-            len(exports) < 2
-            or not exports[0].download_uri
-            or not exports[1].download_uri
-        ):
-            logger.info("Status: exporting model")
-            continue
-        break
+    upcreate_training_status(
+        project_id=project_obj.id,
+        need_to_send_notification=True,
+        **progress.PROGRESS_8_EXPORTING,
+    )
+    exports = JOB_TRACKER.wait(poll=poll_exports(project_obj, iteration.id))
 
     # =====================================================
     # 8. Saving model and performance                   ===
@@ -460,7 +422,6 @@ def train_project_worker(project_id):
     logger.info("Successfully export model: %s", project_obj.download_uri)
     logger.info("Training about to completed.")
 
-    exports = trainer.get_exports(customvision_id, iteration.id)
     if not exports[0].flavor:
         project_obj.download_uri = exports[0].download_uri
         project_obj.download_uri_fp16 = exports[1].download_uri
@@ -470,6 +431,7 @@ def train_project_worker(project_id):
 
     train_performance_list = []
 
+    iterations = trainer.get_iterations(customvision_id)
     for iteration in iterations[:2]:
         train_performance_list.append(
             trainer.get_iteration_performance(customvision_id, iteration.id).as_dict()
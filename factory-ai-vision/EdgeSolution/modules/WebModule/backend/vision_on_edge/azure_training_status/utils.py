@@ -2,11 +2,17 @@
 """
 
 import logging
+import threading
 
 from .models import TrainingStatus
 
 logger = logging.getLogger(__name__)
 
+# Bumped on each update of a project training status, for waiters in
+# this process
+_status_versions = {}
+_status_condition = threading.Condition()
+
 
 def upcreate_training_status(
     project_id,
@@ -45,6 +51,35 @@ def upcreate_training_status(
     training_status_object.performance = performance
     training_status_object.need_to_send_notification = need_to_send_notification
     training_status_object.save()
+    with _status_condition:
+        _status_versions[project_id] = _status_versions.get(project_id, 0) + 1
+        _status_condition.notify_all()
+
+
+def get_training_status_version(project_id) -> int:
+    """get_training_status_version.
+
+    Read it before the training status, then pass it to
+    wait_training_status_update to not miss an update in between.
+    """
+    with _status_condition:
+        return _status_versions.get(project_id, 0)
+
+
+def wait_training_status_update(project_id, version: int, timeout: float = None) -> int:
+    """wait_training_status_update.
+
+    Block until upcreate_training_status updates the project past version,
+    or until timeout.
+
+    Returns:
+        int: the version now
+    """
+    with _status_condition:
+        _status_condition.wait_for(
+            lambda: _status_versions.get(project_id, 0) != version, timeout=timeout
+        )
+        return _status_versions.get(project_id, 0)
 
 
 # def training_status_failed(project_id,
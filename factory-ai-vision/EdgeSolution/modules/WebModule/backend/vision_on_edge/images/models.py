@@ -39,6 +39,14 @@ class Image(models.Model):
     remote_url = models.CharField(max_length=1000, null=True)
     timestamp = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["project", "part", "is_relabel", "timestamp"],
+                name="image_relabel_idx",
+            )
+        ]
+
     def get_remote_image(self):
         """get_remote_image.
 
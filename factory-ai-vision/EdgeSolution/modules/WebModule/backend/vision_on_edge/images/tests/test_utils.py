@@ -0,0 +1,129 @@
+"""App utilities tests.
+"""
+
+import json
+import threading
+from unittest import mock
+
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from ...azure_settings.models import Setting
+from ..models import Image
+from ..utils import upload_images_to_customvision
+
+pytestmark = pytest.mark.django_db
+
+with open("vision_on_edge/cameras/tests/test.png", "rb") as f:
+    PNG = f.read()
+
+
+class FakeTrainer:
+    """Fake Custom Vision trainer, records the size of each batch."""
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self.batch_sizes = []
+        self.image_count = 0
+
+    def create_images_from_files(self, project_id, batch):
+        """create_images_from_files."""
+        results = []
+        with self.mutex:
+            self.batch_sizes.append(len(batch.images))
+            for _ in batch.images:
+                self.image_count += 1
+                image = mock.MagicMock(
+                    id=f"cv-{self.image_count}",
+                    original_image_uri=f"https://fake/{self.image_count}",
+                )
+                results.append(mock.MagicMock(image=image, status="OK"))
+        return mock.MagicMock(is_batch_successful=True, images=results)
+
+
+@pytest.fixture
+def trainer(monkeypatch):
+    """trainer."""
+    fake_trainer = FakeTrainer()
+    monkeypatch.setattr(
+        Setting, "get_trainer_obj", mock.MagicMock(return_value=fake_trainer)
+    )
+    return fake_trainer
+
+
+def create_image(part, labels):
+    """create_image."""
+    return Image.objects.create(
+        part=part,
+        image=SimpleUploadedFile("test.png", PNG),
+        labels=json.dumps(labels),
+        manual_checked=True,
+    )
+
+
+def test_upload_images_in_batches(project, part, trainer):
+    """test_upload_images_in_batches.
+
+    Every checked image is uploaded in batches of at most batch_size, and
+    gets the id Custom Vision gave it.
+    """
+    part.project = project
+    part.customvision_id = "fake_tag_id"
+    part.save()
+    for _ in range(7):
+        create_image(part, [{"x1": 1, "y1": 1, "x2": 10, "y2": 10}])
+
+    assert upload_images_to_customvision(
+        project_id=project.id, part_ids=[part.id], batch_size=3, max_workers=2
+    )
+
+    assert sorted(trainer.batch_sizes) == [1, 3, 3]
+    assert Image.objects.filter(uploaded=True).count() == 7
+    assert Image.objects.filter(customvision_id__startswith="cv-").count() == 7
+
+
+def test_upload_images_skip_unlabeled(project, part, trainer):
+    """test_upload_images_skip_unlabeled.
+
+    Images without labels are not uploaded.
+    """
+    part.project = project
+    part.customvision_id = "fake_tag_id"
+    part.save()
+    create_image(part, [])
+    create_image(part, [{"x1": 1, "y1": 1, "x2": 10, "y2": 10}])
+
+    upload_images_to_customvision(project_id=project.id, part_ids=[part.id])
+
+    assert trainer.batch_sizes == [1]
+    assert Image.objects.filter(uploaded=True).count() == 1
+
+
+def test_upload_images_raise_failed_batch(project, part, trainer, monkeypatch):
+    """test_upload_images_raise_failed_batch.
+
+    A failed batch is raised once the other batches are uploaded and saved.
+    """
+    part.project = project
+    part.customvision_id = "fake_tag_id"
+    part.save()
+    for _ in range(3):
+        create_image(part, [{"x1": 1, "y1": 1, "x2": 10, "y2": 10}])
+    create_images_from_files = trainer.create_images_from_files
+
+    def fail_first_batch(project_id, batch):
+        with trainer.mutex:
+            is_first = not trainer.batch_sizes
+            trainer.batch_sizes.append(0)
+        if is_first:
+            raise ConnectionError("fake upload error")
+        return create_images_from_files(project_id, batch)
+
+    monkeypatch.setattr(trainer, "create_images_from_files", fail_first_batch)
+
+    with pytest.raises(ConnectionError):
+        upload_images_to_customvision(
+            project_id=project.id, part_ids=[part.id], batch_size=1, max_workers=1
+        )
+
+    assert Image.objects.filter(uploaded=True).count() == 2
@@ -4,6 +4,7 @@
 import datetime
 import json
 import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from azure.cognitiveservices.vision.customvision.training.models import (
     ImageFileCreateBatch,
@@ -11,122 +12,194 @@ from azure.cognitiveservices.vision.customvision.training.models import (
     Region,
 )
 
-from vision_on_edge.azure_parts.models import Part
 from vision_on_edge.azure_projects.models import Project
 
 from .models import Image
 
 logger = logging.getLogger(__name__)
 
+# Most images Custom Vision takes in one create_images_from_files call
+UPLOAD_BATCH_SIZE = 64
+# Batches uploaded at the same time
+UPLOAD_WORKERS = 4
+
+
+def _get_regions(image_obj, tag_id):
+    """Custom Vision regions of the labels of an image, in 0-1 coordinates."""
+    regions = []
+    width = image_obj.image.width
+    height = image_obj.image.height
+    for label in json.loads(image_obj.labels):
+        regions.append(
+            Region(
+                tag_id=tag_id,
+                left=label["x1"] / width,
+                top=label["y1"] / height,
+                width=(label["x2"] - label["x1"]) / width,
+                height=(label["y2"] - label["y1"]) / height,
+            )
+        )
+    return regions
 
-def upload_images_to_customvision_helper(
-    project_id, part_id, batch_size: int = 10
-) -> bool:
-    """upload_images_to_customvision_helper.
 
-    Helper function for uploading images to Custom Vision.
-    Make sure part already upload to Custom Vision (
-    customvision_id not null or blank).
+def _upload_image_batch(trainer, customvision_project_id, image_objs):
+    """Read a batch of images and create them on Custom Vision.
 
-    Args:
-        project_id:
-        part_id:
-        batch_size (int): batch_size
+    Runs in an upload worker, so no database access here.
 
     Returns:
-        bool:
+        list: the image objects uploaded, with their customvision_id set.
     """
-
-    logger.info("Uploading images with part_id %s", part_id)
-
-    has_new_images = False
-    project_obj = Project.objects.get(pk=project_id)
-    trainer = project_obj.setting.get_trainer_obj()
-    part_obj: Part = Part.objects.get(pk=part_id)
-    tag_id = part_obj.customvision_id
-    images = Image.objects.filter(part_id=part_id, manual_checked=True, uploaded=False)
-    logger.info("Tag id %s", tag_id)
-    count = 0
     img_entries = []
     img_objs = []
+    for image_obj in image_objs:
+        try:
+            regions = _get_regions(image_obj, image_obj.part.customvision_id)
+            if len(regions) == 0:
+                continue
+            with image_obj.image.open("rb") as image:
+                contents = image.read()
+        except Exception:
+            logger.exception("unexpected error")
+            continue
+        img_entries.append(
+            ImageFileCreateEntry(
+                name="img-" + datetime.datetime.utcnow().isoformat(),
+                contents=contents,
+                regions=regions,
+            )
+        )
+        img_objs.append(image_obj)
+    if not img_entries:
+        return []
+
+    logger.info("Uploading %s images", len(img_entries))
+    upload_result = trainer.create_images_from_files(
+        project_id=customvision_project_id,
+        batch=ImageFileCreateBatch(images=img_entries),
+    )
+    logger.info(
+        "Uploading images... Is batch success: %s", upload_result.is_batch_successful
+    )
+    uploaded = []
+    for img_obj, result in zip(img_objs, upload_result.images):
+        if result.image is None:
+            logger.error("Image %s not uploaded: %s", img_obj.id, result.status)
+            continue
+        img_obj.customvision_id = result.image.id
+        img_obj.remote_url = result.image.original_image_uri
+        img_obj.uploaded = True
+        uploaded.append(img_obj)
+    return uploaded
+
+
+def upload_images_to_customvision(
+    project_id,
+    part_ids,
+    batch_size: int = UPLOAD_BATCH_SIZE,
+    max_workers: int = UPLOAD_WORKERS,
+) -> bool:
+    """upload_images_to_customvision.
 
-    logger.info("Image length: %s", len(images))
+    Upload the checked images of parts that are not on Custom Vision yet.
+    Images are read from disk batch by batch and up to max_workers batches
+    are uploaded at the same time, so only that many batches are in memory.
+    Make sure parts already upload to Custom Vision (customvision_id not
+    null or blank).
 
-    for index, image_obj in enumerate(images):
-        logger.info("*** image %s, %s", index + 1, image_obj)
-        has_new_images = True
+    Args:
+        project_id: Django ORM project id
+        part_ids: Django ORM part ids
+        batch_size (int): images per Custom Vision call
+        max_workers (int): batches uploaded at the same time
 
-        img_name = "img-" + datetime.datetime.utcnow().isoformat()
+    Returns:
+        bool: whether there were images to upload
 
-        regions = []
-        width = image_obj.image.width
-        height = image_obj.image.height
-        try:
-            labels = json.loads(image_obj.labels)
-            if len(labels) == 0:
-                continue
-            for label in labels:
-                label_x = label["x1"] / width
-                label_y = label["y1"] / height
-                label_w = (label["x2"] - label["x1"]) / width
-                label_h = (label["y2"] - label["y1"]) / height
-                region = Region(
-                    tag_id=tag_id,
-                    left=label_x,
-                    top=label_y,
-                    width=label_w,
-                    height=label_h,
-                )
-                regions.append(region)
+    Raises:
+        the error of the first failed batch, after the other batches are
+        done and saved.
+    """
+    logger.info("Uploading images with part_ids %s", part_ids)
 
-            image = image_obj.image
-            image.open()
-            img_entry = ImageFileCreateEntry(
-                name=img_name, contents=image.read(), regions=regions
+    project_obj = Project.objects.get(pk=project_id)
+    trainer = project_obj.setting.get_trainer_obj()
+    customvision_project_id = project_obj.customvision_id
+    # only the ids up front, the images are loaded batch by batch
+    image_ids = list(
+        Image.objects.filter(
+            part_id__in=part_ids, manual_checked=True, uploaded=False
+        ).values_list("id", flat=True)
+    )
+    logger.info("Image length: %s", len(image_ids))
+
+    has_new_images = len(image_ids) > 0
+    count = 0
+    # raised once every batch is done, a partial upload must not be trained
+    errors = []
+
+    def save(futures):
+        nonlocal count
+        for future in futures:
+            try:
+                uploaded = future.result()
+            except Exception as err:
+                logger.exception("Uploading images failed")
+                errors.append(err)
+                continue
+            Image.objects.bulk_update(
+                uploaded, ["customvision_id", "remote_url", "uploaded"]
             )
-            img_objs.append(image_obj)
-            img_entries.append(img_entry)
-            count += 1
-        except:
-            logger.exception("unexpected error")
-
-        if len(img_entries) >= batch_size:
-            logger.info("Uploading %s images", len(img_entries))
-            upload_result = trainer.create_images_from_files(
-                project_id=project_obj.customvision_id,
-                batch=ImageFileCreateBatch(images=img_entries),
+            count += len(uploaded)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for start in range(0, len(image_ids), batch_size):
+            if len(pending) >= max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                save(done)
+            batch = list(
+                Image.objects.filter(
+                    id__in=image_ids[start : start + batch_size]
+                ).select_related("part")
             )
-            logger.info(
-                "Uploading images... Is batch success: %s",
-                upload_result.is_batch_successful,
+            pending.add(
+                executor.submit(
+                    _upload_image_batch, trainer, customvision_project_id, batch
+                )
             )
-            img_entries = []
-            for i, img_obj in enumerate(img_objs):
-                img_obj.customvision_id = upload_result.images[i].image.id
-                img_obj.uploaded = True
-                img_obj.save()
-            img_objs = []
-
-    if len(img_entries) >= 1:
-        logger.info("Uploading %s images", len(img_entries))
-        upload_result = trainer.create_images_from_files(
-            project_id=project_obj.customvision_id,
-            batch=ImageFileCreateBatch(images=img_entries),
-        )
-        logger.info(
-            "Uploading images... Is batch success: %s",
-            upload_result.is_batch_successful,
-        )
-        for i, img_obj in enumerate(img_objs):
-            img_obj.customvision_id = upload_result.images[i].image.id
-            img_obj.remote_url = upload_result.images[i].image.original_image_uri
-            img_obj.uploaded = True
-            img_obj.save()
-    logger.info("Uploading images... Done")
+        save(pending)
+
+    if errors:
+        logger.error("%s image batches failed, %s uploaded", len(errors), count)
+        raise errors[0]
+    logger.info("Uploading images... Done, %s uploaded", count)
     logger.info("Has new images: %s", has_new_images)
     return has_new_images
 
 
+def upload_images_to_customvision_helper(
+    project_id, part_id, batch_size: int = UPLOAD_BATCH_SIZE
+) -> bool:
+    """upload_images_to_customvision_helper.
+
+    Helper function for uploading images of a part to Custom Vision.
+    Make sure part already upload to Custom Vision (
+    customvision_id not null or blank).
+
+    Args:
+        project_id:
+        part_id:
+        batch_size (int): batch_size
+
+    Returns:
+        bool:
+    """
+    return upload_images_to_customvision(
+        project_id=project_id, part_ids=[part_id], batch_size=batch_size
+    )
+
+
 def upload_and_sync_images(part_id):
     """upload_and_sync_images.
 
@@ -6,6 +6,8 @@ import logging
 import requests
 from django.db import models
 
+from .status_cache import STATUS_CACHE
+
 logger = logging.getLogger(__name__)
 
 
@@ -28,21 +30,26 @@ class InferenceModule(models.Model):
             result = 10.0
         return result
 
-    def device(self) -> bool:
+    def device(self) -> str:
         try:
-            response = requests.get("http://" + self.url + "/get_device", timeout=1)
-            result = response.json()["device"]
-            return result
+            return STATUS_CACHE.get("http://" + self.url + "/get_device", timeout=1)[
+                "device"
+            ]
         except:
             return "cpu"
 
     def is_vpu(self) -> bool:
-        try:
-            response = requests.get("http://" + self.url + "/get_device")
-            result = response.json()["device"]
-            return result == "vpu"
-        except Exception:
-            return False
+        return self.device() == "vpu"
+
+    def metrics(self, cam_id) -> dict:
+        """metrics of a camera, from the status cache.
+
+        Raises:
+            requests exceptions if the inference module can't be reached.
+        """
+        return STATUS_CACHE.get(
+            "http://" + self.url + "/metrics", params={"cam_id": cam_id}, timeout=3
+        )
 
     def __str__(self):
         return self.name
@@ -0,0 +1,142 @@
+"""App status cache.
+
+Every open dashboard polls the export API, which reads /metrics and
+/get_device of the inference module. A poller thread fetches each of them
+once per POLL_INTERVAL instead, for as long as someone reads it, and the
+API reads the cache. Readers of an entry that isn't fresh share one
+request, and the last value is served for STALE_TIMEOUT while the
+inference module can't be reached.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 2
+CACHE_TTL = 5
+STALE_TIMEOUT = 60
+# Entries nobody read for IDLE_TIMEOUT are not polled anymore
+IDLE_TIMEOUT = 30
+POLL_WORKERS = 4
+
+
+class _Entry:
+    def __init__(self, url, params, timeout):
+        self.url = url
+        self.params = params
+        self.timeout = timeout
+        self.value = None
+        self.error = None
+        self.fetched_at = 0
+        self.polled_at = 0
+        self.last_read = time.time()
+        # set once the fetch in flight is done, None if there is none
+        self.fetching = None
+
+
+class StatusCache:
+    """StatusCache."""
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        # (url, params): _Entry
+        self.entries = {}
+        self.worker = None
+
+    def get(self, url, params=None, timeout=3):
+        """GET url and return its JSON, from the cache if fresh.
+
+        Raises:
+            the requests exception of the last fetch, if there is no value
+            younger than STALE_TIMEOUT.
+        """
+        key = (url, tuple(sorted((params or {}).items())))
+        now = time.time()
+        with self.mutex:
+            if self.worker is None:
+                self.worker = threading.Thread(
+                    target=self._run, name="status_cache", daemon=True
+                )
+                self.worker.start()
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = _Entry(url, params, timeout)
+            entry.last_read = now
+            if entry.fetched_at + CACHE_TTL > now:
+                return entry.value
+            event = entry.fetching
+            is_fetcher = event is None
+            if is_fetcher:
+                event = entry.fetching = threading.Event()
+        if is_fetcher:
+            self._fetch(entry)
+        else:
+            event.wait()
+        with self.mutex:
+            if entry.fetched_at + STALE_TIMEOUT > time.time():
+                return entry.value
+            raise entry.error
+
+    def get_entry_count(self) -> int:
+        """Entries polled."""
+        with self.mutex:
+            return len(self.entries)
+
+    def _fetch(self, entry):
+        try:
+            response = requests.get(
+                entry.url, params=entry.params, timeout=entry.timeout
+            )
+            value, error = response.json(), None
+        except Exception as err:
+            logger.warning("Get %s failed: %s", entry.url, err)
+            value, error = None, err
+        with self.mutex:
+            entry.polled_at = time.time()
+            entry.error = error
+            if error is None:
+                entry.value = value
+                entry.fetched_at = entry.polled_at
+            event = entry.fetching
+            entry.fetching = None
+        event.set()
+
+    def _run(self):
+        executor = ThreadPoolExecutor(max_workers=POLL_WORKERS)
+        while True:
+            time.sleep(POLL_INTERVAL)
+            now = time.time()
+            due = []
+            with self.mutex:
+                for key, entry in list(self.entries.items()):
+                    if entry.last_read + IDLE_TIMEOUT < now:
+                        if entry.fetching is None:
+                            del self.entries[key]
+                        continue
+                    # a reader may just have fetched it
+                    if (
+                        entry.fetching is None
+                        and entry.polled_at + POLL_INTERVAL / 2 <= now
+                    ):
+                        entry.fetching = threading.Event()
+                        due.append(entry)
+            try:
+                list(executor.map(self._fetch, due))
+            except RuntimeError:
+                # the interpreter is shutting down, no new futures
+                logger.info("Status cache poller stopped")
+                with self.mutex:
+                    events = [entry.fetching for entry in due if entry.fetching]
+                    for entry in due:
+                        entry.fetching = None
+                for event in events:
+                    event.set()
+                return
+
+
+STATUS_CACHE = StatusCache()
@@ -0,0 +1,65 @@
+"""App status cache tests.
+"""
+
+import threading
+import time
+from unittest import mock
+
+import pytest
+import requests
+
+from .. import status_cache
+from ..status_cache import StatusCache
+
+URL = "http://inference/metrics"
+
+
+@pytest.fixture
+def mock_get(monkeypatch):
+    """mock_get."""
+    get = mock.MagicMock()
+    monkeypatch.setattr(status_cache.requests, "get", get)
+    return get
+
+
+def slow_response(*args, **kwargs):
+    """slow_response."""
+    time.sleep(0.2)
+    return mock.MagicMock(json=mock.MagicMock(return_value={"device": "cpu"}))
+
+
+def test_concurrent_misses_share_one_request(mock_get):
+    """test_concurrent_misses_share_one_request."""
+    mock_get.side_effect = slow_response
+    cache = StatusCache()
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get(URL)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [{"device": "cpu"}] * 5
+    assert mock_get.call_count == 1
+    assert cache.get(URL) == {"device": "cpu"}
+    assert mock_get.call_count == 1
+
+
+def test_serve_stale_when_unreachable(mock_get, monkeypatch):
+    """test_serve_stale_when_unreachable.
+
+    The last value is served until it is older than STALE_TIMEOUT.
+    """
+    monkeypatch.setattr(status_cache, "CACHE_TTL", 0)
+    monkeypatch.setattr(status_cache, "STALE_TIMEOUT", 0.2)
+    mock_get.return_value.json.return_value = {"inference_num": 1}
+    cache = StatusCache()
+    assert cache.get(URL, params={"cam_id": "1"}) == {"inference_num": 1}
+
+    mock_get.side_effect = requests.exceptions.ConnectionError
+    assert cache.get(URL, params={"cam_id": "1"}) == {"inference_num": 1}
+    time.sleep(0.3)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        cache.get(URL, params={"cam_id": "1"})
@@ -1,6 +1,7 @@
 """App models.
 """
 
+import atexit
 import logging
 import threading
 import time
@@ -9,7 +10,7 @@ import cv2
 
 from configs.general_configs import PRINT_THREAD
 
-from ..cameras.utils import normalize_rtsp, verify_rtsp
+from ..cameras.utils import normalize_rtsp
 from .exceptions import StreamOpenRTSPError
 
 logger = logging.getLogger(__name__)
@@ -17,14 +18,207 @@ logger = logging.getLogger(__name__)
 # Stream
 KEEP_ALIVE_THRESHOLD = 10  # Seconds
 
+# Preview Hub
+PREVIEW_IDLE_TIMEOUT = 10  # Seconds
+
 # Stream Manager
 STREAM_GC_TIME_THRESHOLD = 5  # Seconds
 
 
+class RtspDecoder:
+    """RtspDecoder.
+
+    Decodes one rtsp for every Stream watching it. Keeps the latest frame,
+    resized for the preview, and encodes it to JPEG once, the first time
+    a Stream asks for it.
+    """
+
+    def __init__(self, rtsp):
+        self.rtsp = rtsp
+        self.ref_count = 0
+        self.idle_since = time.time()
+        self.status = "opening"
+        # set once open is done, whether it succeeded or not
+        self.opened = threading.Event()
+
+        self.condition = threading.Condition()
+        self.encode_mutex = threading.Lock()
+        self.frame_index = 0
+        self.frame = None
+        self.jpeg = None
+        self.cap = None
+
+    def open(self) -> bool:
+        """Open the rtsp and read the first frame, may take a while."""
+        try:
+            self.cap = cv2.VideoCapture(self.rtsp)
+            has_img, img = self.cap.read() if self.cap.isOpened() else (False, None)
+            if has_img:
+                self._set_frame(img)
+            else:
+                self.cap.release()
+        except Exception:
+            logger.exception("Cannot open %s", self.rtsp)
+            has_img = False
+        self.status = "running" if has_img else "failed"
+        self.opened.set()
+        return has_img
+
+    def _set_frame(self, img):
+        img = cv2.resize(img, None, fx=0.5, fy=0.5)
+        with self.condition:
+            self.frame = img
+            self.jpeg = None
+            self.frame_index = (self.frame_index + 1) % 10000
+            self.condition.notify_all()
+
+    def get_jpeg(self, last_index=None, timeout=None):
+        """get_jpeg.
+
+        Args:
+            last_index: the index of the frame the caller already has,
+                wait for another one.
+            timeout: seconds to wait for it.
+
+        Returns:
+            (frame index, JPEG bytes), the same frame again on timeout.
+        """
+        with self.condition:
+            if last_index is not None:
+                self.condition.wait_for(
+                    lambda: self.frame_index != last_index or self.status != "running",
+                    timeout=timeout,
+                )
+            frame_index, frame, jpeg = self.frame_index, self.frame, self.jpeg
+        if jpeg is not None:
+            return frame_index, jpeg
+        with self.encode_mutex:
+            with self.condition:
+                if self.frame_index == frame_index and self.jpeg is not None:
+                    return frame_index, self.jpeg
+            jpeg = cv2.imencode(".jpg", frame)[1].tobytes()
+            with self.condition:
+                if self.frame_index == frame_index:
+                    self.jpeg = jpeg
+        return frame_index, jpeg
+
+    def run(self, should_stop):
+        """Decode until should_stop() returns True."""
+        logger.info("start decoding %s", self.rtsp)
+        while not should_stop(self):
+            has_img, img = self.cap.read()
+            if not has_img:
+                self.cap.release()
+                time.sleep(1)
+                self.cap = cv2.VideoCapture(self.rtsp)
+                continue
+            self._set_frame(img)
+        logger.info("%s releasing cap...", self)
+        with self.condition:
+            self.status = "stopped"
+            self.condition.notify_all()
+        self.cap.release()
+
+    def __repr__(self):
+        return f"<RtspDecoder rtsp:{self.rtsp} refs:{self.ref_count}>"
+
+
+class PreviewHub:
+    """PreviewHub.
+
+    Shares one RtspDecoder per rtsp between all the Streams. A decoder
+    nobody uses for PREVIEW_IDLE_TIMEOUT is stopped.
+    """
+
+    def __init__(self):
+        self.decoders = {}
+        self.mutex = threading.Lock()
+        self.threads = []
+        self.is_closing = False
+        # decoder threads still in cv2 at interpreter shutdown abort it
+        atexit.register(self.close)
+
+    def acquire(self, rtsp) -> RtspDecoder:
+        """Get the decoder of rtsp, opening it if needed.
+
+        Raises:
+            StreamOpenRTSPError: the rtsp can't be opened.
+        """
+        # the decoder is registered before it is opened, opening can take
+        # long and must not hold the other streams
+        with self.mutex:
+            decoder = self.decoders.get(rtsp)
+            is_opener = decoder is None
+            if is_opener:
+                decoder = RtspDecoder(rtsp)
+                self.decoders[rtsp] = decoder
+            decoder.ref_count += 1
+
+        if is_opener:
+            if decoder.open():
+                thread = threading.Thread(
+                    target=decoder.run, args=(self._should_stop,), daemon=True
+                )
+                with self.mutex:
+                    self.threads = [t for t in self.threads if t.is_alive()]
+                    self.threads.append(thread)
+                thread.start()
+        else:
+            decoder.opened.wait()
+
+        if decoder.status == "failed":
+            with self.mutex:
+                decoder.ref_count -= 1
+                if self.decoders.get(rtsp) is decoder:
+                    del self.decoders[rtsp]
+            raise StreamOpenRTSPError
+        return decoder
+
+    def release(self, decoder: RtspDecoder):
+        """Release a decoder from acquire."""
+        with self.mutex:
+            decoder.ref_count -= 1
+            if decoder.ref_count == 0:
+                decoder.idle_since = time.time()
+
+    def close(self, timeout: float = 2):
+        """Stop all the decoders and wait for them."""
+        with self.mutex:
+            self.is_closing = True
+            threads = list(self.threads)
+        for thread in threads:
+            thread.join(timeout=timeout)
+
+    def _should_stop(self, decoder: RtspDecoder) -> bool:
+        with self.mutex:
+            if self.is_closing:
+                return True
+            if (
+                decoder.ref_count > 0
+                or decoder.idle_since + PREVIEW_IDLE_TIMEOUT > time.time()
+            ):
+                return False
+            if self.decoders.get(decoder.rtsp) is decoder:
+                del self.decoders[decoder.rtsp]
+            return True
+
+    def get_decoder_count(self) -> int:
+        """Decoders running."""
+        with self.mutex:
+            return len(self.decoders)
+
+
+PREVIEW_HUB = PreviewHub()
+
+
 class Stream:
-    """Stream Class"""
+    """Stream Class
+
+    A viewer of a rtsp, the frames come from the decoder shared through
+    the PreviewHub.
+    """
 
-    def __init__(self, rtsp, camera_id, part_id=None):
+    def __init__(self, rtsp, camera_id, part_id=None, hub=None):
         self.rtsp = normalize_rtsp(rtsp=rtsp)
         self.camera_id = camera_id
         self.part_id = part_id
@@ -37,11 +231,9 @@ class Stream:
 
         self.mutex = threading.Lock()
 
-        # test rtsp
-        if not verify_rtsp(self.rtsp):
-            raise StreamOpenRTSPError
-        self.cap = cv2.VideoCapture(self.rtsp)
-        self.last_img = self.cap.read()[1]
+        self.hub = hub or PREVIEW_HUB
+        self.decoder = self.hub.acquire(self.rtsp)
+        self.frame_index, self.last_jpeg = self.decoder.get_jpeg()
 
     def update_keep_alive(self):
         """update_keep_alive."""
@@ -49,38 +241,28 @@ class Stream:
 
     def gen(self):
         """generator for stream."""
+        if self.status == "stopped":
+            return
         self.status = "running"
 
         logger.info("start streaming with %s", self.rtsp)
         while self.status == "running" and (
             self.last_active + KEEP_ALIVE_THRESHOLD > time.time()
         ):
-            if not self.cap.isOpened():
-                raise StreamOpenRTSPError
-            has_img, img = self.cap.read()
-            # Need to add the video flag FIXME
-            if not has_img:
-                self.cap = cv2.VideoCapture(self.rtsp)
-                time.sleep(1)
+            frame_index, jpeg = self.decoder.get_jpeg(self.frame_index, timeout=1)
+            if frame_index == self.frame_index:
                 continue
 
-            img = cv2.resize(img, None, fx=0.5, fy=0.5)
+            self.frame_index = frame_index
             self.last_active = time.time()
-            self.last_img = img.copy()
+            self.last_jpeg = jpeg
             self.cur_img_index = (self.cur_img_index + 1) % 10000
-            yield (
-                b"--frame\r\n"
-                b"Content-Type: image/jpeg\r\n\r\n"
-                + cv2.imencode(".jpg", img)[1].tobytes()
-                + b"\r\n"
-            )
-        logger.info("%s releasing self...", self)
-        self.cap.release()
+            yield (b"--frame\r\n" b"Content-Type: image/jpeg\r\n\r\n" + jpeg + b"\r\n")
+        logger.info("%s stop streaming", self)
 
     def get_frame(self):
         """get_frame."""
         logger.info("get frame %s", self)
-        # b, img = self.cap.read()
         time_begin = time.time()
         while True:
             if time.time() - time_begin > 5:
@@ -90,22 +272,19 @@ class Stream:
             else:
                 break
         self.last_get_img_index = self.cur_img_index
-        img = self.last_img.copy()
-        # if b: return cv2.imencode('.jpg', img)[1].tobytes()
-        # else : return None
-        return cv2.imencode(".jpg", img)[1].tobytes()
+        return self.last_jpeg
 
     def close(self):
         """close.
 
         close the stream.
         """
-        self.status = "stopped"
-        try:
-            self.cap.release()
-            logger.info("Release cap success.")
-        except:
-            logger.error("Release cap failed.")
+        with self.mutex:
+            if self.status == "stopped":
+                return
+            self.status = "stopped"
+        self.hub.release(self.decoder)
+        logger.info("Release decoder success.")
 
     def __str__(self):
         return f"<Stream id:{self.id} rtsp:{self.rtsp}>"
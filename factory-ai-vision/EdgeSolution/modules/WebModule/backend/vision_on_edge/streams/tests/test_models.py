@@ -3,12 +3,14 @@
 # pylint: disable=W0613
 # skip unused-argument mock_cv2_capture
 
+import threading
 import time
 
 import pytest
 
 from ...cameras.tests.factories import CameraFactory
-from ..models import Stream
+from .. import models
+from ..models import PreviewHub, Stream
 
 pytestmark = pytest.mark.django_db
 
@@ -150,3 +152,68 @@ def test_method_stop(camera):
     assert stream_obj.status == "running"
     stream_obj.close()
     assert stream_obj.status == "stopped"
+
+
+@pytest.mark.fast
+def test_streams_share_decoder(camera):
+    """test_streams_share_decoder.
+
+    Streams of the same rtsp share one decoder, opened once.
+    """
+    hub = PreviewHub()
+    stream_1 = Stream(rtsp=camera.rtsp, camera_id=camera.id, hub=hub)
+    stream_2 = Stream(rtsp=camera.rtsp, camera_id=camera.id, hub=hub)
+    assert stream_1.decoder is stream_2.decoder
+    assert stream_1.decoder.ref_count == 2
+    assert hub.get_decoder_count() == 1
+    next(stream_1.gen())
+    next(stream_2.gen())
+    assert stream_1.get_frame() == stream_1.last_jpeg
+
+
+@pytest.mark.fast
+def test_decoder_idle_shutdown(camera, monkeypatch):
+    """test_decoder_idle_shutdown.
+
+    A decoder is stopped once no stream uses it.
+    """
+    monkeypatch.setattr(models, "PREVIEW_IDLE_TIMEOUT", 0.1)
+    hub = PreviewHub()
+    stream_obj = Stream(rtsp=camera.rtsp, camera_id=camera.id, hub=hub)
+    stream_obj.close()
+    stream_obj.close()
+    assert stream_obj.decoder.ref_count == 0
+    time.sleep(0.5)
+    assert hub.get_decoder_count() == 0
+    assert stream_obj.decoder.status == "stopped"
+
+
+@pytest.mark.fast
+def test_slow_rtsp_not_block_others(camera, monkeypatch):
+    """test_slow_rtsp_not_block_others.
+
+    A rtsp still opening doesn't hold the streams of the other ones.
+    """
+    slow_rtsp = "rtsp://slow"
+    release_slow = threading.Event()
+    open_decoder = models.RtspDecoder.open
+
+    def slow_open(decoder):
+        if decoder.rtsp == slow_rtsp:
+            release_slow.wait(timeout=5)
+        return open_decoder(decoder)
+
+    monkeypatch.setattr(models.RtspDecoder, "open", slow_open)
+    hub = PreviewHub()
+    slow_thread = threading.Thread(target=hub.acquire, args=(slow_rtsp,))
+    slow_thread.start()
+    time.sleep(0.1)
+
+    start = time.time()
+    stream_obj = Stream(rtsp=camera.rtsp, camera_id=camera.id, hub=hub)
+    assert time.time() - start < 1
+    assert release_slow.is_set() is False
+    release_slow.set()
+    slow_thread.join()
+    assert hub.get_decoder_count() == 2
+    stream_obj.close()